@@ -1,6 +1,7 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Any, Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, Optional
 import html
 import logging
 import httpx
@@ -32,17 +33,24 @@ except ImportError:
     pass  # dotenv es opcional
 
 try:
-    from src.agents.agents_factory import run_agent_flow
+    from src.agents.agents_factory import run_agent_flow, run_agent_flow_async, run_agent_flow_stream
 except ImportError as e:
     logger.warning(f"Error importando agents_factory: {e}")
     run_agent_flow = None
+    run_agent_flow_async = None
+    run_agent_flow_stream = None
+
+from api.streaming import SSE_HEADERS, sse_event, stream_agent_sse
 
 try:
     from src.prediction_session import (
         get_or_create_session,
         get_session,
+        create_session,
+        validate_submission,
         get_next_question,
         process_answer,
+        save_session,
         calculate_bmi,
         is_session_complete,
         VARIABLE_QUESTIONS
@@ -53,11 +61,26 @@ except ImportError as e:
     logger.error(f"Error importando módulos de predicción: {e}")
     get_or_create_session = None
     get_session = None
+    validate_submission = None
     predict_diabetes_risk = None
     get_risk_interpretation = None
 
 router = APIRouter()
 
+# /api/pdf/create espera hasta PDF_RENDER_TIMEOUT; el cliente aguanta algo más para
+# recibir su respuesta (incluido el 504 con el ID del trabajo) en vez de cortar antes
+PDF_CLIENT_TIMEOUT = float(os.getenv('PDF_RENDER_TIMEOUT', '60')) + 5.0
+PDF_SUBMIT_TIMEOUT = 10.0
+
+# Servicio de PDFs del mismo proceso: `service(payload, base_url, wait)`. app/main.py
+# lo registra al montar el router; sin él se usa la API HTTP en PDF_SERVICE_URL.
+_pdf_service: Optional[Callable[[Dict[str, Any], str, bool], Awaitable[Dict[str, Any]]]] = None
+
+
+def set_pdf_service(service) -> None:
+    global _pdf_service
+    _pdf_service = service
+
 class CoachRequest(BaseModel):
     query: str
     session_id: Optional[str] = None
@@ -73,16 +96,21 @@ class CoachResponse(BaseModel):
     is_question: bool = False  # Indica si es una pregunta de evaluación
     question_progress: Optional[str] = None  # Progreso de preguntas (ej: "3/12")
 
-@router.post("/", response_model=CoachResponse)
-async def coach_endpoint(request: CoachRequest):
-    """
-    Endpoint principal del coach que maneja:
-    1. Conversación normal con el agente
-    2. Inicio de evaluación de riesgo
-    3. Recopilación de variables para predicción
-    4. Predicción y recomendaciones personalizadas
-    """
-    
+class AssessmentRequest(BaseModel):
+    # {variable: respuesta} con las variables de VARIABLE_QUESTIONS; texto ("Sí", "70 kg") o números
+    answers: Dict[str, Any]
+
+class AssessmentResponse(BaseModel):
+    session_id: str
+    risk_score: float
+    risk_level: str
+    bmi: Optional[float] = None
+    variables: Dict[str, Any]
+    interpretation: str
+    report_url: str  # POST para generar el informe (recomendaciones del agente y PDF)
+
+def _wants_assessment(request: CoachRequest) -> bool:
+    """Indica si la consulta pide iniciar una evaluación de riesgo."""
     # Detectar palabras clave para iniciar evaluación
     query_lower = request.query.lower()
     keywords_assessment = [
@@ -93,10 +121,23 @@ async def coach_endpoint(request: CoachRequest):
         "chequear", "chequeo", "revisar", "calcular", "calculame"
     ]
     
-    should_start_assessment = (
+    return (
         request.start_assessment or 
         any(keyword in query_lower for keyword in keywords_assessment)
     )
+
+
+@router.post("/", response_model=CoachResponse)
+async def coach_endpoint(request: CoachRequest):
+    """
+    Endpoint principal del coach que maneja:
+    1. Conversación normal con el agente
+    2. Inicio de evaluación de riesgo
+    3. Recopilación de variables para predicción
+    4. Predicción y recomendaciones personalizadas
+    """
+    
+    should_start_assessment = _wants_assessment(request)
     
     # Log para debugging
     logger.info(f"📩 Query recibido: '{request.query}'")
@@ -121,6 +162,102 @@ async def coach_endpoint(request: CoachRequest):
     return await handle_normal_conversation(request)
 
 
+@router.post("/stream")
+async def coach_stream_endpoint(request: CoachRequest):
+    """
+    Variante en streaming (SSE) del coach: transmite la respuesta final a medida
+    que el formateador la genera. Las evaluaciones de riesgo (preguntas y
+    predicción) no se transmiten: se envían en un único evento `done` con el
+    mismo contenido que `/api/coach/`.
+    """
+    in_assessment = False
+    if request.session_id and get_session is not None:
+        session = get_session(request.session_id)
+        in_assessment = bool(session and not session.completed)
+
+    if in_assessment or _wants_assessment(request) or run_agent_flow_stream is None:
+        response = await coach_endpoint(request)
+
+        async def single_event():
+            yield sse_event('done', response.model_dump())
+
+        return StreamingResponse(single_event(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+    def build_done(out: dict) -> dict:
+        return CoachResponse(
+            risk=out.get('risk', 'medio'),
+            retrieved_count=len(out.get('retrieved', [])),
+            draft=out.get('draft', '') or '',
+            final=render_markdown_to_safe_html(out.get('final', '')),
+            details={k: v for k, v in out.items() if k not in ('draft', 'final')},
+        ).model_dump()
+
+    events = run_agent_flow_stream(request.query)
+    return StreamingResponse(
+        stream_agent_sse(events, render_markdown_to_safe_html, build_done),
+        media_type='text/event-stream',
+        headers=SSE_HEADERS,
+    )
+
+
+@router.post("/assessment", response_model=AssessmentResponse)
+async def assessment_endpoint(request: AssessmentRequest):
+    """
+    Evaluación de riesgo en una sola llamada (formularios e integraciones): valida
+    todas las respuestas, calcula el IMC y devuelve la predicción sin pasar por las
+    12 preguntas del chat. El informe con recomendaciones y PDF es un paso aparte
+    y opcional: `POST /api/coach/assessment/{session_id}/report`.
+    """
+    if validate_submission is None or predict_diabetes_risk is None:
+        raise HTTPException(status_code=500, detail="Módulo de evaluación no disponible")
+    values, errors = validate_submission(request.answers)
+    if errors:
+        raise HTTPException(status_code=422, detail={"message": "Respuestas inválidas", "errors": errors})
+
+    session = create_session()
+    for name, value in values.items():
+        session.set(name, value)
+    calculate_bmi(session)
+    variables = session.variables
+    risk_score, risk_level = predict_diabetes_risk(variables)
+    session.risk_prediction = risk_score
+    session.risk_level = risk_level
+    session.current_question_index = len(VARIABLE_QUESTIONS)
+    session.completed = True
+    save_session(session)
+
+    return AssessmentResponse(
+        session_id=session.session_id,
+        risk_score=risk_score,
+        risk_level=risk_level,
+        bmi=variables.get("BMI"),
+        variables=variables,
+        interpretation=get_risk_interpretation(risk_score, risk_level, variables),
+        report_url=f"/api/coach/assessment/{session.session_id}/report",
+    )
+
+
+@router.post("/assessment/{session_id}/report", response_model=CoachResponse, status_code=202)
+async def assessment_report_endpoint(session_id: str, response: Response):
+    """
+    Genera el informe (recomendaciones del agente) de una evaluación ya completada
+    y encola su PDF sin esperar a que se renderice: responde 202 con el estado del
+    trabajo en `details.pdf_data` (`status_url`, `download_url`) y en `Location`.
+    """
+    if get_session is None:
+        raise HTTPException(status_code=500, detail="Módulo de sesiones no disponible")
+    session = get_session(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada o expirada")
+    if session.risk_level is None:
+        raise HTTPException(status_code=409, detail="La evaluación de esta sesión no está completa")
+    report = await build_assessment_report(session, wait_pdf=False)
+    pdf_data = report.details.get("pdf_data") if report.details else None
+    if pdf_data and pdf_data.get("status_url"):
+        response.headers["Location"] = pdf_data["status_url"]
+    return report
+
+
 async def start_assessment() -> CoachResponse:
     """Inicia una nueva sesión de evaluación de riesgo."""
     session = get_or_create_session()
@@ -159,6 +296,7 @@ async def handle_assessment_flow(request: CoachRequest, session) -> CoachRespons
     
     # Procesar la respuesta del usuario
     result = process_answer(session, request.query)
+    save_session(session)
     
     if not result["success"]:
         # Error de validación, re-preguntar
@@ -208,7 +346,7 @@ async def handle_assessment_flow(request: CoachRequest, session) -> CoachRespons
     return await complete_assessment(session)
 
 
-async def generate_assessment_pdf(html_content: str, risk_level: str, risk_score: float, session) -> Optional[Dict[str, Any]]:
+async def generate_assessment_pdf(html_content: str, risk_level: str, risk_score: float, session, wait: bool = True) -> Optional[Dict[str, Any]]:
     """
     Genera un PDF del informe de evaluación usando la API interna.
     
@@ -217,9 +355,11 @@ async def generate_assessment_pdf(html_content: str, risk_level: str, risk_score
         risk_level: Nivel de riesgo (bajo, medio, alto)
         risk_score: Probabilidad de riesgo (0-1)
         session: Objeto de sesión con variables del usuario
+        wait: Si es True espera el PDF (/api/pdf/create); si es False solo encola
+            el trabajo (/api/pdf/jobs) y devuelve su estado
         
     Returns:
-        Diccionario con información del PDF generado o None si falla
+        Diccionario con información del PDF generado (o del trabajo encolado) o None si falla
     """
     try:
         # Generar título basado en el nivel de riesgo (sin emojis para compatibilidad con headers HTTP)
@@ -245,7 +385,14 @@ async def generate_assessment_pdf(html_content: str, risk_level: str, risk_score
         
         # Obtener URL del servicio PDF desde variable de entorno
         pdf_service_url = os.getenv('PDF_SERVICE_URL', 'http://localhost:8000')
-        pdf_api_url = f"{pdf_service_url}/api/pdf/create"
+        
+        if _pdf_service is not None:
+            # Mismo proceso: se encola directamente en el pool, sin llamada HTTP a sí mismo
+            pdf_data = await _pdf_service(pdf_payload, pdf_service_url, wait)
+            logger.info(f"PDF {'generado' if wait else 'encolado'} exitosamente: {pdf_data.get('pdf_id') or pdf_data.get('job_id')}")
+            return pdf_data
+        
+        pdf_api_url = f"{pdf_service_url}/api/pdf/create" if wait else f"{pdf_service_url}/api/pdf/jobs"
         
         logger.info(f"📄 Generando PDF usando servicio: {pdf_api_url}")
         
@@ -254,12 +401,12 @@ async def generate_assessment_pdf(html_content: str, risk_level: str, risk_score
             response = await client.post(
                 pdf_api_url,
                 json=pdf_payload,
-                timeout=30.0
+                timeout=PDF_CLIENT_TIMEOUT if wait else PDF_SUBMIT_TIMEOUT
             )
             
-            if response.status_code == 200:
+            if response.status_code in (200, 202):
                 pdf_data = response.json()
-                logger.info(f"PDF generado exitosamente: {pdf_data.get('pdf_id')}")
+                logger.info(f"PDF {'generado' if wait else 'encolado'} exitosamente: {pdf_data.get('pdf_id') or pdf_data.get('job_id')}")
                 return pdf_data
             else:
                 logger.error(f"Error al generar PDF: {response.status_code} - {response.text}")
@@ -283,35 +430,65 @@ async def complete_assessment(session) -> CoachResponse:
         # Guardar en sesión
         session.risk_prediction = risk_score
         session.risk_level = risk_level
+        save_session(session)
         
-        # Obtener interpretación personalizada
-        interpretation = get_risk_interpretation(risk_score, risk_level, session.variables)
+        return await build_assessment_report(session)
         
-        # Generar recomendaciones específicas usando el agente
-        context_for_agent = f"""
+    except Exception as e:
+        logger.exception("Error completando evaluación")
+        error_html = render_markdown_to_safe_html(f"""
+### ❌ Error en la Evaluación
+
+Lo siento, ocurrió un error al procesar tu evaluación: {str(e)}
+
+Por favor, intenta nuevamente o consulta con el administrador del sistema.
+""")
+        return CoachResponse(
+            risk="error",
+            retrieved_count=0,
+            draft="",
+            final=error_html,
+            session_id=session.session_id,
+            is_question=False
+        )
+
+
+async def build_assessment_report(session, wait_pdf: bool = True) -> CoachResponse:
+    """Informe de una sesión ya evaluada: interpretación, recomendaciones del agente y PDF.
+
+    Con `wait_pdf=False` el PDF solo se encola y `details.pdf_data` describe el trabajo.
+    """
+    risk_score, risk_level = session.risk_prediction, session.risk_level
+    variables = session.variables
+    
+    # Obtener interpretación personalizada
+    interpretation = get_risk_interpretation(risk_score, risk_level, variables)
+    
+    # Generar recomendaciones específicas usando el agente
+    context_for_agent = f"""
 El usuario ha completado una evaluación de riesgo de diabetes con los siguientes resultados:
 
 - **Nivel de riesgo:** {risk_level.upper()}
 - **Probabilidad:** {risk_score:.1%}
-- **IMC:** {session.variables.get('BMI', 'N/A'):.1f}
-- **Edad:** {session.variables.get('Age_Years', 'N/A')} años
-- **Antecedentes familiares:** {"Sí" if session.variables.get('Family_History_Diabetes') == 1 else "No"}
-- **Actividad física:** {session.variables.get('Total_MET_Score', 0):.0f} MET-min/semana
+- **IMC:** {variables.get('BMI', 'N/A'):.1f}
+- **Edad:** {variables.get('Age_Years', 'N/A')} años
+- **Antecedentes familiares:** {"Sí" if variables.get('Family_History_Diabetes') == 1 else "No"}
+- **Actividad física:** {variables.get('Total_MET_Score', 0):.0f} MET-min/semana
 
 Genera recomendaciones específicas y motivadoras basadas en su perfil.
 """
-        
-        # Usar el agente para generar recomendaciones adicionales
-        agent_recommendations = ""
-        if run_agent_flow:
-            try:
-                agent_out = run_agent_flow(context_for_agent)
-                agent_recommendations = agent_out.get('final', '')
-            except Exception as e:
-                logger.error(f"Error en agente: {e}")
-        
-        # Combinar interpretación + recomendaciones del agente
-        final_response = f"""
+    
+    # Usar el agente para generar recomendaciones adicionales
+    agent_recommendations = ""
+    if run_agent_flow_async:
+        try:
+            agent_out = await run_agent_flow_async(context_for_agent)
+            agent_recommendations = agent_out.get('final', '')
+        except Exception as e:
+            logger.error(f"Error en agente: {e}")
+    
+    # Combinar interpretación + recomendaciones del agente
+    final_response = f"""
 ## 📊 Resultados de tu Evaluación
 
 {interpretation}
@@ -326,20 +503,21 @@ Genera recomendaciones específicas y motivadoras basadas en su perfil.
 
 🎯 **Próximo paso:** Guarda estos resultados y compártelos con tu médico en tu próxima consulta.
 """
-        
-        final_html = render_markdown_to_safe_html(final_response)
-        
-        # Generar PDF con el informe
-        pdf_data = await generate_assessment_pdf(
-            html_content=final_html,
-            risk_level=risk_level,
-            risk_score=risk_score,
-            session=session
-        )
-        
-        # Agregar enlace del PDF a la respuesta
-        if pdf_data:
-            pdf_link_html = f"""
+    
+    final_html = render_markdown_to_safe_html(final_response)
+    
+    # Generar PDF con el informe
+    pdf_data = await generate_assessment_pdf(
+        html_content=final_html,
+        risk_level=risk_level,
+        risk_score=risk_score,
+        session=session,
+        wait=wait_pdf
+    )
+    
+    # Agregar enlace del PDF a la respuesta
+    if pdf_data:
+        pdf_link_html = f"""
 <div style="margin-top: 30px; padding: 20px; background-color: #f0f9ff; border-left: 4px solid #3b82f6; border-radius: 8px;">
     <h3 style="margin: 0 0 10px 0; color: #1e40af;">📄 Tu Informe está Listo</h3>
     <p style="margin: 0 0 15px 0;">Hemos generado un PDF completo con tu evaluación y recomendaciones personalizadas.</p>
@@ -351,50 +529,32 @@ Genera recomendaciones específicas y motivadoras basadas en su perfil.
     </div>
 </div>
 """
-            final_html += pdf_link_html
-        
-        return CoachResponse(
-            risk=risk_level,
-            retrieved_count=0,
-            draft="",
-            final=final_html,
-            session_id=session.session_id,
-            is_question=False,
-            question_progress=f"{len(VARIABLE_QUESTIONS)}/{len(VARIABLE_QUESTIONS)}",
-            details={
-                "risk_score": risk_score,
-                "variables": session.variables,
-                "bmi": session.variables.get("BMI"),
-                "pdf_data": pdf_data
-            }
-        )
-        
-    except Exception as e:
-        logger.exception("Error completando evaluación")
-        error_html = render_markdown_to_safe_html(f"""
-### ❌ Error en la Evaluación
-
-Lo siento, ocurrió un error al procesar tu evaluación: {str(e)}
-
-Por favor, intenta nuevamente o consulta con el administrador del sistema.
-""")
-        return CoachResponse(
-            risk="error",
-            retrieved_count=0,
-            draft="",
-            final=error_html,
-            session_id=session.session_id,
-            is_question=False
-        )
+        final_html += pdf_link_html
+    
+    return CoachResponse(
+        risk=risk_level,
+        retrieved_count=0,
+        draft="",
+        final=final_html,
+        session_id=session.session_id,
+        is_question=False,
+        question_progress=f"{len(VARIABLE_QUESTIONS)}/{len(VARIABLE_QUESTIONS)}",
+        details={
+            "risk_score": risk_score,
+            "variables": variables,
+            "bmi": variables.get("BMI"),
+            "pdf_data": pdf_data
+        }
+    )
 
 
 async def handle_normal_conversation(request: CoachRequest) -> CoachResponse:
     """Maneja la conversación normal con el agente (sin evaluación)."""
-    if run_agent_flow is None:
+    if run_agent_flow_async is None:
         raise HTTPException(status_code=500, detail="run_agent_flow no disponible")
     
     try:
-        out = run_agent_flow(request.query)
+        out = await run_agent_flow_async(request.query)
         final_html = render_markdown_to_safe_html(out.get('final', ''))
         draft_text = out.get('draft', '') or ''
         
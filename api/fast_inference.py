@@ -0,0 +1,259 @@
+"""
+Inferencia de baja latencia para el modelo XGBoost de diabetes.
+
+`XGBClassifier.predict_proba` paga por cada llamada la validación del wrapper de
+sklearn y la construcción de un DMatrix, que para una sola fila cuestan más que
+evaluar los árboles. Este módulo ofrece dos caminos alternativos:
+
+- `inplace`: `Booster.inplace_predict`, que evalúa el array numpy sin DMatrix.
+- `flat`: los árboles exportados a arrays numpy planos (hijos, feature, umbral,
+  hoja) y evaluados nivel a nivel para todos los árboles a la vez.
+
+El backend se elige con PREDICT_BACKEND (sklearn | inplace | flat; por defecto
+`flat`, que solo atiende lotes de hasta PREDICT_FLAT_MAX_ROWS filas y delega los
+mayores en XGBoost). Al cargarlo se compara contra `predict_proba` sobre filas aleatorias
+y, si alguna probabilidad difiere más de PREDICT_EPSILON (1e-6), se vuelve a
+`sklearn` con un aviso.
+
+Microbenchmark:
+    python -m api.fast_inference --rows 2000
+"""
+from typing import Callable, Optional
+import os
+import json
+import time
+import logging
+import argparse
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("sklearn", "inplace", "flat")
+
+
+class FlatTreeEnsemble:
+    """Ensamble de árboles de regresión (gbtree, binary:logistic) en arrays planos."""
+
+    def __init__(self, left: np.ndarray, right: np.ndarray, feature: np.ndarray, threshold: np.ndarray,
+                 default_left: np.ndarray, value: np.ndarray, roots: np.ndarray, max_depth: int, base_margin: float):
+        self.left = left
+        self.right = right
+        self.feature = feature
+        self.threshold = threshold
+        self.default_left = default_left
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.base_margin = base_margin
+
+    @classmethod
+    def from_booster(cls, booster) -> "FlatTreeEnsemble":
+        raw = json.loads(booster.save_raw("json"))
+        learner = raw["learner"]
+        objective = learner["objective"]["name"]
+        if objective != "binary:logistic":
+            raise ValueError(f"Objetivo no soportado por el evaluador plano: {objective}")
+        gb = learner["gradient_booster"]
+        if gb["name"] != "gbtree":
+            raise ValueError(f"Booster no soportado por el evaluador plano: {gb['name']}")
+
+        lefts, rights, feats, thresholds, defaults, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for tree in gb["model"]["trees"]:
+            if any(tree.get("split_type", [])):
+                raise ValueError("Splits categóricos no soportados por el evaluador plano")
+            left = np.asarray(tree["left_children"], dtype=np.int32)
+            right = np.asarray(tree["right_children"], dtype=np.int32)
+            leaf = left < 0
+            # índices absolutos; las hojas apuntan a sí mismas para poder iterar sin ramas
+            own = np.arange(offset, offset + left.size, dtype=np.int32)
+            lefts.append(np.where(leaf, own, left + offset))
+            rights.append(np.where(leaf, own, right + offset))
+            feats.append(np.where(leaf, 0, np.asarray(tree["split_indices"], dtype=np.int32)))
+            # en las hojas split_conditions guarda el valor de la hoja
+            thresholds.append(np.asarray(tree["split_conditions"], dtype=np.float32))
+            defaults.append(np.asarray(tree["default_left"], dtype=bool))
+            roots.append(offset)
+            max_depth = max(max_depth, _tree_depth(left, right))
+            offset += left.size
+
+        base_score = float(learner["learner_model_param"]["base_score"].strip("[]"))
+        base_margin = float(np.log(base_score / (1.0 - base_score)))
+        threshold = np.concatenate(thresholds)
+        is_leaf = np.concatenate([np.asarray(t["left_children"]) < 0 for t in gb["model"]["trees"]])
+        return cls(
+            left=np.concatenate(lefts),
+            right=np.concatenate(rights),
+            feature=np.concatenate(feats),
+            threshold=threshold,
+            default_left=np.concatenate(defaults),
+            value=np.where(is_leaf, threshold, np.float32(0)).astype(np.float32),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max_depth,
+            base_margin=base_margin,
+        )
+
+    def margin(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[0] == 1:
+            return np.array([self._margin_row(X[0])], dtype=np.float32)
+        rows = np.arange(X.shape[0])[:, None]
+        node = np.broadcast_to(self.roots, (X.shape[0], self.roots.size)).copy()
+        for _ in range(self.max_depth):
+            x = X[rows, self.feature[node]]
+            # XGBoost: izquierda si x < umbral; los NaN siguen default_left.
+            # Las hojas apuntan a sí mismas, así que iterar de más no las mueve.
+            go_left = np.where(np.isnan(x), self.default_left[node], x < self.threshold[node])
+            node = np.where(go_left, self.left[node], self.right[node])
+        return self.value[node].sum(axis=1, dtype=np.float32) + np.float32(self.base_margin)
+
+    def _margin_row(self, x: np.ndarray) -> np.float32:
+        # camino de una fila: arrays 1D (un nodo por árbol) y sin máscara de NaN si no hay faltantes
+        has_nan = bool(np.isnan(x).any())
+        node = self.roots
+        for _ in range(self.max_depth):
+            v = x[self.feature[node]]
+            go_left = v < self.threshold[node]
+            if has_nan:
+                go_left = np.where(np.isnan(v), self.default_left[node], go_left)
+            node = np.where(go_left, self.left[node], self.right[node])
+        return self.value[node].sum(dtype=np.float32) + np.float32(self.base_margin)
+
+    def predict_proba1(self, X: np.ndarray) -> np.ndarray:
+        """Probabilidad de la clase positiva para cada fila de X."""
+        m = self.margin(X).astype(np.float64)
+        return (1.0 / (1.0 + np.exp(-m))).astype(np.float32)
+
+
+def _tree_depth(left: np.ndarray, right: np.ndarray) -> int:
+    depth = 0
+    frontier = [0]
+    while frontier:
+        nxt = []
+        for n in frontier:
+            if left[n] >= 0:
+                nxt.extend((int(left[n]), int(right[n])))
+        if nxt:
+            depth += 1
+        frontier = nxt
+    return depth
+
+
+def _sklearn_scorer(model) -> Callable[[np.ndarray], np.ndarray]:
+    def score(X: np.ndarray) -> np.ndarray:
+        proba = model.predict_proba(X)
+        return (proba[:, 1] if proba.shape[1] > 1 else proba[:, 0]).astype(np.float32)
+    return score
+
+
+def _inplace_scorer(model) -> Callable[[np.ndarray], np.ndarray]:
+    booster = model.get_booster()
+
+    def score(X: np.ndarray) -> np.ndarray:
+        # inplace_predict devuelve directamente la probabilidad para binary:logistic
+        out = booster.inplace_predict(np.asarray(X, dtype=np.float32), validate_features=False)
+        return np.asarray(out, dtype=np.float32).reshape(-1)
+    return score
+
+
+# A partir de este número de filas el evaluador de XGBoost (multihilo, en C++) es más rápido
+FLAT_MAX_ROWS = int(os.getenv("PREDICT_FLAT_MAX_ROWS", "64"))
+
+
+def _flat_scorer(model) -> Callable[[np.ndarray], np.ndarray]:
+    ensemble = FlatTreeEnsemble.from_booster(model.get_booster())
+    fallback = _sklearn_scorer(model)
+
+    def score(X: np.ndarray) -> np.ndarray:
+        if np.ndim(X) == 2 and X.shape[0] > FLAT_MAX_ROWS:
+            return fallback(X)
+        return ensemble.predict_proba1(X)
+    return score
+
+
+def build_scorer(model, backend: str) -> Callable[[np.ndarray], np.ndarray]:
+    """Función X (n, 16) -> probabilidades (n,) float32 para el backend indicado."""
+    if backend == "inplace":
+        return _inplace_scorer(model)
+    if backend == "flat":
+        return _flat_scorer(model)
+    return _sklearn_scorer(model)
+
+
+def validation_rows(n_features: int, n: int = 512, seed: int = 0) -> np.ndarray:
+    """Filas de prueba: valores enteros y continuos en rangos amplios, con algunos NaN."""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0, 2, size=(n, n_features)).astype(np.float32)
+    X[: n // 2] = rng.integers(0, 3, size=(n // 2, n_features))
+    X[n // 2: 3 * n // 4] *= 50
+    X[rng.random((n, n_features)) < 0.02] = np.nan
+    return X
+
+
+def max_abs_diff(model, scorer: Callable[[np.ndarray], np.ndarray], X: Optional[np.ndarray] = None) -> float:
+    """Diferencia máxima contra `predict_proba`, evaluando en bloques pequeños (camino de baja latencia)."""
+    if X is None:
+        X = validation_rows(model.n_features_in_)
+    reference = _sklearn_scorer(model)(X)
+    scores = np.concatenate([scorer(X[i:i + 16]) for i in range(0, X.shape[0], 16)] + [scorer(X[:1])])
+    return float(np.max(np.abs(scores - np.append(reference, reference[0]))))
+
+
+def load_scorer(model, backend: Optional[str] = None, epsilon: Optional[float] = None) -> tuple:
+    """Construye y valida el scorer. Devuelve (función, backend efectivo)."""
+    backend = (backend or os.getenv("PREDICT_BACKEND", "flat")).lower()
+    epsilon = float(os.getenv("PREDICT_EPSILON", "1e-6")) if epsilon is None else epsilon
+    if backend not in BACKENDS:
+        logger.warning(f"PREDICT_BACKEND={backend} desconocido; usando sklearn")
+        backend = "sklearn"
+    if backend == "sklearn":
+        return _sklearn_scorer(model), backend
+    try:
+        scorer = build_scorer(model, backend)
+        diff = max_abs_diff(model, scorer)
+    except Exception as e:
+        logger.warning(f"Backend de predicción {backend} no disponible ({e}); usando sklearn")
+        return _sklearn_scorer(model), "sklearn"
+    if diff > epsilon:
+        logger.warning(f"Backend {backend} difiere de predict_proba en {diff:.2e} (> {epsilon:.0e}); usando sklearn")
+        return _sklearn_scorer(model), "sklearn"
+    logger.info(f"Backend de predicción {backend} validado (diferencia máxima {diff:.2e})")
+    return scorer, backend
+
+
+def _bench(fn: Callable, X: np.ndarray, repeat: int) -> float:
+    fn(X[:1])
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for i in range(X.shape[0]):
+            fn(X[i:i + 1])
+    return (time.perf_counter() - t0) / (repeat * X.shape[0]) * 1e6
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmark de los backends de predicción de una fila")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    try:
+        from api.predict import get_model
+    except ImportError:
+        from predict import get_model  # type: ignore
+    model = get_model()
+    X = validation_rows(model.n_features_in_, n=args.rows, seed=1)
+    for backend in BACKENDS:
+        scorer = build_scorer(model, backend)
+        diff = max_abs_diff(model, scorer, X)
+        us = _bench(scorer, X, args.repeat)
+        batch_t0 = time.perf_counter()
+        scorer(X)
+        batch_ms = (time.perf_counter() - batch_t0) * 1000
+        print(f"{backend:8s} una fila: {us:8.1f} µs   lote de {args.rows}: {batch_ms:7.2f} ms   diferencia máx: {diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,23 @@ Módulo para cargar y ejecutar el modelo de predicción de diabetes.
 """
 import numpy as np
 from pathlib import Path
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Tuple, List, Sequence, Iterator, Optional
+import io
+import os
+import csv
+import json
 import logging
+import threading
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from xgboost import XGBClassifier
 
+try:
+    from api.fast_inference import load_scorer
+except ImportError:
+    from fast_inference import load_scorer  # type: ignore
+
 logger = logging.getLogger(__name__)
 
 # Ruta al modelo
@@ -40,6 +53,114 @@ DEFAULT_VALUES = {
 }
 
 
+class BatchValidationError(ValueError):
+    """Un registro del lote tiene un valor no numérico."""
+
+    def __init__(self, row: int, feature: str, value: Any):
+        super().__init__(f"Registro {row}: valor no numérico para {feature}: {value!r}")
+        self.row = row
+        self.feature = feature
+        self.value = value
+
+
+def _missing(value: Any) -> bool:
+    return value is None or value == "" or (isinstance(value, float) and np.isnan(value))
+
+
+class FeatureSchema:
+    """
+    Esquema compilado de las features del modelo: índice de columna de cada
+    variable, fila de valores por defecto y dtype fijados una sola vez.
+
+    `row` rellena un buffer (1, n) preasignado por hilo y `matrix` una matriz
+    (m, n) por columnas; ambos parten de la fila de defaults y solo escriben
+    las variables presentes. Las variables sin default que faltan se registran
+    en un único aviso por llamada, no uno por variable.
+    """
+
+    def __init__(self, features: Sequence[str], defaults: Dict[str, Any], dtype=np.float32):
+        self.features = tuple(features)
+        self.index = {name: j for j, name in enumerate(self.features)}
+        self.dtype = np.dtype(dtype)
+        self.defaults = np.array([defaults.get(name, 0) for name in self.features], dtype=self.dtype)
+        self.required = frozenset(name for name in self.features if name not in defaults)
+        self._default_values = self.defaults.tolist()
+        self._columns = tuple((j, name, name in self.required) for j, name in enumerate(self.features))
+        self._local = threading.local()
+
+    def __len__(self) -> int:
+        return len(self.features)
+
+    def _buffer(self) -> np.ndarray:
+        buf = getattr(self._local, "row", None)
+        if buf is None:
+            buf = self._local.row = np.empty((1, len(self.features)), dtype=self.dtype)
+        return buf
+
+    def row(self, variables: Dict[str, Any], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Fila (1, n) de features para un usuario.
+
+        Sin `out` se reutiliza el buffer del hilo actual: el resultado es válido
+        hasta la siguiente llamada en el mismo hilo (copiarlo si se guarda).
+        """
+        if out is None:
+            out = self._buffer()
+        values = list(self._default_values)
+        missing = []
+        for j, name, required in self._columns:
+            value = variables.get(name)
+            # None, "" o NaN (value != value) cuentan como faltantes
+            if value is None or value == "" or value != value:
+                if required:
+                    missing.append(name)
+            else:
+                values[j] = value
+        out[0] = values
+        if missing:
+            logger.warning(f"Variables faltantes (se usa 0): {missing}")
+        return out
+
+    def matrix(self, records: Sequence[Dict[str, Any]], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Matriz (m, n) de features para un lote, en el orden del esquema.
+
+        Los valores faltantes (None, "" o NaN) toman el default de su columna;
+        un valor no numérico lanza `BatchValidationError` con la fila y la variable.
+        """
+        n = len(records)
+        if out is None:
+            out = np.empty((n, len(self.features)), dtype=self.dtype)
+        missing_counts = {}
+        for j, feature_name in enumerate(self.features):
+            default = self.defaults[j]
+            column = [r.get(feature_name) for r in records]
+            missing = 0
+            for i, value in enumerate(column):
+                if _missing(value):
+                    column[i] = default
+                    missing += 1
+            try:
+                out[:, j] = column
+            except (TypeError, ValueError):
+                for i, value in enumerate(column):
+                    try:
+                        float(value)
+                    except (TypeError, ValueError):
+                        raise BatchValidationError(i, feature_name, value)
+                raise
+            if missing and feature_name in self.required:
+                missing_counts[feature_name] = missing
+        if missing_counts:
+            # un aviso por lote (no por fila), con cuántos registros usaron 0
+            logger.warning(f"Variables faltantes en el lote de {n} registros (se usa 0): {missing_counts}")
+        return out
+
+
+# Esquema compartido por la predicción individual y la de lotes
+FEATURE_SCHEMA = FeatureSchema(EXPECTED_FEATURES, DEFAULT_VALUES)
+
+
 def load_model():
     """Carga el modelo XGBoost desde disco."""
     try:
@@ -67,6 +188,19 @@ def get_model():
     return _MODEL_CACHE
 
 
+# Función de scoring validada (ver api/fast_inference.py) y su backend
+_SCORER = None
+_SCORER_BACKEND = None
+
+
+def get_scorer():
+    """Devuelve `score(X) -> probabilidades` con el backend de PREDICT_BACKEND."""
+    global _SCORER, _SCORER_BACKEND
+    if _SCORER is None:
+        _SCORER, _SCORER_BACKEND = load_scorer(get_model())
+    return _SCORER
+
+
 def prepare_features(variables: Dict[str, Any]) -> np.ndarray:
     """
     Prepara las features para el modelo a partir de las variables recopiladas.
@@ -75,21 +209,10 @@ def prepare_features(variables: Dict[str, Any]) -> np.ndarray:
         variables: Diccionario con las variables recopiladas
         
     Returns:
-        Array numpy con las features en el orden esperado
+        Array numpy (1, 16) float32 con las features en el orden esperado
+        (buffer del hilo actual, ver `FeatureSchema.row`)
     """
-    features = []
-    
-    for feature_name in EXPECTED_FEATURES:
-        if feature_name in variables:
-            features.append(variables[feature_name])
-        elif feature_name in DEFAULT_VALUES:
-            features.append(DEFAULT_VALUES[feature_name])
-        else:
-            # Si falta una variable crítica, usar un valor neutro
-            logger.warning(f"Variable faltante: {feature_name}, usando 0")
-            features.append(0)
-    
-    return np.array([features])
+    return FEATURE_SCHEMA.row(variables)
 
 
 def predict_diabetes_risk(variables: Dict[str, Any]) -> Tuple[float, str]:
@@ -105,23 +228,14 @@ def predict_diabetes_risk(variables: Dict[str, Any]) -> Tuple[float, str]:
         - nivel_riesgo: str ("bajo", "medio", "alto")
     """
     try:
-        # Obtener el modelo
-        model = get_model()
+        # Obtener la función de scoring (modelo + backend de inferencia validado)
+        score = get_scorer()
         
         # Preparar features
         X = prepare_features(variables)
         
-        # Realizar predicción
-        # El modelo puede retornar probabilidades o clases
-        if hasattr(model, 'predict_proba'):
-            # Si tiene predict_proba, obtener la probabilidad de la clase positiva
-            proba = model.predict_proba(X)[0]
-            # Asumiendo que la clase 1 es diabetes
-            risk_score = float(proba[1] if len(proba) > 1 else proba[0])
-        else:
-            # Si solo tiene predict, obtener la predicción binaria
-            prediction = model.predict(X)[0]
-            risk_score = float(prediction)
+        # Probabilidad de la clase positiva (clase 1 = diabetes)
+        risk_score = float(score(X)[0])
         
         # Clasificar el nivel de riesgo
         if risk_score < 0.3:
@@ -141,6 +255,155 @@ def predict_diabetes_risk(variables: Dict[str, Any]) -> Tuple[float, str]:
         raise
 
 
+# ========== Predicción por lotes ==========
+
+# Umbrales de `predict_diabetes_risk`: < 0.3 bajo, < 0.6 medio, resto alto
+RISK_LEVEL_BINS = np.array([0.3, 0.6])
+RISK_LEVEL_NAMES = np.array(["bajo", "medio", "alto"])
+
+# Filas por llamada al modelo al transmitir resultados
+PREDICT_BATCH_CHUNK = int(os.getenv("PREDICT_BATCH_CHUNK", "5000"))
+PREDICT_BATCH_MAX_ROWS = int(os.getenv("PREDICT_BATCH_MAX_ROWS", "200000"))
+
+
+def prepare_feature_matrix(records: Sequence[Dict[str, Any]]) -> np.ndarray:
+    """
+    Versión por lotes de `prepare_features`: una matriz (n, 16) float32 en el orden
+    de EXPECTED_FEATURES, rellenando con DEFAULT_VALUES (o 0) lo que falte.
+    """
+    return FEATURE_SCHEMA.matrix(records)
+
+
+def risk_levels(scores: np.ndarray) -> np.ndarray:
+    """Nivel de riesgo ("bajo", "medio", "alto") de cada probabilidad."""
+    return RISK_LEVEL_NAMES[np.searchsorted(RISK_LEVEL_BINS, scores, side="right")]
+
+
+def _predict_matrix(X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    scores = get_scorer()(X)
+    return scores, risk_levels(scores)
+
+
+def predict_diabetes_risk_batch(records: Sequence[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Predicción de riesgo para muchos registros con una sola llamada al modelo.
+
+    Returns:
+        Tuple con (probabilidades float32 de forma (n,), niveles de riesgo de forma (n,))
+    """
+    if not records:
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=RISK_LEVEL_NAMES.dtype)
+    return _predict_matrix(prepare_feature_matrix(records))
+
+
+def iter_batch_predictions(records: Sequence[Dict[str, Any]], chunk_size: int = PREDICT_BATCH_CHUNK,
+                           X: Optional[np.ndarray] = None) -> Iterator[List[Dict[str, Any]]]:
+    """Predice por bloques de `chunk_size` y entrega, por bloque, un dict por registro.
+
+    Si ya se calculó la matriz de features de `records`, pasarla en `X` evita rehacerla.
+    """
+    if X is None:
+        X = prepare_feature_matrix(records)
+    for start in range(0, len(records), chunk_size):
+        scores, levels = _predict_matrix(X[start:start + chunk_size])
+        results = []
+        for offset, (score, level) in enumerate(zip(scores.tolist(), levels.tolist())):
+            record = records[start + offset]
+            item = {"index": start + offset, "risk_score": round(score, 6), "risk_level": level}
+            if "id" in record:
+                item["id"] = record["id"]
+            results.append(item)
+        yield results
+
+
+def _parse_number(value: str) -> Any:
+    value = value.strip()
+    if value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def parse_csv_records(data: bytes) -> List[Dict[str, Any]]:
+    """Registros de un CSV con encabezado (nombres de EXPECTED_FEATURES y opcional `id`)."""
+    text = data.decode("utf-8-sig")
+    reader = csv.DictReader(io.StringIO(text))
+    return [
+        {k: (v if k == "id" else _parse_number(v or "")) for k, v in row.items() if k is not None}
+        for row in reader
+    ]
+
+
+def parse_parquet_records(data: bytes) -> List[Dict[str, Any]]:
+    """Registros de un archivo Parquet (requiere pyarrow)."""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise HTTPException(status_code=415, detail="Parquet no soportado: instala pyarrow (pip install pyarrow)")
+    return pq.read_table(io.BytesIO(data)).to_pylist()
+
+
+async def _read_batch_records(request: Request) -> List[Dict[str, Any]]:
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "multipart/form-data":
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or not hasattr(upload, "read"):
+            raise HTTPException(status_code=400, detail="Falta el archivo en el campo 'file'")
+        data = await upload.read()
+        filename = (upload.filename or "").lower()
+        if filename.endswith(".parquet") or (upload.content_type or "").endswith("parquet"):
+            return await run_in_threadpool(parse_parquet_records, data)
+        return await run_in_threadpool(parse_csv_records, data)
+    if content_type in ("text/csv", "application/csv"):
+        return await run_in_threadpool(parse_csv_records, await request.body())
+    if content_type in ("application/vnd.apache.parquet", "application/x-parquet"):
+        return await run_in_threadpool(parse_parquet_records, await request.body())
+    try:
+        payload = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON inválido")
+    records = payload.get("records") if isinstance(payload, dict) else payload
+    if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+        raise HTTPException(status_code=422, detail="Se esperaba una lista de registros (objetos) o {'records': [...]}")
+    return records
+
+
+router = APIRouter()
+
+
+@router.post("/batch")
+async def predict_batch_endpoint(request: Request):
+    """
+    Predicción de riesgo por lotes.
+
+    Acepta JSON (lista de registros o {"records": [...]}), CSV (text/csv o archivo
+    en el campo `file`) o Parquet. Responde NDJSON: una línea por registro con
+    `index`, `risk_score`, `risk_level` (e `id` si el registro lo trae), en el
+    orden de entrada y a medida que se calculan los bloques.
+    """
+    records = await _read_batch_records(request)
+    if len(records) > PREDICT_BATCH_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Máximo {PREDICT_BATCH_MAX_ROWS} registros por lote")
+    try:
+        # validar todo el lote antes de empezar a transmitir
+        X = await run_in_threadpool(prepare_feature_matrix, records)
+    except BatchValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    async def ndjson():
+        chunks = iter_batch_predictions(records, X=X)
+        while True:
+            results = await run_in_threadpool(next, chunks, None)
+            if results is None:
+                break
+            yield "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in results)
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
 def get_risk_interpretation(risk_score: float, risk_level: str, variables: Dict[str, Any]) -> str:
     """
     Genera una interpretación del riesgo basada en el score y las variables.
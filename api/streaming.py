@@ -0,0 +1,100 @@
+"""
+Utilidades para respuestas en streaming (Server-Sent Events).
+
+`stream_agent_sse` convierte los eventos de `run_agent_flow_stream` en eventos SSE:
+- `meta`:  nivel de riesgo y número de fragmentos recuperados
+- `token`: texto crudo a medida que lo genera el formateador
+- `block`: HTML seguro de cada bloque Markdown ya completo (párrafo, lista, código...)
+- `done`:  respuesta final completa (mismo contenido que el endpoint no streaming)
+- `error`: si el flujo falla a mitad de camino
+
+El cliente puede pintar los `block` según llegan y sustituirlos por `done.final`.
+"""
+from typing import Any, AsyncIterator, Callable, List, Tuple
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    # evitar que nginx acumule la respuesta antes de enviarla
+    'X-Accel-Buffering': 'no',
+}
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Serializa un evento SSE con `data` en JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class MarkdownBlockBuffer:
+    """Acumula texto en streaming y entrega renderizados los bloques Markdown completos.
+
+    Un bloque termina en una línea en blanco, salvo dentro de un bloque de código
+    (```), que solo se cierra con su fence de cierre.
+    """
+
+    def __init__(self, render: Callable[[str], str]):
+        self.render = render
+        self._pending = ''
+        self._block: List[str] = []
+        self._in_fence = False
+
+    def feed(self, text: str) -> List[str]:
+        """Añade texto y devuelve el HTML de los bloques que quedaron completos."""
+        self._pending += text
+        out = []
+        while '\n' in self._pending:
+            line, self._pending = self._pending.split('\n', 1)
+            if line.strip().startswith('```'):
+                self._in_fence = not self._in_fence
+            if not line.strip() and not self._in_fence:
+                out.extend(self._emit())
+            else:
+                self._block.append(line)
+        return out
+
+    def flush(self) -> List[str]:
+        """Renderiza lo que quede pendiente (al final del stream)."""
+        if self._pending:
+            self._block.append(self._pending)
+            self._pending = ''
+        self._in_fence = False
+        return self._emit()
+
+    def _emit(self) -> List[str]:
+        text = '\n'.join(self._block).strip()
+        self._block = []
+        if not text:
+            return []
+        return [self.render(text)]
+
+
+async def stream_agent_sse(
+    events: AsyncIterator[Tuple[str, Any]],
+    render_block: Callable[[str], str],
+    build_done: Callable[[dict], dict],
+) -> AsyncIterator[str]:
+    """Traduce los eventos del flujo de agentes a SSE.
+
+    - render_block: convierte un bloque Markdown en HTML seguro
+    - build_done: construye el payload del evento `done` a partir de la salida del flujo
+    """
+    buffer = MarkdownBlockBuffer(render_block)
+    try:
+        async for kind, data in events:
+            if kind == 'meta':
+                yield sse_event('meta', {'risk': data.get('risk'), 'retrieved_count': len(data.get('retrieved') or [])})
+            elif kind == 'token':
+                yield sse_event('token', {'text': data})
+                for block in buffer.feed(data):
+                    yield sse_event('block', {'html': block})
+            elif kind == 'done':
+                for block in buffer.flush():
+                    yield sse_event('block', {'html': block})
+                yield sse_event('done', build_done(data))
+    except Exception as e:
+        logger.exception('Fallo durante el streaming de la respuesta')
+        yield sse_event('error', {'detail': str(e)})
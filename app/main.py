@@ -1,32 +1,53 @@
 from pathlib import Path
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, Request, HTTPException, Header
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 import uvicorn
+import os
 import random
 import json
+import asyncio
 import uuid
 from datetime import datetime
-from xhtml2pdf import pisa
-from io import BytesIO
-import qrcode
-import base64
-import matplotlib.pyplot as plt
-import matplotlib
 import re
 from typing import Any, Dict
 
 # importar el orquestador de agentes
 try:
-	from src.agents.agents_factory import run_agent_flow
+	from src.agents.agents_factory import run_agent_flow, run_agent_flow_async, run_agent_flow_stream
+	from src.agents.openai_utils import close_async_client, get_llm_metrics
 except Exception:
 	# fallback si se ejecuta desde diferente cwd
 	try:
-		from agents.agents_factory import run_agent_flow
+		from agents.agents_factory import run_agent_flow, run_agent_flow_async, run_agent_flow_stream
+		from agents.openai_utils import close_async_client, get_llm_metrics
 	except Exception:
 		run_agent_flow = None
+		run_agent_flow_async = None
+		run_agent_flow_stream = None
+		close_async_client = None
+		get_llm_metrics = None
+
+try:
+	from src.agents.prompt_registry import get_prompt_registry
+except Exception:
+	get_prompt_registry = None
+
+try:
+	from app.pdf_worker import get_pdf_pool, PDFJob, PDFQueueFull, PDFWorkerUnavailable
+except ImportError:
+	from pdf_worker import get_pdf_pool, PDFJob, PDFQueueFull, PDFWorkerUnavailable
+
+try:
+	from app.warmup import get_warmup_state, start_warmup
+except Exception:
+	try:
+		from warmup import get_warmup_state, start_warmup
+	except Exception:
+		get_warmup_state = None
+		start_warmup = None
 
 
 # Rutas de directorios relativas a este archivo (app/main.py)
@@ -36,6 +57,9 @@ STATIC_DIR = BASE_DIR.parent / "static"  # ../static
 PDF_DIR = BASE_DIR.parent / "generated_pdfs"  # ../generated_pdfs
 DATA_DIR = BASE_DIR.parent / "data"  # ../data
 PDF_METADATA_FILE = DATA_DIR / "pdf_metadata.json"
+# Espera máxima de /api/pdf/create (el trabajo sigue en /api/pdf/jobs si se supera)
+PDF_RENDER_TIMEOUT = float(os.getenv("PDF_RENDER_TIMEOUT", "60"))
+PDF_RETRY_AFTER = os.getenv("PDF_RETRY_AFTER", "5")
 
 # Crear directorios si no existen
 PDF_DIR.mkdir(exist_ok=True)
@@ -68,6 +92,69 @@ async def ping():
 	return {"status": "ok"}
 
 
+@app.get("/api/llm/metrics")
+async def llm_metrics():
+	"""Latencia, tokens, errores y reintentos de las últimas llamadas al LLM, por modelo."""
+	if get_llm_metrics is None:
+		raise HTTPException(status_code=503, detail="Cliente LLM no disponible")
+	return get_llm_metrics()
+
+
+@app.get("/ready")
+async def ready():
+	"""Readiness: 200 cuando el calentamiento terminó (modelo, índice, prompts, embedder); 503 mientras tanto."""
+	if get_warmup_state is None:
+		return {"ready": True, "steps": {}}
+	state = get_warmup_state().as_dict()
+	if not state["ready"]:
+		return JSONResponse(status_code=503, content=state)
+	return state
+
+
+@app.on_event("startup")
+async def warmup():
+	"""Calienta el worker en segundo plano: /ping responde de inmediato y /ready cuando termina."""
+	if start_warmup is not None:
+		start_warmup()
+
+
+@app.on_event("shutdown")
+async def close_llm_client():
+	"""Cierra el pool de conexiones compartido del cliente LLM asíncrono."""
+	if close_async_client is not None:
+		await close_async_client()
+
+
+@app.on_event("shutdown")
+async def close_pdf_pool():
+	"""Detiene los procesos de renderizado de PDFs."""
+	get_pdf_pool().shutdown()
+
+
+def _check_admin_token(token: str | None) -> None:
+	expected = os.getenv('ADMIN_TOKEN')
+	if expected and token != expected:
+		raise HTTPException(status_code=403, detail="Token de administración inválido")
+
+
+@app.get("/api/admin/prompts")
+async def list_prompts(x_admin_token: str | None = Header(default=None)):
+	"""Versiones (hash) de los prompts cargados."""
+	_check_admin_token(x_admin_token)
+	if get_prompt_registry is None:
+		raise HTTPException(status_code=503, detail="Registro de prompts no disponible")
+	return {"versions": get_prompt_registry().versions()}
+
+
+@app.post("/api/admin/prompts/reload")
+async def reload_prompts(x_admin_token: str | None = Header(default=None)):
+	"""Recarga los prompts de kb/agents sin reiniciar el servidor."""
+	_check_admin_token(x_admin_token)
+	if get_prompt_registry is None:
+		raise HTTPException(status_code=503, detail="Registro de prompts no disponible")
+	return {"versions": get_prompt_registry().reload()}
+
+
 # Modelo para las peticiones del chat
 class ChatRequest(BaseModel):
 	message: str
@@ -146,220 +233,6 @@ def add_pdf_metadata(pdf_id, title, description, filename):
 	return new_entry
 
 
-def generate_qr_code(url: str) -> str:
-	"""
-	Genera un código QR para la URL proporcionada y lo retorna como base64.
-	
-	Args:
-		url: URL para la que se generará el código QR
-		
-	Returns:
-		String base64 del código QR en formato PNG
-	"""
-	# Crear código QR
-	qr = qrcode.QRCode(
-		version=1,
-		error_correction=qrcode.constants.ERROR_CORRECT_L,
-		box_size=10,
-		border=4,
-	)
-	qr.add_data(url)
-	qr.make(fit=True)
-	
-	# Generar imagen
-	img = qr.make_image(fill_color="black", back_color="white")
-	
-	# Convertir a base64
-	buffer = BytesIO()
-	img.save(buffer, format='PNG')
-	buffer.seek(0)
-	img_base64 = base64.b64encode(buffer.read()).decode()
-	
-	return img_base64
-
-
-def generate_circular_chart(percentage: float, title: str = "Progreso") -> str:
-	"""
-	Genera un gráfico circular (donut chart) para mostrar un porcentaje.
-	
-	Args:
-		percentage: Valor del porcentaje (0-100)
-		title: Título del gráfico
-		
-	Returns:
-		String base64 del gráfico en formato PNG
-	"""
-	# Configurar matplotlib para no usar GUI
-	matplotlib.use('Agg')
-	
-	# Asegurar que el porcentaje esté en el rango correcto
-	percentage = max(0, min(100, percentage))
-	remaining = 100 - percentage
-	
-	# Crear figura más grande y con mejor aspecto
-	fig, ax = plt.subplots(figsize=(8, 8), facecolor='white')
-	
-	# Determinar color basado en el porcentaje (semáforo de riesgo)
-	if percentage < 30:
-		main_color = '#10b981'  # Verde (bajo riesgo)
-		risk_label = 'Riesgo Bajo'
-	elif percentage < 60:
-		main_color = '#f59e0b'  # Amarillo/Naranja (riesgo medio)
-		risk_label = 'Riesgo Medio'
-	else:
-		main_color = '#ef4444'  # Rojo (riesgo alto)
-		risk_label = 'Riesgo Alto'
-	
-	# Datos para el gráfico
-	sizes = [percentage, remaining]
-	colors = [main_color, '#f0f0f0']  # Color dinámico para riesgo, gris muy claro para restante
-	
-	# Crear el gráfico circular (donut) sin explosión para aspecto más limpio
-	wedges, texts = ax.pie(
-		sizes,
-		colors=colors,
-		startangle=90,
-		wedgeprops=dict(width=0.3, edgecolor='white', linewidth=4)
-	)
-	
-	# Agregar el porcentaje en el centro del círculo (arriba)
-	ax.text(0, 0.2, f'{percentage:.1f}%', 
-			ha='center', va='center', 
-			fontsize=48, fontweight='bold', 
-			color='#1f2937')
-	
-	# Agregar etiqueta de nivel de riesgo en el centro del círculo (abajo)
-	ax.text(0, -0.2, risk_label, 
-			ha='center', va='center', 
-			fontsize=22, fontweight='600', 
-			color=main_color)
-	
-	# Agregar título FUERA y debajo del círculo
-	ax.text(0, -1.6, title, 
-			ha='center', va='center', 
-			fontsize=20, fontweight='bold', 
-			color='#374151')
-	
-	# Asegurar que el gráfico sea circular
-	ax.axis('equal')
-	
-	# Guardar en buffer con mayor resolución
-	buffer = BytesIO()
-	plt.tight_layout(pad=0.5)
-	plt.savefig(buffer, format='PNG', dpi=200, bbox_inches='tight', 
-				facecolor='white', edgecolor='none')
-	plt.close(fig)
-	
-	# Convertir a base64
-	buffer.seek(0)
-	img_base64 = base64.b64encode(buffer.read()).decode()
-	
-	return img_base64
-
-
-def add_chart_to_html(html_content: str, percentage: float, chart_title: str = "Nivel de Riesgo") -> str:
-	"""
-	Agrega un gráfico circular al inicio del contenido HTML.
-	
-	Args:
-		html_content: Contenido HTML original
-		percentage: Porcentaje para mostrar (0-100)
-		chart_title: Título del gráfico
-		
-	Returns:
-		HTML con el gráfico agregado al inicio
-	"""
-	# Generar gráfico circular
-	chart_base64 = generate_circular_chart(percentage, chart_title)
-	
-	# HTML del gráfico centrado al inicio del documento
-	chart_html = f"""
-	<!DOCTYPE html>
-	<html>
-	<head>
-		<meta charset="utf-8">
-		<style>
-			body {{
-				font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-				margin: 0;
-				padding: 20px;
-				background-color: #f9fafb;
-			}}
-			.chart-container {{
-				text-align: center;
-				margin: 40px auto 60px;
-				padding: 30px;
-				background-color: white;
-				border-radius: 12px;
-				box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-				max-width: 600px;
-			}}
-			.chart-container img {{
-				max-width: 500px;
-				width: 100%;
-				height: auto;
-				margin: 0 auto;
-			}}
-		</style>
-	</head>
-	<body>
-		<div class="chart-container">
-			<img src="data:image/png;base64,{chart_base64}" alt="Grafico de Riesgo">
-		</div>
-	"""
-	
-	# Limpiar el HTML original de etiquetas de documento si las tiene
-	content = html_content
-	if '<!DOCTYPE' in content:
-		# Extraer solo el contenido del body
-		import re
-		body_match = re.search(r'<body[^>]*>(.*?)</body>', content, re.DOTALL | re.IGNORECASE)
-		if body_match:
-			content = body_match.group(1)
-		else:
-			# Si no hay body, quitar html, head, body tags
-			content = re.sub(r'<html[^>]*>|</html>|<head[^>]*>.*?</head>|<body[^>]*>|</body>', '', content, flags=re.DOTALL | re.IGNORECASE)
-	
-	# Combinar gráfico con contenido
-	return chart_html + content
-
-
-def add_qr_to_html(html_content: str, pdf_url: str) -> str:
-	"""
-	Agrega un código QR al final del contenido HTML.
-	
-	Args:
-		html_content: Contenido HTML original
-		pdf_url: URL completa del PDF para generar el QR
-		
-	Returns:
-		HTML con el código QR agregado al final
-	"""
-	# Generar código QR
-	qr_base64 = generate_qr_code(pdf_url)
-	
-	# HTML del código QR centrado al final del documento
-	qr_html = f"""
-	<div style="page-break-before: avoid; margin-top: 50px; padding-top: 30px; border-top: 2px solid #e0e0e0; text-align: center;">
-		<h3 style="color: #666; font-size: 16px; margin-bottom: 20px;">Accede a este documento escaneando el código QR</h3>
-		<img src="data:image/png;base64,{qr_base64}" alt="QR Code" style="width: 200px; height: 200px; margin: 0 auto; display: block;">
-		<p style="margin-top: 15px; font-size: 12px; color: #888;">Escanea este código para ver el PDF en línea</p>
-	</div>
-	</body>
-	</html>
-	"""
-	
-	# Reemplazar el cierre de body y html con el QR incluido
-	if '</body>' in html_content and '</html>' in html_content:
-		html_content = html_content.replace('</body>', '').replace('</html>', '')
-		html_content += qr_html
-	else:
-		# Si no hay cierre de etiquetas, agregar al final
-		html_content += qr_html
-	
-	return html_content
-
-
 # API endpoint para el chatbot (demo hardcodeado)
 # Modelo para las peticiones del chat
 class ChatRequest(BaseModel):
@@ -468,11 +341,11 @@ async def chat(request: ChatRequest):
     """
     Endpoint de chatbot que utiliza el flujo de agentes para generar respuestas.
     """
-    if run_agent_flow is None:
+    if run_agent_flow_async is None:
         return ChatResponse(response="Error: El flujo de agentes no está disponible.")
 
     try:
-        out = run_agent_flow(request.message)
+        out = await run_agent_flow_async(request.message)
         raw_response = out.get('final', 'Lo siento, no pude generar una respuesta.')
         formatted_response = format_response_to_html(raw_response)
         return ChatResponse(response=formatted_response)
@@ -487,65 +360,170 @@ from pathlib import Path
 root_dir = Path(__file__).parent.parent
 sys.path.insert(0, str(root_dir))
 
-from api import coach
+from api import coach, predict
+from api.streaming import SSE_HEADERS, sse_event, stream_agent_sse
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Variante en streaming (SSE) de /api/chat. Los bloques se envían como HTML
+    seguro a medida que se completan; el evento `done` trae la respuesta
+    formateada igual que /api/chat.
+    """
+    if run_agent_flow_stream is None:
+        async def unavailable():
+            yield sse_event('done', {'response': "Error: El flujo de agentes no está disponible."})
+        return StreamingResponse(unavailable(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+    def build_done(out: dict) -> dict:
+        raw_response = out.get('final', 'Lo siento, no pude generar una respuesta.')
+        done = {'response': format_response_to_html(raw_response)}
+        if out.get('incomplete'):
+            done['incomplete'] = True
+        return done
+
+    return StreamingResponse(
+        stream_agent_sse(run_agent_flow_stream(request.message), coach.render_markdown_to_safe_html, build_done),
+        media_type='text/event-stream',
+        headers=SSE_HEADERS,
+    )
+
 
 app.include_router(coach.router, prefix="/api/coach", tags=["coach"])
+app.include_router(predict.router, prefix="/api/predict", tags=["predict"])
 
 
 # ========== Endpoints para manejo de PDFs ==========
 
-@app.post("/api/pdf/create", response_model=PDFCreateResponse)
-async def create_pdf(request: PDFCreateRequest, req: Request):
+def submit_pdf_job(request: PDFCreateRequest, base_url: str) -> PDFJob:
 	"""
-	Crea un PDF desde contenido HTML y lo guarda.
-	Retorna URLs para descargar y visualizar el PDF.
+	Encola la generación de un PDF en el pool de procesos (app/pdf_worker.py).
+	El ID del trabajo es el ID del PDF; los metadatos se guardan al terminar,
+	en este proceso. `base_url` es la URL pública del servidor (para el QR).
 	"""
-	try:
-		# Generar un ID único para el PDF
-		pdf_id = str(uuid.uuid4())
-		filename = f"{pdf_id}.pdf"
-		pdf_path = PDF_DIR / filename
-		
-		# Construir URL completa del PDF
-		base_url = str(req.base_url).rstrip('/')
-		pdf_view_url = f"{base_url}/api/pdf/{pdf_id}/view"
-		
-		# Agregar gráfico circular al inicio del HTML si se proporciona un porcentaje
-		html_content = request.html_content
-		if request.percentage > 0:
-			html_content = add_chart_to_html(html_content, request.percentage, f"{request.title} - Análisis")
-		
-		# Agregar código QR al final del HTML
-		html_with_qr = add_qr_to_html(html_content, pdf_view_url)
-		
-		# Convertir HTML a PDF usando xhtml2pdf
-		with open(pdf_path, "wb") as pdf_file:
-			pisa_status = pisa.CreatePDF(
-				html_with_qr.encode('utf-8'),
-				dest=pdf_file
-			)
-		
-		if pisa_status.err:
-			raise Exception(f"Error al generar PDF: {pisa_status.err}")
-		
+	# Generar un ID único para el PDF
+	pdf_id = str(uuid.uuid4())
+	filename = f"{pdf_id}.pdf"
+	pdf_path = PDF_DIR / filename
+	
+	# Construir URL completa del PDF
+	base_url = base_url.rstrip('/')
+	pdf_view_url = f"{base_url}/api/pdf/{pdf_id}/view"
+	
+	params = {
+		"html_content": request.html_content,
+		"pdf_path": str(pdf_path),
+		"pdf_view_url": pdf_view_url,
+		"title": request.title,
+		"percentage": request.percentage,
+	}
+	
+	def finalize(job: PDFJob) -> dict:
 		# Guardar metadatos
-		metadata = add_pdf_metadata(
+		return add_pdf_metadata(
 			pdf_id=pdf_id,
 			title=request.title,
 			description=request.description,
 			filename=filename
 		)
-		
-		return PDFCreateResponse(
-			pdf_id=pdf_id,
-			download_url=metadata["download_url"],
-			view_url=metadata["view_url"],
-			filename=filename,
-			created_at=metadata["created_at"]
-		)
 	
-	except Exception as e:
-		raise HTTPException(status_code=500, detail=f"Error al crear PDF: {str(e)}")
+	try:
+		return get_pdf_pool().submit(pdf_id, params, finalize)
+	except PDFQueueFull as e:
+		raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": PDF_RETRY_AFTER})
+	except PDFWorkerUnavailable as e:
+		raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": PDF_RETRY_AFTER})
+
+
+def _job_response(job: dict) -> dict:
+	return {
+		**job,
+		"status_url": f"/api/pdf/jobs/{job['job_id']}",
+		"download_url": f"/api/pdf/jobs/{job['job_id']}/download",
+	}
+
+
+async def _await_pdf(job: PDFJob) -> PDFCreateResponse:
+	"""Espera un trabajo hasta PDF_RENDER_TIMEOUT (504 si sigue en curso, 500 si falló)."""
+	try:
+		await get_pdf_pool().wait(job, timeout=PDF_RENDER_TIMEOUT)
+	except asyncio.TimeoutError:
+		raise HTTPException(status_code=504, detail=f"El PDF sigue en proceso; consulta /api/pdf/jobs/{job.job_id}")
+	
+	if job.status != "done":
+		raise HTTPException(status_code=500, detail=f"Error al crear PDF: {job.error}")
+	
+	metadata = job.result
+	return PDFCreateResponse(
+		pdf_id=metadata["pdf_id"],
+		download_url=metadata["download_url"],
+		view_url=metadata["view_url"],
+		filename=metadata["filename"],
+		created_at=metadata["created_at"]
+	)
+
+
+async def create_pdf_in_process(payload: dict, base_url: str, wait: bool) -> dict:
+	"""
+	Servicio de PDFs para api/coach.py sin pasar por HTTP: devuelve lo mismo que
+	/api/pdf/create (`wait=True`) o /api/pdf/jobs (`wait=False`).
+	"""
+	job = submit_pdf_job(PDFCreateRequest(**payload), base_url)
+	if not wait:
+		return _job_response(job.to_dict())
+	return (await _await_pdf(job)).model_dump()
+
+
+coach.set_pdf_service(create_pdf_in_process)
+
+
+@app.post("/api/pdf/create", response_model=PDFCreateResponse)
+async def create_pdf(request: PDFCreateRequest, req: Request):
+	"""
+	Crea un PDF desde contenido HTML y lo guarda.
+	Retorna URLs para descargar y visualizar el PDF.
+	
+	El renderizado corre en el pool de procesos; este handler solo espera el
+	resultado, sin bloquear el event loop.
+	"""
+	return await _await_pdf(submit_pdf_job(request, str(req.base_url)))
+
+
+@app.post("/api/pdf/jobs", status_code=202)
+async def create_pdf_job(request: PDFCreateRequest, req: Request):
+	"""
+	Encola un PDF y responde de inmediato con el ID del trabajo.
+	Responde 429 (con Retry-After) si la cola está llena.
+	
+	`status_url` y `download_url` funcionan desde cualquier worker o réplica que
+	comparta PDF_JOB_DIR, generated_pdfs/ y data/pdf_metadata.json; si no se
+	comparten, solo el proceso que aceptó el trabajo lo conoce.
+	"""
+	return _job_response(submit_pdf_job(request, str(req.base_url)).to_dict())
+
+
+@app.get("/api/pdf/jobs/{job_id}")
+async def get_pdf_job(job_id: str):
+	"""Estado de un trabajo de PDF: queued, running, done o error."""
+	job = get_pdf_pool().lookup(job_id)
+	if job is None:
+		raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+	return _job_response(job)
+
+
+@app.get("/api/pdf/jobs/{job_id}/download")
+async def download_pdf_job(job_id: str):
+	"""Descarga el PDF de un trabajo terminado (409 mientras no esté listo)."""
+	job = get_pdf_pool().lookup(job_id)
+	if job is None:
+		raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+	status = job["status"]
+	if status == "error":
+		raise HTTPException(status_code=500, detail=f"Error al crear PDF: {job.get('error')}")
+	if status != "done":
+		raise HTTPException(status_code=409, detail=f"El PDF aún no está listo (estado: {status})")
+	return await download_pdf(job_id)
 
 
 @app.get("/api/pdf/{pdf_id}/download")
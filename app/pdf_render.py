@@ -0,0 +1,256 @@
+"""
+Renderizado de informes PDF (HTML -> PDF con gráfico de riesgo y código QR).
+
+Estas funciones son CPU-bound (matplotlib, qrcode, xhtml2pdf) y se ejecutan en
+los procesos del pool de app/pdf_worker.py, nunca en el event loop del servidor.
+"""
+from pathlib import Path
+from xhtml2pdf import pisa
+from io import BytesIO
+import qrcode
+import base64
+import matplotlib.pyplot as plt
+import matplotlib
+
+
+def generate_qr_code(url: str) -> str:
+	"""
+	Genera un código QR para la URL proporcionada y lo retorna como base64.
+	
+	Args:
+		url: URL para la que se generará el código QR
+		
+	Returns:
+		String base64 del código QR en formato PNG
+	"""
+	# Crear código QR
+	qr = qrcode.QRCode(
+		version=1,
+		error_correction=qrcode.constants.ERROR_CORRECT_L,
+		box_size=10,
+		border=4,
+	)
+	qr.add_data(url)
+	qr.make(fit=True)
+	
+	# Generar imagen
+	img = qr.make_image(fill_color="black", back_color="white")
+	
+	# Convertir a base64
+	buffer = BytesIO()
+	img.save(buffer, format='PNG')
+	buffer.seek(0)
+	img_base64 = base64.b64encode(buffer.read()).decode()
+	
+	return img_base64
+
+
+def generate_circular_chart(percentage: float, title: str = "Progreso") -> str:
+	"""
+	Genera un gráfico circular (donut chart) para mostrar un porcentaje.
+	
+	Args:
+		percentage: Valor del porcentaje (0-100)
+		title: Título del gráfico
+		
+	Returns:
+		String base64 del gráfico en formato PNG
+	"""
+	# Configurar matplotlib para no usar GUI
+	matplotlib.use('Agg')
+	
+	# Asegurar que el porcentaje esté en el rango correcto
+	percentage = max(0, min(100, percentage))
+	remaining = 100 - percentage
+	
+	# Crear figura más grande y con mejor aspecto
+	fig, ax = plt.subplots(figsize=(8, 8), facecolor='white')
+	
+	# Determinar color basado en el porcentaje (semáforo de riesgo)
+	if percentage < 30:
+		main_color = '#10b981'  # Verde (bajo riesgo)
+		risk_label = 'Riesgo Bajo'
+	elif percentage < 60:
+		main_color = '#f59e0b'  # Amarillo/Naranja (riesgo medio)
+		risk_label = 'Riesgo Medio'
+	else:
+		main_color = '#ef4444'  # Rojo (riesgo alto)
+		risk_label = 'Riesgo Alto'
+	
+	# Datos para el gráfico
+	sizes = [percentage, remaining]
+	colors = [main_color, '#f0f0f0']  # Color dinámico para riesgo, gris muy claro para restante
+	
+	# Crear el gráfico circular (donut) sin explosión para aspecto más limpio
+	wedges, texts = ax.pie(
+		sizes,
+		colors=colors,
+		startangle=90,
+		wedgeprops=dict(width=0.3, edgecolor='white', linewidth=4)
+	)
+	
+	# Agregar el porcentaje en el centro del círculo (arriba)
+	ax.text(0, 0.2, f'{percentage:.1f}%', 
+			ha='center', va='center', 
+			fontsize=48, fontweight='bold', 
+			color='#1f2937')
+	
+	# Agregar etiqueta de nivel de riesgo en el centro del círculo (abajo)
+	ax.text(0, -0.2, risk_label, 
+			ha='center', va='center', 
+			fontsize=22, fontweight='600', 
+			color=main_color)
+	
+	# Agregar título FUERA y debajo del círculo
+	ax.text(0, -1.6, title, 
+			ha='center', va='center', 
+			fontsize=20, fontweight='bold', 
+			color='#374151')
+	
+	# Asegurar que el gráfico sea circular
+	ax.axis('equal')
+	
+	# Guardar en buffer con mayor resolución
+	buffer = BytesIO()
+	plt.tight_layout(pad=0.5)
+	plt.savefig(buffer, format='PNG', dpi=200, bbox_inches='tight', 
+				facecolor='white', edgecolor='none')
+	plt.close(fig)
+	
+	# Convertir a base64
+	buffer.seek(0)
+	img_base64 = base64.b64encode(buffer.read()).decode()
+	
+	return img_base64
+
+
+def add_chart_to_html(html_content: str, percentage: float, chart_title: str = "Nivel de Riesgo") -> str:
+	"""
+	Agrega un gráfico circular al inicio del contenido HTML.
+	
+	Args:
+		html_content: Contenido HTML original
+		percentage: Porcentaje para mostrar (0-100)
+		chart_title: Título del gráfico
+		
+	Returns:
+		HTML con el gráfico agregado al inicio
+	"""
+	# Generar gráfico circular
+	chart_base64 = generate_circular_chart(percentage, chart_title)
+	
+	# HTML del gráfico centrado al inicio del documento
+	chart_html = f"""
+	<!DOCTYPE html>
+	<html>
+	<head>
+		<meta charset="utf-8">
+		<style>
+			body {{
+				font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+				margin: 0;
+				padding: 20px;
+				background-color: #f9fafb;
+			}}
+			.chart-container {{
+				text-align: center;
+				margin: 40px auto 60px;
+				padding: 30px;
+				background-color: white;
+				border-radius: 12px;
+				box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+				max-width: 600px;
+			}}
+			.chart-container img {{
+				max-width: 500px;
+				width: 100%;
+				height: auto;
+				margin: 0 auto;
+			}}
+		</style>
+	</head>
+	<body>
+		<div class="chart-container">
+			<img src="data:image/png;base64,{chart_base64}" alt="Grafico de Riesgo">
+		</div>
+	"""
+	
+	# Limpiar el HTML original de etiquetas de documento si las tiene
+	content = html_content
+	if '<!DOCTYPE' in content:
+		# Extraer solo el contenido del body
+		import re
+		body_match = re.search(r'<body[^>]*>(.*?)</body>', content, re.DOTALL | re.IGNORECASE)
+		if body_match:
+			content = body_match.group(1)
+		else:
+			# Si no hay body, quitar html, head, body tags
+			content = re.sub(r'<html[^>]*>|</html>|<head[^>]*>.*?</head>|<body[^>]*>|</body>', '', content, flags=re.DOTALL | re.IGNORECASE)
+	
+	# Combinar gráfico con contenido
+	return chart_html + content
+
+
+def add_qr_to_html(html_content: str, pdf_url: str) -> str:
+	"""
+	Agrega un código QR al final del contenido HTML.
+	
+	Args:
+		html_content: Contenido HTML original
+		pdf_url: URL completa del PDF para generar el QR
+		
+	Returns:
+		HTML con el código QR agregado al final
+	"""
+	# Generar código QR
+	qr_base64 = generate_qr_code(pdf_url)
+	
+	# HTML del código QR centrado al final del documento
+	qr_html = f"""
+	<div style="page-break-before: avoid; margin-top: 50px; padding-top: 30px; border-top: 2px solid #e0e0e0; text-align: center;">
+		<h3 style="color: #666; font-size: 16px; margin-bottom: 20px;">Accede a este documento escaneando el código QR</h3>
+		<img src="data:image/png;base64,{qr_base64}" alt="QR Code" style="width: 200px; height: 200px; margin: 0 auto; display: block;">
+		<p style="margin-top: 15px; font-size: 12px; color: #888;">Escanea este código para ver el PDF en línea</p>
+	</div>
+	</body>
+	</html>
+	"""
+	
+	# Reemplazar el cierre de body y html con el QR incluido
+	if '</body>' in html_content and '</html>' in html_content:
+		html_content = html_content.replace('</body>', '').replace('</html>', '')
+		html_content += qr_html
+	else:
+		# Si no hay cierre de etiquetas, agregar al final
+		html_content += qr_html
+	
+	return html_content
+
+
+def render_pdf(html_content: str, pdf_path: str, pdf_view_url: str, title: str, percentage: float = 0.0) -> int:
+	"""
+	Genera el PDF completo en `pdf_path`: gráfico circular al inicio (si hay
+	porcentaje), QR con `pdf_view_url` al final y conversión con xhtml2pdf.
+	
+	Returns:
+		Tamaño del archivo generado en bytes
+	"""
+	# Agregar gráfico circular al inicio del HTML si se proporciona un porcentaje
+	if percentage > 0:
+		html_content = add_chart_to_html(html_content, percentage, f"{title} - Análisis")
+	
+	# Agregar código QR al final del HTML
+	html_with_qr = add_qr_to_html(html_content, pdf_view_url)
+	
+	# Convertir HTML a PDF usando xhtml2pdf
+	with open(pdf_path, "wb") as pdf_file:
+		pisa_status = pisa.CreatePDF(
+			html_with_qr.encode('utf-8'),
+			dest=pdf_file
+		)
+	
+	if pisa_status.err:
+		Path(pdf_path).unlink(missing_ok=True)
+		raise RuntimeError(f"Error al generar PDF: {pisa_status.err}")
+	
+	return Path(pdf_path).stat().st_size
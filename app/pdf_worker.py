@@ -0,0 +1,236 @@
+"""
+Pool de procesos para generar PDFs fuera del event loop.
+
+`render_pdf` (matplotlib + qrcode + xhtml2pdf) tarda de cientos de ms a varios
+segundos de CPU; ejecutarlo dentro de un handler `async` bloquea todo el
+servidor, chat incluido. Aquí cada PDF es un trabajo que corre en un
+ProcessPoolExecutor:
+
+- la cola está acotada: con PDF_WORKERS + PDF_QUEUE_SIZE trabajos pendientes,
+  `submit` lanza `PDFQueueFull` (HTTP 429 con Retry-After) en lugar de acumular;
+- si el pool se rompe (un proceso murió) se lanza `PDFWorkerUnavailable` (503)
+  y el siguiente envío crea un pool nuevo;
+- al terminar, `finalize` se ejecuta en el proceso principal (p. ej. escribir los
+  metadatos), de modo que solo el servidor toca el archivo de metadatos.
+
+Los trabajos terminados se conservan (hasta PDF_JOB_HISTORY) para consultar su
+estado: queued -> running -> done | error.
+
+Con varios workers de uvicorn (o réplicas) cada proceso tiene su propio pool, y
+la consulta de un trabajo puede llegar a otro proceso. Por eso el estado de cada
+trabajo se guarda también como JSON en PDF_JOB_DIR (al encolarse y al terminar)
+y `lookup` lo lee de ahí cuando el trabajo no es local. El directorio, igual que
+los PDFs y sus metadatos, debe ser compartido entre los procesos; desde otro
+proceso un trabajo en curso conserva el estado guardado al encolarse hasta que
+termina.
+"""
+from collections import OrderedDict
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+try:
+    from app.pdf_render import render_pdf
+except ImportError:
+    from pdf_render import render_pdf  # type: ignore
+
+
+DEFAULT_JOB_DIR = Path(__file__).resolve().parent.parent / 'generated_pdfs' / 'jobs'
+_JOB_ID_RE = re.compile(r'[0-9A-Za-z_-]{1,64}')
+
+
+class PDFQueueFull(RuntimeError):
+    """La cola de renderizado está llena; reintentar más tarde."""
+
+
+class PDFWorkerUnavailable(RuntimeError):
+    """El pool de procesos no está disponible."""
+
+
+class PDFJob:
+    """Un PDF pendiente, en curso o terminado."""
+
+    def __init__(self, job_id: str, params: Dict[str, Any]):
+        self.job_id = job_id
+        self.params = params
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.future = None
+        self.done = asyncio.Event()
+
+    def refresh(self) -> str:
+        if self.status == 'queued' and self.future is not None and self.future.running():
+            self.status = 'running'
+        return self.status
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            'job_id': self.job_id,
+            'status': self.refresh(),
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+        if self.finished_at is not None:
+            data['elapsed_ms'] = round((self.finished_at - self.created_at) * 1000, 1)
+        if self.result is not None:
+            data['result'] = self.result
+        if self.error is not None:
+            data['error'] = self.error
+        return data
+
+
+class PDFWorkerPool:
+    """ProcessPoolExecutor con cola acotada y registro de trabajos."""
+
+    def __init__(self, workers: int = 2, queue_size: int = 16, history: int = 1000, state_dir: Optional[Path] = None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.history = history
+        self.state_dir = Path(state_dir) if state_dir else None
+        if self.state_dir is not None:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._jobs: 'OrderedDict[str, PDFJob]' = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: los procesos no heredan hilos ni conexiones abiertas del servidor
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def submit(self, job_id: str, params: Dict[str, Any], finalize: Callable[[PDFJob], Dict[str, Any]]) -> PDFJob:
+        """
+        Encola `render_pdf(**params)`; `finalize(job)` se llama en el proceso
+        principal al terminar y su resultado queda en `job.result`.
+        Debe llamarse desde el event loop.
+        """
+        with self._lock:
+            if self._pending >= self.capacity:
+                raise PDFQueueFull(f'Cola de PDFs llena ({self._pending} trabajos pendientes)')
+            job = PDFJob(job_id, params)
+            try:
+                job.future = self._get_executor().submit(render_pdf, **params)
+            except (BrokenProcessPool, RuntimeError) as e:
+                self._executor = None
+                raise PDFWorkerUnavailable(f'Pool de PDFs no disponible: {e}') from e
+            self._pending += 1
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.history:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if not oldest.done.is_set():
+                    break
+                del self._jobs[oldest_id]
+                self._drop_state(oldest_id)
+        self._save_state(job)
+        asyncio.ensure_future(self._track(job, finalize))
+        return job
+
+    async def _track(self, job: PDFJob, finalize: Callable[[PDFJob], Dict[str, Any]]) -> None:
+        try:
+            await asyncio.wrap_future(job.future)
+            job.result = finalize(job)
+            job.status = 'done'
+        except BrokenProcessPool as e:
+            with self._lock:
+                self._executor = None
+            job.status, job.error = 'error', f'Proceso de PDFs interrumpido: {e}'
+            logger.error('Trabajo PDF %s: %s', job.job_id, job.error)
+        except Exception as e:
+            job.status, job.error = 'error', str(e)
+            logger.error('Trabajo PDF %s falló: %s', job.job_id, e)
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+            self._save_state(job)
+            job.done.set()
+
+    def _state_path(self, job_id: str) -> Optional[Path]:
+        if self.state_dir is None or not _JOB_ID_RE.fullmatch(job_id):
+            return None
+        return self.state_dir / f'{job_id}.json'
+
+    def _save_state(self, job: PDFJob) -> None:
+        path = self._state_path(job.job_id)
+        if path is None:
+            return
+        tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+        try:
+            tmp.write_text(json.dumps(job.to_dict(), ensure_ascii=False), encoding='utf-8')
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning('No se pudo guardar el estado del trabajo PDF %s: %s', job.job_id, e)
+
+    def _drop_state(self, job_id: str) -> None:
+        path = self._state_path(job_id)
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+    def get(self, job_id: str) -> Optional[PDFJob]:
+        return self._jobs.get(job_id)
+
+    def lookup(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Estado de un trabajo (`PDFJob.to_dict`), sea de este proceso o de otro que comparta `state_dir`."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        path = self._state_path(job_id)
+        if path is None:
+            return None
+        try:
+            return json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+
+    async def wait(self, job: PDFJob, timeout: Optional[float] = None) -> PDFJob:
+        await asyncio.wait_for(job.done.wait(), timeout)
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        return {'workers': self.workers, 'queue_size': self.queue_size, 'pending': self._pending}
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_POOL: Optional[PDFWorkerPool] = None
+
+
+def get_pdf_pool() -> PDFWorkerPool:
+    """Pool de PDFs del proceso (PDF_WORKERS, PDF_QUEUE_SIZE, PDF_JOB_HISTORY, PDF_JOB_DIR)."""
+    global _POOL
+    if _POOL is None:
+        _POOL = PDFWorkerPool(
+            workers=int(os.getenv('PDF_WORKERS', '2')),
+            queue_size=int(os.getenv('PDF_QUEUE_SIZE', '16')),
+            history=int(os.getenv('PDF_JOB_HISTORY', '1000')),
+            state_dir=Path(os.getenv('PDF_JOB_DIR', str(DEFAULT_JOB_DIR))),
+        )
+    return _POOL
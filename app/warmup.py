@@ -0,0 +1,185 @@
+"""
+Calentamiento del worker al arrancar y estado de preparación (readiness).
+
+En un hilo de fondo se cargan, en orden, los prompts de los agentes, el índice
+vectorial residente, el embedder local (solo sin OPENAI_API_KEY) y el modelo
+XGBoost con su backend de inferencia, y se ejecutan una predicción y una
+recuperación de prueba. Mientras tanto `/ping` responde (el proceso está vivo)
+pero `/ready` devuelve 503, para que el balanceador solo envíe tráfico a
+workers ya calientes.
+
+Configuración por entorno:
+- WARMUP_REQUIRED: pasos cuyo fallo deja el worker no listo (por defecto "prompts,model")
+- WARMUP_RETRIEVAL: '0' para omitir la recuperación de prueba (con OpenAI hace
+  una llamada de embeddings)
+"""
+from typing import Callable, Dict, Optional
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+try:
+    from src.agents.prompt_registry import get_prompt_registry
+    from src.vector_index import get_resident_index
+    from src.local_embedder import get_local_embedder
+    from src.retrieval import retrieve_relevant
+except Exception:
+    get_prompt_registry = None
+    get_resident_index = None
+    get_local_embedder = None
+    retrieve_relevant = None
+
+try:
+    from api.predict import get_scorer, predict_diabetes_risk
+    import api.predict as predict_module
+except Exception:
+    get_scorer = None
+    predict_diabetes_risk = None
+    predict_module = None
+
+
+class SkipStep(Exception):
+    """El paso no aplica en esta configuración (no es un error)."""
+
+
+class WarmupState:
+    """Estado de cada paso del calentamiento y si el worker está listo."""
+
+    def __init__(self, required):
+        self.required = set(required)
+        self.steps: Dict[str, dict] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def ready(self) -> bool:
+        if not self.finished:
+            return False
+        return all(self.steps.get(name, {}).get('status') in ('ok', 'skipped') for name in self.required)
+
+    def run_step(self, name: str, fn: Callable[[], Optional[str]]) -> None:
+        with self._lock:
+            self.steps[name] = {'status': 'running'}
+        t0 = time.perf_counter()
+        try:
+            detail = fn()
+            status = 'ok'
+        except SkipStep as e:
+            status, detail = 'skipped', str(e)
+        except Exception as e:
+            logger.exception('Calentamiento: falló el paso %s', name)
+            status, detail = 'error', str(e)
+        step = {'status': status, 'ms': round((time.perf_counter() - t0) * 1000, 1)}
+        if detail:
+            step['detail'] = detail
+        with self._lock:
+            self.steps[name] = step
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            steps = {k: dict(v) for k, v in self.steps.items()}
+        total = None
+        if self.started_at is not None and self.finished_at is not None:
+            total = round((self.finished_at - self.started_at) * 1000, 1)
+        return {'ready': self.ready, 'finished': self.finished, 'total_ms': total, 'steps': steps}
+
+
+def _load_prompts() -> str:
+    if get_prompt_registry is None:
+        raise RuntimeError('Registro de prompts no disponible')
+    versions = get_prompt_registry().reload()
+    if not versions:
+        raise RuntimeError('No se encontraron prompts de agentes en kb/agents')
+    return f'{len(versions)} prompts'
+
+
+def _load_index() -> str:
+    if get_resident_index is None:
+        raise RuntimeError('Índice vectorial no disponible')
+    snapshot = get_resident_index().get()
+    if snapshot is None:
+        raise SkipStep('no hay índice vectorial publicado en kb/db')
+    return f'versión {snapshot.version}, {len(snapshot)} vectores'
+
+
+def _load_embedder() -> str:
+    if os.getenv('OPENAI_API_KEY'):
+        raise SkipStep('embeddings vía OpenAI')
+    if get_local_embedder is None:
+        raise RuntimeError('Embedder local no disponible')
+    embedder = get_local_embedder()
+    embedder.load()
+    embedder.encode(['calentamiento'])
+    return embedder.model_name
+
+
+def _load_model() -> str:
+    if get_scorer is None:
+        raise RuntimeError('Módulo de predicción no disponible')
+    get_scorer()
+    return f'backend {predict_module._SCORER_BACKEND}'
+
+
+def _dummy_prediction() -> str:
+    if predict_diabetes_risk is None:
+        raise RuntimeError('Módulo de predicción no disponible')
+    variables = {name: 0 for name in predict_module.EXPECTED_FEATURES}
+    variables.update(Age_Years=45, Weight_kg=70, Height_cm=170, BMI=24.2, Total_MET_Score=600)
+    score, level = predict_diabetes_risk(variables)
+    return f'{score:.3f} ({level})'
+
+
+def _dummy_retrieval() -> str:
+    if os.getenv('WARMUP_RETRIEVAL', '1') == '0':
+        raise SkipStep('desactivado con WARMUP_RETRIEVAL=0')
+    if retrieve_relevant is None:
+        raise RuntimeError('Recuperación no disponible')
+    if get_resident_index is None or get_resident_index().get() is None:
+        raise SkipStep('sin índice')
+    hits = retrieve_relevant('¿Qué es la diabetes?', top_k=1)
+    return f'{len(hits)} resultados'
+
+
+WARMUP_STEPS = (
+    ('prompts', _load_prompts),
+    ('index', _load_index),
+    ('embedder', _load_embedder),
+    ('model', _load_model),
+    ('prediction', _dummy_prediction),
+    ('retrieval', _dummy_retrieval),
+)
+
+
+def run_warmup(state: 'WarmupState') -> None:
+    state.started_at = time.perf_counter()
+    for name, fn in WARMUP_STEPS:
+        state.run_step(name, fn)
+    state.finished_at = time.perf_counter()
+    level = logging.INFO if state.ready else logging.WARNING
+    logger.log(level, 'Calentamiento terminado en %.0f ms (listo=%s)', (state.finished_at - state.started_at) * 1000, state.ready)
+
+
+_STATE: Optional[WarmupState] = None
+
+
+def get_warmup_state() -> WarmupState:
+    global _STATE
+    if _STATE is None:
+        required = [s.strip() for s in os.getenv('WARMUP_REQUIRED', 'prompts,model').split(',') if s.strip()]
+        _STATE = WarmupState(required)
+    return _STATE
+
+
+def start_warmup() -> threading.Thread:
+    """Lanza el calentamiento en un hilo de fondo (el servidor acepta conexiones mientras tanto)."""
+    thread = threading.Thread(target=run_warmup, args=(get_warmup_state(),), name='warmup', daemon=True)
+    thread.start()
+    return thread
@@ -1,30 +1,45 @@
 from pathlib import Path
 import os
+import re
 import sys
+import asyncio
 import json
+import time
 import logging
-from typing import List, Optional, Callable
+from typing import List, Optional, Callable, AsyncIterator
 from functools import lru_cache
-
-import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # Intento robusto de importar `utils` desde `src` o como módulo plano
 try:
     from src import utils
-    from src.agents.openai_utils import get_call_model
-    from src.retrieval import retrieve_relevant
+    from src.agents.openai_utils import get_call_model, get_async_call_model, get_async_stream_model, track_llm_usage, summarize_llm_usage
+    from src.retrieval import retrieve_relevant, search_vectors
+    from src.agents.risk_classifier import get_risk_classifier, log_risk_label, fold
+    from src.agents.response_cache import get_response_cache
+    from src.agents.prompt_registry import get_prompt_registry
+    from src.vector_index import get_resident_index
 except ImportError:
     project_root = Path(__file__).parent.parent
     if str(project_root) not in sys.path:
         sys.path.insert(0, str(project_root))
     try:
         from src import utils
-        from src.agents.openai_utils import get_call_model
-        from src.retrieval import retrieve_relevant
+        from src.agents.openai_utils import get_call_model, get_async_call_model, get_async_stream_model, track_llm_usage, summarize_llm_usage
+        from src.retrieval import retrieve_relevant, search_vectors
+        from src.agents.risk_classifier import get_risk_classifier, log_risk_label, fold
+        from src.agents.response_cache import get_response_cache
+        from src.agents.prompt_registry import get_prompt_registry
+        from src.vector_index import get_resident_index
     except ImportError:
         import utils  # type: ignore
-        from openai_utils import get_call_model # type: ignore
-        from retrieval import retrieve_relevant # type: ignore
+        from openai_utils import get_call_model, get_async_call_model, get_async_stream_model, track_llm_usage, summarize_llm_usage # type: ignore
+        from retrieval import retrieve_relevant, search_vectors # type: ignore
+        from risk_classifier import get_risk_classifier, log_risk_label, fold # type: ignore
+        from response_cache import get_response_cache # type: ignore
+        from prompt_registry import get_prompt_registry # type: ignore
+        from vector_index import get_resident_index # type: ignore
 
 
 logger = logging.getLogger(__name__)
@@ -33,21 +48,6 @@ if not logger.handlers:
     logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 
 
-# Directorio con instrucciones de agentes (markdown)
-KB_AGENTS_DIR = Path(__file__).resolve().parent.parent / 'kb' / 'agents'
-
-# Cache del índice en memoria para evitar lecturas repetidas desde disco
-_INDEX_CACHE: Optional[tuple] = None  # (emb_arr, metadatas)
-
-
-def _load_index_cached(index_path: Path):
-    global _INDEX_CACHE
-    if _INDEX_CACHE is None:
-        emb_arr, metadatas = utils.load_index(index_path)
-        _INDEX_CACHE = (emb_arr, metadatas)
-    return _INDEX_CACHE
-
-
 @lru_cache(maxsize=256)
 def _embed_query_cached(query: str):
     try:
@@ -59,35 +59,226 @@ def _embed_query_cached(query: str):
 
 
 def _read_agent_instructions(name: str) -> str:
-    path = KB_AGENTS_DIR / f"{name}.md"
-    if not path.exists():
-        return ""
-    text = path.read_text(encoding='utf-8')
-    # eliminar fences de código para evitar confundir prompts
-    lines = []
-    skip = False
-    for ln in text.splitlines():
-        if ln.strip().startswith('```'):
-            skip = not skip
-            continue
-        if not skip:
-            lines.append(ln)
-    return '\n'.join(lines)
+    # Instrucciones precargadas (kb/agents/<name>.md, sin bloques de código)
+    return get_prompt_registry().get(name)
+
+
+RISK_LEVELS = ('bajo', 'medio', 'alto')
+
+SIMPLE_GREETINGS = ['hola', 'hi', 'hello', 'buenos días', 'buenas tardes', 'buenas noches',
+                    'hey', 'saludos', 'qué tal', 'cómo estás', 'como estas']
+
+GREETING_RESPONSE = '¡Hola! 👋 Soy MediNutrIA, tu asistente de salud y nutrición. ¿En qué puedo ayudarte hoy? Puedes preguntarme sobre alimentación, ejercicio, condiciones de salud o cualquier tema relacionado con tu bienestar.'
+
+DISCLAIMER = "\n\n\n\n💙Recuerda: Esta información es solo para fines educativos y está basada en una recopilación de datos confiables. Sin embargo, **no reemplaza una consulta médica profesional**. Siempre es importante que consultes con tu médico o un profesional de la salud calificado para recibir un diagnóstico y tratamiento personalizado. ¡Tu salud es lo más importante! 💙"
+
+EMPTY_FINAL = 'Lo siento — no pude generar una respuesta en este momento. Intenta de nuevo más tarde.'
+
+
+def _risk_prompt(user_input: str) -> str:
+    return _read_agent_instructions('risk_selector_agent') + f"\n\nUser query:\n{user_input}\n\nPor favor responde solo con 'bajo', 'medio' o 'alto'."
+
+
+def _parse_risk(risk_out: Optional[str]) -> str:
+    words = (risk_out or '').strip().lower().split()
+    risk = words[0] if words else 'medio'
+    return risk if risk in RISK_LEVELS else 'medio'
+
+
+def _draft_prompt(user_input: str, context: str, risk: str) -> str:
+    # Incluir el nivel de riesgo en el prompt para que el agente adapte su respuesta
+    risk_info = f"\n\n**NIVEL DE RIESGO DETECTADO: {risk.upper()}**\nAdapta tu respuesta según las instrucciones para riesgo {risk}."
+    return _read_agent_instructions('retrieval') + risk_info + f"\n\nConsulta:\n{user_input}\n\nContexto recuperado:\n{context}"
+
+
+def _draft_fallback_prompt(user_input: str) -> str:
+    return f"Responde brevemente a la consulta del usuario:\n{user_input}\n\nProvee recomendaciones prácticas y pasos a seguir."
+
+
+def _formatter_prompt(draft: str) -> str:
+    return _read_agent_instructions('formatter') + f"\n\nBorrador:\n{draft}\n\nPor favor formatea según las reglas. NO incluyas las palabras 'Borrador:' o 'Revisión:' en tu respuesta."
+
+
+def _single_pass_prompt(user_input: str, context: str, risk: str) -> str:
+    # Modo de una sola pasada: instrucciones de contenido (retrieval) y de formato
+    # (formatter) en un único prompt, sin borrador intermedio.
+    risk_info = f"\n\n**NIVEL DE RIESGO DETECTADO: {risk.upper()}**\nAdapta tu respuesta según las instrucciones para riesgo {risk}."
+    return (
+        _read_agent_instructions('retrieval') + risk_info
+        + "\n\n---\n\nREGLAS DE FORMATO DE LA RESPUESTA FINAL:\n\n" + _read_agent_instructions('formatter')
+        + f"\n\nConsulta:\n{user_input}\n\nContexto recuperado:\n{context}"
+        + "\n\nEscribe directamente la respuesta final ya formateada según las reglas. NO escribas un borrador previo ni incluyas las palabras 'Borrador:' o 'Revisión:'."
+    )
+
+
+def _formatter_fallback_prompt(user_input: str) -> str:
+    return f"Por favor, responde de forma clara y breve a esta consulta:\n{user_input}\n\nIncluye recomendaciones prácticas y próximas acciones cuando corresponda."
+
+
+def _clean_formatted(final: str) -> str:
+    if not final:
+        final = EMPTY_FINAL
+    return final.replace('<p>', '').replace('</p>', '').replace('<br>', '\n').strip()
+
+
+def _greeting_result(user_input: str) -> Optional[dict]:
+    """Respuesta directa para saludos simples (sin flujo completo), o None."""
+    user_lower = user_input.lower().strip()
+    is_simple_greeting = any(greeting == user_lower or user_lower.startswith(greeting + ' ') or user_lower.startswith(greeting + ',')
+                             for greeting in SIMPLE_GREETINGS)
+    if is_simple_greeting and len(user_input.split()) <= 3:
+        return {
+            'risk': 'bajo',
+            'retrieved': [],
+            'draft': '',
+            'final': GREETING_RESPONSE,
+        }
+    return None
+
+
+def _finalize(final: str) -> str:
+    # Limpiar marcadores de debug que puedan haber quedado
+    final = final.replace('Borrador:', '').replace('Revisión:', '').strip()
+    final = final.replace('<p>', '').replace('</p>', '').replace('<br>', '\n').strip()
+
+    # Añadir disclaimer médico solo si la respuesta contiene contenido de salud sustancial
+    # (evitar disclaimer en saludos o respuestas muy cortas)
+    if len(final) > 100:  # Solo si la respuesta tiene contenido sustancial
+        final = final + DISCLAIMER
+    return final
+
+
+class _StageTimer:
+    """Acumula la duración (ms) de cada etapa del flujo y el total."""
+
+    def __init__(self):
+        self._t0 = time.perf_counter()
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round((time.perf_counter() - t0) * 1000, 1)
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self._t0) * 1000, 1)
+
+    def mark(self, name: str) -> None:
+        """Registra en `name` el tiempo transcurrido desde el inicio (p. ej. primer token)."""
+        self.timings[name] = self.elapsed_ms()
+
+    def finish(self) -> dict:
+        self.mark('total')
+        return self.timings
+
+
+# Hilos para solapar etapas independientes del flujo síncrono (p. ej. recuperación)
+_STAGE_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('AGENT_STAGE_THREADS', '8')), thread_name_prefix='agent-stage')
+
+
+def _timed_call(timer: _StageTimer, name: str, fn: Callable, *args):
+    with timer.stage(name):
+        return fn(*args)
+
+
+PIPELINE_MODES = ('two_pass', 'single_pass')
+
+
+def _pipeline_mode(mode: Optional[str] = None) -> str:
+    """Modo de generación: `two_pass` (borrador + formateador) o `single_pass` (una llamada).
+
+    Se configura con AGENT_PIPELINE_MODE; un valor desconocido usa `two_pass`.
+    """
+    mode = (mode or os.getenv('AGENT_PIPELINE_MODE', 'two_pass')).strip().lower()
+    return mode if mode in PIPELINE_MODES else 'two_pass'
+
+
+# Prompts de los que depende la respuesta final (su hash invalida la caché de respuestas)
+AGENT_PROMPTS = ('risk_selector_agent', 'retrieval', 'formatter')
+
+
+def _prompt_versions() -> dict:
+    return get_prompt_registry().versions(AGENT_PROMPTS)
+
+
+def _cache_namespace(mode: str) -> tuple:
+    """Versión de todo lo que determina una respuesta: índice de la KB, prompts y modo."""
+    snapshot = get_resident_index().get()
+    return (snapshot.version if snapshot is not None else None, tuple(sorted(_prompt_versions().items())), mode)
+
+
+_NUMBER_RE = re.compile(r'\d+(?:[.,]\d+)?')
+
+
+def _cache_key(user_input: str) -> tuple:
+    """Parte de la consulta que debe coincidir exactamente para reutilizar una respuesta.
+
+    El embedding apenas distingue "glucosa en 250" de "glucosa en 50", así que se
+    exige que coincidan las cifras mencionadas y la etiqueta del clasificador local.
+    """
+    numbers = tuple(n.replace(',', '.') for n in _NUMBER_RE.findall(fold(user_input)))
+    prediction = _local_risk(user_input)
+    return numbers, prediction.label if prediction is not None else None
+
+
+def _cache_lookup(user_input: str, mode: str):
+    """Consulta la caché semántica. Devuelve (caché, embedding, (namespace, key), acierto o None)."""
+    cache = get_response_cache()
+    if cache is None:
+        return None, None, None, None
+    q_emb = _embed_query_cached(user_input)
+    scope = (_cache_namespace(mode), _cache_key(user_input))
+    return cache, q_emb, scope, cache.get(q_emb, *scope)
+
+
+def _cache_hit_result(hit: tuple, timer: _StageTimer) -> dict:
+    out, similarity = hit
+    out['cache'] = {'hit': True, 'similarity': round(similarity, 4)}
+    out['timings'] = timer.finish()
+    return out
+
+
+def _cache_store(cache, q_emb, scope, out: dict) -> None:
+    # Las respuestas de riesgo alto nunca se reutilizan: cada caso urgente se evalúa de nuevo
+    if cache is None or not out.get('final') or out['final'].startswith(EMPTY_FINAL) or out.get('risk') == 'alto':
+        return
+    cache.put(q_emb, {k: v for k, v in out.items() if k != 'timings'}, *scope)
+
+
+def _stage_models() -> tuple[str, str, str]:
+    """Devuelve (modelo por defecto, modelo del borrador, modelo del formateador)."""
+    model_default = os.getenv('LLM_MODEL', 'gpt-4')
+    # Modelos configurables: para reducir latencia podemos usar un modelo más barato
+    # para la generación del borrador. Ajusta con la variable DRAFT_MODEL.
+    draft_model = os.getenv('DRAFT_MODEL', model_default)
+    formatter_model = os.getenv('FORMATTER_MODEL', model_default)
+    return model_default, draft_model, formatter_model
+
+
+def _local_risk(user_input: str):
+    """Predicción del clasificador local, o None si está desactivado (RISK_SELECTOR=llm)."""
+    classifier = get_risk_classifier()
+    if classifier is None:
+        return None
+    return classifier.predict(user_input)
 
 
 def run_risk_selector(user_input: str, call_model: Callable, model_default: str) -> str:
-    risk_prompt = _read_agent_instructions('risk_selector_agent') + f"\n\nUser query:\n{user_input}\n\nPor favor responde solo con 'bajo', 'medio' o 'alto'."
+    # El clasificador local resuelve la mayoría de los turnos sin llamar al LLM;
+    # solo con baja confianza se consulta al modelo y se registran ambas etiquetas.
+    prediction = _local_risk(user_input)
+    if prediction is not None and get_risk_classifier().is_confident(prediction):
+        return prediction.label
     try:
-        risk_out = call_model(risk_prompt, model=model_default, max_tokens=10)
-        if risk_out:
-            risk = (risk_out or '').strip().lower().split()[0]
-            if risk not in ('bajo', 'medio', 'alto'):
-                risk = 'medio'
-        else:
-            risk = 'medio'
+        risk = _parse_risk(call_model(_risk_prompt(user_input), model=model_default, max_tokens=10))
     except Exception:
         logger.exception('Risk selector failed, defaulting to medio')
-        risk = 'medio'
+        return prediction.label if prediction is not None else 'medio'
+    if prediction is not None:
+        log_risk_label(user_input, risk, prediction)
     return risk
 
 def run_retrieval(user_input: str) -> tuple[list[dict], str]:
@@ -95,38 +286,19 @@ def run_retrieval(user_input: str) -> tuple[list[dict], str]:
     top_k_env = int(os.getenv('RETRIEVAL_TOP_K', '3'))  # Reducido de 5 a 3 para mayor velocidad
     snippet_chars = int(os.getenv('RETRIEVAL_SNIPPET_CHARS', '350'))  # Reducido de 500 a 350
 
-    # retrieve_relevant internamente puede ser una función que lee desde disco;
-    # si existe una versión local cargada (src.retrieval) la usamos, si no, usamos
-    # utils.load_index pero desde memoria (cache).
+    # retrieve_relevant usa el índice residente del proceso (src.vector_index);
+    # si falla (p. ej. por el embedding), se reintenta con el embedding cacheado.
     try:
         # intentar usar la función importada retrieve_relevant (si fue sobrescrita)
         retrieved = retrieve_relevant(user_input, top_k=top_k_env)
     except Exception:
-        # fallback: cargar índice en memoria y calcular similitud localmente
-        index_path = Path(__file__).parent.parent / 'kb' / 'db' / 'index.npz'
-        if not index_path.exists():
-            logger.info('No se encontró índice en %s', index_path)
-            return [], ''
-        emb_arr, metadatas = _load_index_cached(index_path)
-        if emb_arr is None or not metadatas:
-            return [], ''
+        # fallback: embedding cacheado en memoria y búsqueda directa sobre el índice residente
         q_emb = _embed_query_cached(user_input)
-        emb_matrix = np.array(emb_arr)
-        qv = np.array(q_emb)
-
-        def cos(a, b):
-            denom = (np.linalg.norm(a) * np.linalg.norm(b))
-            return float(np.dot(a, b) / denom) if denom != 0 else 0.0
-
-        scores = [cos(qv, emb_matrix[i]) for i in range(len(emb_matrix))]
-        idxs = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k_env]
-        retrieved = []
-        for i in idxs:
-            m = dict(metadatas[i])
-            if 'text' in m and isinstance(m['text'], str):
-                m['text'] = m['text'][:snippet_chars]
-            m['score'] = scores[i]
-            retrieved.append(m)
+        try:
+            retrieved = search_vectors([q_emb], top_k=top_k_env, snippet_chars=snippet_chars)[0]
+        except ValueError:
+            logger.exception('Embedding de consulta incompatible con el índice')
+            return [], ''
 
     # Construir contexto reducido para ahorrar tokens y latencia
     context = '\n\n---\n\n'.join([f"Source: {r.get('source')}\nScore: {r.get('score'):.4f}\nText:\n{r.get('text')}" for r in retrieved])
@@ -140,96 +312,312 @@ RISK_TEMPERATURE_MAP = {
 
 def run_draft_generator(user_input: str, context: str, risk: str, call_model: Callable, model_default: str, temperature: float) -> str:
     """Genera el borrador de respuesta pasando el nivel de riesgo al agente de retrieval."""
-    # Incluir el nivel de riesgo en el prompt para que el agente adapte su respuesta
-    risk_info = f"\n\n**NIVEL DE RIESGO DETECTADO: {risk.upper()}**\nAdapta tu respuesta según las instrucciones para riesgo {risk}."
-    retrieval_prompt = _read_agent_instructions('retrieval') + risk_info + f"\n\nConsulta:\n{user_input}\n\nContexto recuperado:\n{context}"
     draft = ''
     try:
-        draft = (call_model(retrieval_prompt, model=model_default, temperature=temperature, max_tokens=800) or '').strip()
+        draft = (call_model(_draft_prompt(user_input, context, risk), model=model_default, temperature=temperature, max_tokens=800) or '').strip()
     except Exception:
         logger.exception('Draft generation failed; trying fallback prompt')
         try:
-            fb_prompt = f"Responde brevemente a la consulta del usuario:\n{user_input}\n\nProvee recomendaciones prácticas y pasos a seguir."
-            draft = (call_model(fb_prompt, model=model_default, temperature=temperature, max_tokens=800) or '').strip()
+            draft = (call_model(_draft_fallback_prompt(user_input), model=model_default, temperature=temperature, max_tokens=800) or '').strip()
         except Exception:
             logger.exception('Fallback draft failed')
             draft = ''
     return draft
 
 def run_formatter(draft: str, user_input: str, call_model: Callable, model_default: str, temperature: float) -> str:
-    formatter_prompt = _read_agent_instructions('formatter') + f"\n\nBorrador:\n{draft}\n\nPor favor formatea según las reglas. NO incluyas las palabras 'Borrador:' o 'Revisión:' en tu respuesta."
     final = ''
     try:
-        final = (call_model(formatter_prompt, model=model_default, temperature=temperature, max_tokens=1000) or '').strip()
+        final = (call_model(_formatter_prompt(draft), model=model_default, temperature=temperature, max_tokens=1000) or '').strip()
     except Exception:
         logger.exception('Formatter failed; trying simple response prompt')
         try:
-            simple_prompt = f"Por favor, responde de forma clara y breve a esta consulta:\n{user_input}\n\nIncluye recomendaciones prácticas y próximas acciones cuando corresponda."
-            final = (call_model(simple_prompt, model=model_default, temperature=temperature, max_tokens=1000) or '').strip()
+            final = (call_model(_formatter_fallback_prompt(user_input), model=model_default, temperature=temperature, max_tokens=1000) or '').strip()
         except Exception:
             logger.exception('Fallback final failed')
             final = ''
+    return _clean_formatted(final)
 
-    if not final:
-        final = 'Lo siento — no pude generar una respuesta en este momento. Intenta de nuevo más tarde.'
-    
-    final = final.replace('<p>', '').replace('</p>', '').replace('<br>', '\n').strip()
-    return final
+def run_single_pass_generator(user_input: str, context: str, risk: str, call_model: Callable, model_default: str, temperature: float) -> str:
+    """Genera la respuesta final formateada en una sola llamada (modo `single_pass`)."""
+    final = ''
+    try:
+        final = (call_model(_single_pass_prompt(user_input, context, risk), model=model_default, temperature=temperature, max_tokens=1000) or '').strip()
+    except Exception:
+        logger.exception('Single-pass generation failed; trying simple response prompt')
+        try:
+            final = (call_model(_formatter_fallback_prompt(user_input), model=model_default, temperature=temperature, max_tokens=1000) or '').strip()
+        except Exception:
+            logger.exception('Fallback final failed')
+            final = ''
+    return _clean_formatted(final)
 
-def run_agent_flow(user_input: str, run_risk_model: Optional[Callable] = None) -> dict:
-    """Orquesta el flujo de agentes y devuelve un dict con `risk`, `retrieved`, `draft`, `final`.
+def run_agent_flow(user_input: str, run_risk_model: Optional[Callable] = None, mode: Optional[str] = None, call_model: Optional[Callable] = None) -> dict:
+    """Orquesta el flujo de agentes y devuelve un dict con `risk`, `retrieved`, `draft`, `final`,
+    `timings` (ms por etapa), `usage` (llamadas y tokens del LLM) y `prompt_versions`.
 
     - run_risk_model: función opcional para ejecutar un modelo de riesgo (si aplica).
+    - mode: `two_pass` | `single_pass`; por defecto AGENT_PIPELINE_MODE.
+    - call_model: función de llamada al LLM; por defecto `get_call_model()`.
     """
-    call_model = get_call_model()
-    model_default = os.getenv('LLM_MODEL', 'gpt-4')
+    greeting = _greeting_result(user_input)
+    if greeting is not None:
+        return greeting
+
+    timer = _StageTimer()
+    usage = track_llm_usage()
+    mode = _pipeline_mode(mode)
+    with timer.stage('cache_lookup'):
+        cache, q_emb, scope, hit = _cache_lookup(user_input, mode)
+    if hit is not None:
+        return _cache_hit_result(hit, timer)
+
+    call_model = call_model or get_call_model()
+    model_default, draft_model, formatter_model = _stage_models()
+
+    # El selector de riesgo y la recuperación son independientes: la recuperación
+    # corre en otro hilo mientras se espera al LLM, y solo se unen antes del borrador.
+    retrieval_future = _STAGE_POOL.submit(_timed_call, timer, 'retrieval', run_retrieval, user_input)
+    with timer.stage('risk_selector'):
+        risk = run_risk_selector(user_input, call_model, model_default)
+    temperature = RISK_TEMPERATURE_MAP.get(risk, 0.5)
+    retrieved, context = retrieval_future.result()
+
+    if mode == 'single_pass':
+        draft = ''
+        with timer.stage('generate'):
+            final = run_single_pass_generator(user_input, context, risk, call_model, formatter_model, temperature)
+    else:
+        # Pasar el nivel de riesgo al draft generator para que adapte la respuesta
+        with timer.stage('draft'):
+            draft = run_draft_generator(user_input, context, risk, call_model, draft_model, temperature)
+        with timer.stage('formatter'):
+            final = run_formatter(draft, user_input, call_model, formatter_model, temperature)
+
+    out = {
+        'risk': risk,
+        'retrieved': retrieved,
+        'draft': draft,
+        'final': _finalize(final),
+        'pipeline_mode': mode,
+        'prompt_versions': _prompt_versions(),
+    }
+    _cache_store(cache, q_emb, scope, out)
+    out['timings'] = timer.finish()
+    out['usage'] = summarize_llm_usage(usage)
+    return out
+
+
+# ========== Versión asíncrona del flujo ==========
+# Misma lógica que las funciones síncronas, pero las llamadas al LLM se hacen con
+# el cliente asíncrono compartido (get_async_call_model) y la recuperación, que
+# es CPU/IO bloqueante, corre en un hilo. Así un worker de uvicorn atiende muchas
+# conversaciones concurrentes sin bloquear el event loop.
+
+async def run_risk_selector_async(user_input: str, call_model: Callable, model_default: str) -> str:
+    prediction = _local_risk(user_input)
+    if prediction is not None and get_risk_classifier().is_confident(prediction):
+        return prediction.label
+    try:
+        risk = _parse_risk(await call_model(_risk_prompt(user_input), model=model_default, max_tokens=10))
+    except Exception:
+        logger.exception('Risk selector failed, defaulting to medio')
+        return prediction.label if prediction is not None else 'medio'
+    if prediction is not None:
+        await asyncio.to_thread(log_risk_label, user_input, risk, prediction)
+    return risk
 
-    # Modelos configurables: para reducir latencia podemos usar un modelo más barato
-    # para la generación del borrador. Ajusta con la variable DRAFT_MODEL.
-    draft_model = os.getenv('DRAFT_MODEL', model_default)
-    formatter_model = os.getenv('FORMATTER_MODEL', model_default)
 
-    # Detectar si es un saludo simple o pregunta trivial (sin contenido médico)
-    user_lower = user_input.lower().strip()
-    simple_greetings = ['hola', 'hi', 'hello', 'buenos días', 'buenas tardes', 'buenas noches', 
-                        'hey', 'saludos', 'qué tal', 'cómo estás', 'como estas']
-    
-    is_simple_greeting = any(greeting == user_lower or user_lower.startswith(greeting + ' ') or user_lower.startswith(greeting + ',') 
-                             for greeting in simple_greetings)
-    
-    if is_simple_greeting and len(user_input.split()) <= 3:
-        # Respuesta directa para saludos simples, sin flujo completo
-        return {
-            'risk': 'bajo',
-            'retrieved': [],
-            'draft': '',
-            'final': '¡Hola! 👋 Soy MediNutrIA, tu asistente de salud y nutrición. ¿En qué puedo ayudarte hoy? Puedes preguntarme sobre alimentación, ejercicio, condiciones de salud o cualquier tema relacionado con tu bienestar.'
-        }
+async def run_retrieval_async(user_input: str) -> tuple[list[dict], str]:
+    return await asyncio.to_thread(run_retrieval, user_input)
+
+
+async def _timed_async(timer: _StageTimer, name: str, awaitable):
+    with timer.stage(name):
+        return await awaitable
 
-    risk = run_risk_selector(user_input, call_model, model_default)
+
+async def run_draft_generator_async(user_input: str, context: str, risk: str, call_model: Callable, model_default: str, temperature: float) -> str:
+    draft = ''
+    try:
+        draft = (await call_model(_draft_prompt(user_input, context, risk), model=model_default, temperature=temperature, max_tokens=800) or '').strip()
+    except Exception:
+        logger.exception('Draft generation failed; trying fallback prompt')
+        try:
+            draft = (await call_model(_draft_fallback_prompt(user_input), model=model_default, temperature=temperature, max_tokens=800) or '').strip()
+        except Exception:
+            logger.exception('Fallback draft failed')
+            draft = ''
+    return draft
+
+
+async def run_formatter_async(draft: str, user_input: str, call_model: Callable, model_default: str, temperature: float) -> str:
+    final = ''
+    try:
+        final = (await call_model(_formatter_prompt(draft), model=model_default, temperature=temperature, max_tokens=1000) or '').strip()
+    except Exception:
+        logger.exception('Formatter failed; trying simple response prompt')
+        try:
+            final = (await call_model(_formatter_fallback_prompt(user_input), model=model_default, temperature=temperature, max_tokens=1000) or '').strip()
+        except Exception:
+            logger.exception('Fallback final failed')
+            final = ''
+    return _clean_formatted(final)
+
+
+async def run_single_pass_generator_async(user_input: str, context: str, risk: str, call_model: Callable, model_default: str, temperature: float) -> str:
+    final = ''
+    try:
+        final = (await call_model(_single_pass_prompt(user_input, context, risk), model=model_default, temperature=temperature, max_tokens=1000) or '').strip()
+    except Exception:
+        logger.exception('Single-pass generation failed; trying simple response prompt')
+        try:
+            final = (await call_model(_formatter_fallback_prompt(user_input), model=model_default, temperature=temperature, max_tokens=1000) or '').strip()
+        except Exception:
+            logger.exception('Fallback final failed')
+            final = ''
+    return _clean_formatted(final)
+
+
+async def run_agent_flow_async(user_input: str, run_risk_model: Optional[Callable] = None, mode: Optional[str] = None) -> dict:
+    """Versión asíncrona de `run_agent_flow` (mismo formato de salida)."""
+    greeting = _greeting_result(user_input)
+    if greeting is not None:
+        return greeting
+
+    timer = _StageTimer()
+    usage = track_llm_usage()
+    mode = _pipeline_mode(mode)
+    with timer.stage('cache_lookup'):
+        cache, q_emb, scope, hit = await asyncio.to_thread(_cache_lookup, user_input, mode)
+    if hit is not None:
+        return _cache_hit_result(hit, timer)
+
+    call_model = get_async_call_model()
+    model_default, draft_model, formatter_model = _stage_models()
+
+    # Etapas independientes en paralelo; se unen antes de generar el borrador
+    risk, (retrieved, context) = await asyncio.gather(
+        _timed_async(timer, 'risk_selector', run_risk_selector_async(user_input, call_model, model_default)),
+        _timed_async(timer, 'retrieval', run_retrieval_async(user_input)),
+    )
     temperature = RISK_TEMPERATURE_MAP.get(risk, 0.5)
 
-    retrieved, context = run_retrieval(user_input)
-    # Pasar el nivel de riesgo al draft generator para que adapte la respuesta
-    draft = run_draft_generator(user_input, context, risk, call_model, draft_model, temperature)
-    final = run_formatter(draft, user_input, call_model, formatter_model, temperature)
-    
-    # Limpiar marcadores de debug que puedan haber quedado
-    final = final.replace('Borrador:', '').replace('Revisión:', '').strip()
-    final = final.replace('<p>', '').replace('</p>', '').replace('<br>', '\n').strip()
+    if mode == 'single_pass':
+        draft = ''
+        with timer.stage('generate'):
+            final = await run_single_pass_generator_async(user_input, context, risk, call_model, formatter_model, temperature)
+    else:
+        with timer.stage('draft'):
+            draft = await run_draft_generator_async(user_input, context, risk, call_model, draft_model, temperature)
+        with timer.stage('formatter'):
+            final = await run_formatter_async(draft, user_input, call_model, formatter_model, temperature)
+
+    out = {
+        'risk': risk,
+        'retrieved': retrieved,
+        'draft': draft,
+        'final': _finalize(final),
+        'pipeline_mode': mode,
+        'prompt_versions': _prompt_versions(),
+    }
+    _cache_store(cache, q_emb, scope, out)
+    out['timings'] = timer.finish()
+    out['usage'] = summarize_llm_usage(usage)
+    return out
 
-    # Añadir disclaimer médico solo si la respuesta contiene contenido de salud sustancial
-    # (evitar disclaimer en saludos o respuestas muy cortas)
-    if len(final) > 100:  # Solo si la respuesta tiene contenido sustancial
-        disclaimer = "\n\n\n\n💙Recuerda: Esta información es solo para fines educativos y está basada en una recopilación de datos confiables. Sin embargo, **no reemplaza una consulta médica profesional**. Siempre es importante que consultes con tu médico o un profesional de la salud calificado para recibir un diagnóstico y tratamiento personalizado. ¡Tu salud es lo más importante! 💙"
-        final = final + disclaimer
 
-    return {
+async def run_agent_flow_stream(user_input: str, mode: Optional[str] = None) -> AsyncIterator[tuple[str, object]]:
+    """Flujo asíncrono que transmite la etapa final token a token.
+
+    En modo `two_pass` se transmite el formateador; en `single_pass`, la única
+    llamada de generación.
+
+    Produce tuplas `(evento, dato)`:
+    - ('meta', {'risk', 'retrieved'}) cuando se conocen riesgo y contexto
+    - ('token', str) por cada fragmento de texto del formateador
+    - ('done', dict) al terminar, con el mismo formato que `run_agent_flow_async`
+      (`final` ya limpio y con el disclaimer, que no se transmite como token);
+      si el stream se cortó tras enviar texto lleva `incomplete: True` y no se cachea
+    """
+    greeting = _greeting_result(user_input)
+    if greeting is not None:
+        yield 'meta', {'risk': greeting['risk'], 'retrieved': []}
+        yield 'token', greeting['final']
+        yield 'done', greeting
+        return
+
+    timer = _StageTimer()
+    usage = track_llm_usage()
+    mode = _pipeline_mode(mode)
+    with timer.stage('cache_lookup'):
+        cache, q_emb, scope, hit = await asyncio.to_thread(_cache_lookup, user_input, mode)
+    if hit is not None:
+        out = _cache_hit_result(hit, timer)
+        yield 'meta', {'risk': out.get('risk'), 'retrieved': out.get('retrieved', [])}
+        yield 'token', out['final']
+        yield 'done', out
+        return
+
+    call_model = get_async_call_model()
+    stream_model = get_async_stream_model()
+    model_default, draft_model, formatter_model = _stage_models()
+
+    risk, (retrieved, context) = await asyncio.gather(
+        _timed_async(timer, 'risk_selector', run_risk_selector_async(user_input, call_model, model_default)),
+        _timed_async(timer, 'retrieval', run_retrieval_async(user_input)),
+    )
+    temperature = RISK_TEMPERATURE_MAP.get(risk, 0.5)
+    yield 'meta', {'risk': risk, 'retrieved': retrieved}
+
+    if mode == 'single_pass':
+        draft = ''
+        stage = 'generate'
+        prompt = _single_pass_prompt(user_input, context, risk)
+    else:
+        with timer.stage('draft'):
+            draft = await run_draft_generator_async(user_input, context, risk, call_model, draft_model, temperature)
+        stage = 'formatter'
+        prompt = _formatter_prompt(draft)
+
+    parts: List[str] = []
+    interrupted = False
+    with timer.stage(stage):
+        try:
+            async for delta in stream_model(prompt, model=formatter_model, temperature=temperature, max_tokens=1000):
+                if not parts:
+                    timer.mark('first_token')
+                parts.append(delta)
+                yield 'token', delta
+        except Exception:
+            if parts:
+                # ya se entregó texto al cliente: se cierra con lo recibido, sin cachearlo
+                logger.exception('Formatter stream interrupted')
+                interrupted = True
+            else:
+                logger.exception('Final stage stream failed; falling back to non-streaming generation')
+                if mode == 'single_pass':
+                    fallback = await run_single_pass_generator_async(user_input, context, risk, call_model, formatter_model, temperature)
+                else:
+                    fallback = await run_formatter_async(draft, user_input, call_model, formatter_model, temperature)
+                parts.append(fallback)
+                yield 'token', fallback
+    final = _clean_formatted(''.join(parts).strip())
+
+    out = {
         'risk': risk,
         'retrieved': retrieved,
         'draft': draft,
-        'final': final,
+        'final': _finalize(final),
+        'pipeline_mode': mode,
+        'prompt_versions': _prompt_versions(),
     }
+    if interrupted:
+        out['incomplete'] = True
+    else:
+        _cache_store(cache, q_emb, scope, out)
+    out['timings'] = timer.finish()
+    out['usage'] = summarize_llm_usage(usage)
+    yield 'done', out
 
 
 if __name__ == '__main__':
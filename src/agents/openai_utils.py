@@ -1,42 +1,252 @@
 import os
+import time
+import random
 import logging
-from typing import Optional, Callable
+import threading
+import contextvars
+from collections import deque
+from typing import Optional, Callable, Awaitable, AsyncIterator, List
 
 logger = logging.getLogger(__name__)
 
-def _call_model_modern(prompt: str, model: str, temperature: float, max_tokens: Optional[int] = None) -> str:
-    from openai import OpenAI
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+
+# ========== Errores ==========
+
+class LLMError(RuntimeError):
+    """Error al invocar el LLM."""
+
+
+class LLMRetryableError(LLMError):
+    """Error transitorio (límite de tasa, timeout, conexión, 5xx) que agotó los reintentos."""
+
+
+class LLMRequestError(LLMError):
+    """Petición rechazada por la API (parámetros, autenticación, modelo inexistente); no se reintenta."""
+
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _is_retryable(exc: Exception) -> bool:
     try:
-        kwargs = {"model": model, "messages": [{"role": "user", "content": prompt}]}
-        if max_tokens:
-            kwargs["max_tokens"] = max_tokens
-        
+        import openai
+    except ImportError:
+        return False
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    status = getattr(exc, 'status_code', None)
+    return status in RETRYABLE_STATUS
+
+
+def _rejects_temperature(exc: Exception) -> bool:
+    # algunos modelos (p. ej. de razonamiento) solo aceptan la temperatura por defecto
+    return getattr(exc, 'status_code', None) == 400 and 'temperature' in str(exc).lower()
+
+
+def _retry_delay(exc: Exception, attempt: int) -> float:
+    backoff_max = float(os.getenv('LLM_BACKOFF_MAX', '8'))
+    response = getattr(exc, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
         try:
-            resp = client.chat.completions.create(**kwargs)
-        except Exception:
-            logger.debug('client.chat.completions.create failed without temperature, retrying with temperature', exc_info=True)
-            kwargs["temperature"] = temperature
-            resp = client.chat.completions.create(**kwargs)
+            return min(backoff_max, float(retry_after))
+        except ValueError:
+            pass
+    base = float(os.getenv('LLM_BACKOFF_BASE', '0.5'))
+    return min(backoff_max, base * (2 ** attempt)) * (0.5 + random.random() / 2)
 
-        choices = getattr(resp, 'choices', None)
-        if choices:
-            c = choices[0]
-            if isinstance(c, dict):
-                return c.get('message', {}).get('content', '')
-            else:
-                return c.message.content
-    except Exception:
-        logger.exception('client.chat.completions.create failed')
+
+def _max_retries() -> int:
+    return int(os.getenv('LLM_MAX_RETRIES', '2'))
+
+
+# Modelos que rechazaron `temperature`: a partir de entonces se llaman sin ella
+_NO_TEMPERATURE_MODELS = {m.strip() for m in os.getenv('LLM_NO_TEMPERATURE_MODELS', '').split(',') if m.strip()}
+
+
+def _build_kwargs(prompt: str, model: str, temperature: float, max_tokens: Optional[int]) -> dict:
+    kwargs = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+    if max_tokens:
+        kwargs["max_tokens"] = max_tokens
+    if model not in _NO_TEMPERATURE_MODELS:
+        kwargs["temperature"] = temperature
+    return kwargs
+
+
+# ========== Métricas ==========
+# Cada llamada deja un registro (modelo, latencia, tokens, intentos). Se guardan los
+# últimos LLM_METRICS_WINDOW en memoria para `get_llm_metrics()` y, además, en la
+# lista activa del contexto (`track_llm_usage`) para atribuirlos a una petición.
+
+_METRICS = deque(maxlen=int(os.getenv('LLM_METRICS_WINDOW', '1000')))
+_METRICS_LOCK = threading.Lock()
+_USAGE: contextvars.ContextVar = contextvars.ContextVar('llm_usage', default=None)
+
+
+def track_llm_usage() -> List[dict]:
+    """Empieza a acumular en una lista nueva las llamadas al LLM del contexto actual.
+
+    Las tareas asyncio y los hilos de `asyncio.to_thread` creados después heredan
+    la misma lista.
+    """
+    records: List[dict] = []
+    _USAGE.set(records)
+    return records
+
+
+def summarize_llm_usage(records: List[dict]) -> dict:
+    return {
+        'calls': len(records),
+        'prompt_tokens': sum(r['prompt_tokens'] or 0 for r in records),
+        'completion_tokens': sum(r['completion_tokens'] or 0 for r in records),
+        'latency_ms': round(sum(r['latency_ms'] for r in records), 1),
+    }
+
+
+def _record_call(model: str, t0: float, attempts: int, usage=None, ok: bool = True, stream: bool = False) -> None:
+    record = {
+        'model': model,
+        'latency_ms': round((time.perf_counter() - t0) * 1000, 1),
+        'prompt_tokens': getattr(usage, 'prompt_tokens', None),
+        'completion_tokens': getattr(usage, 'completion_tokens', None),
+        'attempts': attempts,
+        'ok': ok,
+        'stream': stream,
+    }
+    with _METRICS_LOCK:
+        _METRICS.append(record)
+    records = _USAGE.get()
+    if records is not None:
+        records.append(record)
+
+
+def get_llm_metrics() -> dict:
+    """Resumen por modelo de las últimas llamadas: latencias p50/p95, tokens, errores y reintentos."""
+    with _METRICS_LOCK:
+        records = list(_METRICS)
+    by_model = {}
+    for r in records:
+        by_model.setdefault(r['model'], []).append(r)
+    summary = {}
+    for model, rs in by_model.items():
+        latencies = sorted(r['latency_ms'] for r in rs)
+        summary[model] = {
+            'calls': len(rs),
+            'errors': sum(not r['ok'] for r in rs),
+            'retries': sum(r['attempts'] - 1 for r in rs),
+            'latency_ms_p50': latencies[len(latencies) // 2],
+            'latency_ms_p95': latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+            'prompt_tokens': sum(r['prompt_tokens'] or 0 for r in rs),
+            'completion_tokens': sum(r['completion_tokens'] or 0 for r in rs),
+        }
+    return {'window': len(records), 'models': summary}
+
+
+# ========== Clientes compartidos ==========
+# Un OpenAI (síncrono) y un AsyncOpenAI por proceso, cada uno con un pool de
+# conexiones httpx keep-alive. Los reintentos los gestiona este módulo, por eso
+# el SDK se configura con max_retries=0.
+
+_SYNC_CLIENT = None
+_ASYNC_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def _http_limits():
+    import httpx
+    max_connections = int(os.getenv('LLM_MAX_CONNECTIONS', '100'))
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+
+def _http_timeout():
+    import httpx
+    return httpx.Timeout(float(os.getenv('LLM_TIMEOUT', '60')), connect=10.0)
+
+
+def _get_sync_client():
+    global _SYNC_CLIENT
+    if _SYNC_CLIENT is None:
+        with _CLIENT_LOCK:
+            if _SYNC_CLIENT is None:
+                import httpx
+                from openai import OpenAI
+                http_client = httpx.Client(limits=_http_limits(), timeout=_http_timeout())
+                _SYNC_CLIENT = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), http_client=http_client, max_retries=0)
+    return _SYNC_CLIENT
+
+
+def _get_async_client():
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        import httpx
+        from openai import AsyncOpenAI
+        http_client = httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout())
+        _ASYNC_CLIENT = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), http_client=http_client, max_retries=0)
+    return _ASYNC_CLIENT
+
+
+async def close_async_client() -> None:
+    """Cierra los pools de conexiones de los clientes compartidos (al apagar la app)."""
+    global _ASYNC_CLIENT, _SYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT.close()
+        _ASYNC_CLIENT = None
+    with _CLIENT_LOCK:
+        if _SYNC_CLIENT is not None:
+            _SYNC_CLIENT.close()
+            _SYNC_CLIENT = None
+
+
+def _handle_failure(exc: Exception, kwargs: dict, attempt: int) -> Optional[float]:
+    """Decide qué hacer tras un fallo: devuelve la espera antes de reintentar, o lanza LLMError."""
+    if _rejects_temperature(exc) and 'temperature' in kwargs:
+        logger.info('El modelo %s no acepta temperature; se omite en adelante', kwargs['model'])
+        _NO_TEMPERATURE_MODELS.add(kwargs['model'])
+        kwargs.pop('temperature')
+        return 0.0
+    if not _is_retryable(exc):
+        raise LLMRequestError(f'{type(exc).__name__}: {exc}') from exc
+    if attempt >= _max_retries():
+        raise LLMRetryableError(f'{type(exc).__name__} tras {attempt + 1} intentos: {exc}') from exc
+    delay = _retry_delay(exc, attempt)
+    logger.warning('LLM %s: %s; reintento %d en %.1fs', kwargs['model'], type(exc).__name__, attempt + 1, delay)
+    return delay
+
+
+def _extract_content(resp) -> str:
+    choices = getattr(resp, 'choices', None)
+    if choices:
+        return choices[0].message.content or ''
     return ''
 
+
+def _call_model_modern(prompt: str, model: str, temperature: float, max_tokens: Optional[int] = None) -> str:
+    client = _get_sync_client()
+    kwargs = _build_kwargs(prompt, model, temperature, max_tokens)
+    t0 = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            resp = client.chat.completions.create(**kwargs)
+            break
+        except Exception as e:
+            try:
+                delay = _handle_failure(e, kwargs, attempt)
+            except LLMError:
+                _record_call(model, t0, attempt + 1, ok=False)
+                raise
+            attempt += 1
+            time.sleep(delay)
+    _record_call(model, t0, attempt + 1, getattr(resp, 'usage', None))
+    return _extract_content(resp)
+
 def _call_model_classic(prompt: str, model: str, temperature: float, max_tokens: Optional[int] = None) -> str:
     import openai
     openai.api_key = os.getenv('OPENAI_API_KEY')
     kwargs = {"model": model, "messages": [{"role": "user", "content": prompt}]}
     if max_tokens:
         kwargs["max_tokens"] = max_tokens
-    
+
     try:
         resp = openai.ChatCompletion.create(**kwargs)
     except Exception:
@@ -49,7 +259,8 @@ def get_call_model() -> Callable[[str, Optional[str], float, Optional[int]], str
     """Construye y devuelve una función `call_model(prompt, model, temperature, max_tokens)`.
 
     La función detecta la librería `openai` instalada y utiliza la interfaz
-    disponible. Lanza RuntimeError si no se puede invocar la API o si falta la clave.
+    disponible. Lanza RuntimeError si falta la clave y `LLMError` (o sus
+    subclases) si la API falla tras los reintentos.
     """
 
     def call_model(prompt: str, model: Optional[str] = None, temperature: float = 0.0, max_tokens: Optional[int] = None) -> str:
@@ -61,13 +272,109 @@ def get_call_model() -> Callable[[str, Optional[str], float, Optional[int]], str
 
         try:
             from openai import OpenAI
-            return _call_model_modern(prompt, model, temperature, max_tokens)
         except ImportError:
             try:
                 return _call_model_classic(prompt, model, temperature, max_tokens)
             except Exception:
                 logger.exception('Fallback openai.ChatCompletion failed')
+            raise RuntimeError('No fue posible invocar la API de OpenAI con la configuración actual')
+        return _call_model_modern(prompt, model, temperature, max_tokens)
 
-        raise RuntimeError('No fue posible invocar la API de OpenAI con la configuración actual')
+    return call_model
+
+
+# ========== Llamadas asíncronas ==========
+# Mismo manejo de errores y métricas sobre el cliente asíncrono compartido, para
+# que las peticiones concurrentes de un worker reutilicen conexiones.
+
+async def _call_model_async(prompt: str, model: str, temperature: float, max_tokens: Optional[int] = None) -> str:
+    import asyncio
+    client = _get_async_client()
+    kwargs = _build_kwargs(prompt, model, temperature, max_tokens)
+    t0 = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            resp = await client.chat.completions.create(**kwargs)
+            break
+        except Exception as e:
+            try:
+                delay = _handle_failure(e, kwargs, attempt)
+            except LLMError:
+                _record_call(model, t0, attempt + 1, ok=False)
+                raise
+            attempt += 1
+            await asyncio.sleep(delay)
+    _record_call(model, t0, attempt + 1, getattr(resp, 'usage', None))
+    return _extract_content(resp)
+
+
+def get_async_call_model() -> Callable[..., Awaitable[str]]:
+    """Versión asíncrona de `get_call_model`: devuelve `async call_model(prompt, model, temperature, max_tokens)`.
+
+    Requiere el SDK `openai>=1.0` (AsyncOpenAI). Lanza RuntimeError si falta la clave.
+    """
+
+    async def call_model(prompt: str, model: Optional[str] = None, temperature: float = 0.0, max_tokens: Optional[int] = None) -> str:
+        model = model or os.getenv('LLM_MODEL', 'gpt-4')
+        logger.debug("async call_model: model=%s prompt_len=%d max_tokens=%s", model, len(prompt), max_tokens)
+        if not os.getenv('OPENAI_API_KEY'):
+            raise RuntimeError('OPENAI_API_KEY no configurada - no es posible invocar el LLM')
+        return await _call_model_async(prompt, model, temperature, max_tokens)
 
     return call_model
+
+
+async def _stream_model_async(prompt: str, model: str, temperature: float, max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+    import asyncio
+    client = _get_async_client()
+    kwargs = _build_kwargs(prompt, model, temperature, max_tokens)
+    kwargs["stream"] = True
+    kwargs["stream_options"] = {"include_usage": True}
+    t0 = time.perf_counter()
+    attempt = 0
+    # solo se reintenta al abrir el stream: una vez entregado texto no se repite
+    while True:
+        try:
+            stream = await client.chat.completions.create(**kwargs)
+            break
+        except Exception as e:
+            try:
+                delay = _handle_failure(e, kwargs, attempt)
+            except LLMError:
+                _record_call(model, t0, attempt + 1, ok=False, stream=True)
+                raise
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    usage = None
+    ok = False
+    try:
+        async for chunk in stream:
+            if getattr(chunk, 'usage', None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+        ok = True
+    finally:
+        _record_call(model, t0, attempt + 1, usage, ok=ok, stream=True)
+
+
+def get_async_stream_model() -> Callable[..., AsyncIterator[str]]:
+    """Devuelve `stream_model(prompt, model, temperature, max_tokens)`, un generador asíncrono
+    que entrega el texto de la respuesta a medida que el modelo lo produce.
+
+    A diferencia de `call_model`, los errores de la API se propagan al consumidor.
+    """
+
+    def stream_model(prompt: str, model: Optional[str] = None, temperature: float = 0.0, max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        model = model or os.getenv('LLM_MODEL', 'gpt-4')
+        logger.debug("async stream_model: model=%s prompt_len=%d max_tokens=%s", model, len(prompt), max_tokens)
+        if not os.getenv('OPENAI_API_KEY'):
+            raise RuntimeError('OPENAI_API_KEY no configurada - no es posible invocar el LLM')
+        return _stream_model_async(prompt, model, temperature, max_tokens)
+
+    return stream_model
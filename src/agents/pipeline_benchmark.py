@@ -0,0 +1,199 @@
+"""
+Benchmark de los modos de generación del flujo de agentes (`two_pass` vs `single_pass`).
+
+Ejecuta un conjunto fijo de consultas con cada modo y compara:
+- latencia (total y por etapa, según `timings`)
+- llamadas al LLM y tokens de entrada/salida (los que informa la API en `usage`;
+  estimados a ~4 caracteres por token si no vienen), y su costo si se indican
+  precios por 1K tokens
+- calidad: adherencia al formato (encabezados ###, listas), anclaje en el contexto
+  recuperado y similitud léxica entre las respuestas de ambos modos
+
+Uso:
+    python -m src.agents.pipeline_benchmark --repeat 2 --out benchmark.json
+
+Requiere OPENAI_API_KEY (hace llamadas reales al LLM) y un índice publicado en kb/db.
+"""
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+
+try:
+    from src.agents.agents_factory import run_agent_flow, PIPELINE_MODES
+    from src.agents.openai_utils import get_call_model
+except ImportError:
+    project_root = Path(__file__).resolve().parent.parent.parent
+    if str(project_root) not in sys.path:
+        sys.path.insert(0, str(project_root))
+    from src.agents.agents_factory import run_agent_flow, PIPELINE_MODES
+    from src.agents.openai_utils import get_call_model
+
+
+DEFAULT_QUERIES = [
+    '¿Qué alimentos me recomiendas si tengo prediabetes?',
+    '¿Cuánto ejercicio a la semana necesito para controlar mi glucosa?',
+    'Tengo mucha sed y orino seguido, ¿debería preocuparme?',
+    '¿Qué diferencia hay entre diabetes tipo 1 y tipo 2?',
+    '¿Cómo puedo bajar de peso de forma saludable?',
+    'Me mareo y tengo visión borrosa después de comer, ¿qué hago?',
+    '¿Es malo comer fruta si tengo diabetes?',
+    '¿Cada cuánto debo medirme la glucosa?',
+]
+
+_WORD_RE = re.compile(r'[a-záéíóúüñ]{4,}', re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text or '') // 4 + 1
+
+
+class _CountingCallModel:
+    """Envuelve `call_model` para contar llamadas y estimar tokens cuando la API no informa `usage`."""
+
+    def __init__(self, call_model: Callable):
+        self._call_model = call_model
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def __call__(self, prompt: str, model: Optional[str] = None, temperature: float = 0.0, max_tokens: Optional[int] = None) -> str:
+        self.calls += 1
+        self.prompt_tokens += estimate_tokens(prompt)
+        out = self._call_model(prompt, model=model, temperature=temperature, max_tokens=max_tokens)
+        self.completion_tokens += estimate_tokens(out)
+        return out
+
+
+def _token_counts(out: dict, counter: _CountingCallModel) -> tuple:
+    """(tokens de entrada, tokens de salida, exactos?) de una ejecución del flujo."""
+    usage = out.get('usage') or {}
+    if usage.get('calls') == counter.calls and (usage.get('prompt_tokens') or usage.get('completion_tokens')):
+        return usage['prompt_tokens'], usage['completion_tokens'], True
+    return counter.prompt_tokens, counter.completion_tokens, False
+
+
+def _words(text: str) -> set:
+    return {w.lower() for w in _WORD_RE.findall(text or '')}
+
+
+def format_score(text: str) -> float:
+    """Fracción de las reglas de formato cumplidas (empieza con ###, secciones, listas, negritas)."""
+    lines = [ln.strip() for ln in (text or '').splitlines() if ln.strip()]
+    if not lines:
+        return 0.0
+    checks = [
+        lines[0].startswith('#'),
+        sum(ln.startswith('###') for ln in lines) >= 2,
+        any(re.match(r'^([-*•]|\d+\.)\s', ln) for ln in lines),
+        '**' in text,
+    ]
+    return sum(checks) / len(checks)
+
+
+def grounding_score(text: str, retrieved: List[dict]) -> float:
+    """Fracción de las palabras de la respuesta que aparecen en el contexto recuperado."""
+    answer = _words(text)
+    context = set()
+    for r in retrieved:
+        context |= _words(r.get('text', ''))
+    if not answer or not context:
+        return 0.0
+    return len(answer & context) / len(answer)
+
+
+def jaccard(a: str, b: str) -> float:
+    wa, wb = _words(a), _words(b)
+    if not wa or not wb:
+        return 0.0
+    return len(wa & wb) / len(wa | wb)
+
+
+def run_benchmark(queries: List[str], modes: List[str], repeat: int = 1,
+                  price_in: float = 0.0, price_out: float = 0.0) -> Dict:
+    """Ejecuta cada consulta `repeat` veces por modo y devuelve filas y resumen."""
+    # sin caché de respuestas: cada repetición debe ejecutar el flujo completo
+    os.environ['RESPONSE_CACHE'] = '0'
+    base_call_model = get_call_model()
+    rows = []
+    for query in queries:
+        for r in range(repeat):
+            for mode in modes:
+                counter = _CountingCallModel(base_call_model)
+                t0 = time.perf_counter()
+                out = run_agent_flow(query, mode=mode, call_model=counter)
+                elapsed = (time.perf_counter() - t0) * 1000
+                prompt_tokens, completion_tokens, exact = _token_counts(out, counter)
+                rows.append({
+                    'query': query,
+                    'repeat': r,
+                    'mode': mode,
+                    'latency_ms': round(elapsed, 1),
+                    'timings': out.get('timings', {}),
+                    'llm_calls': counter.calls,
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'tokens_exact': exact,
+                    'cost': (prompt_tokens * price_in + completion_tokens * price_out) / 1000,
+                    'format_score': format_score(out.get('final', '')),
+                    'grounding_score': grounding_score(out.get('final', ''), out.get('retrieved', [])),
+                    'final': out.get('final', ''),
+                })
+
+    summary = {}
+    for mode in modes:
+        mode_rows = [row for row in rows if row['mode'] == mode]
+        if not mode_rows:
+            continue
+        latencies = sorted(row['latency_ms'] for row in mode_rows)
+        summary[mode] = {
+            'runs': len(mode_rows),
+            'latency_ms_p50': round(statistics.median(latencies), 1),
+            'latency_ms_p95': round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 1),
+            'llm_calls_mean': statistics.mean(row['llm_calls'] for row in mode_rows),
+            'prompt_tokens_mean': round(statistics.mean(row['prompt_tokens'] for row in mode_rows)),
+            'completion_tokens_mean': round(statistics.mean(row['completion_tokens'] for row in mode_rows)),
+            'cost_total': round(sum(row['cost'] for row in mode_rows), 6),
+            'tokens_exact': all(row['tokens_exact'] for row in mode_rows),
+            'format_score_mean': round(statistics.mean(row['format_score'] for row in mode_rows), 3),
+            'grounding_score_mean': round(statistics.mean(row['grounding_score'] for row in mode_rows), 3),
+        }
+
+    # similitud entre modos para la misma consulta/repetición
+    if len(modes) == 2:
+        by_key = {(row['query'], row['repeat'], row['mode']): row['final'] for row in rows}
+        sims = [jaccard(by_key[(q, r, modes[0])], by_key[(q, r, modes[1])])
+                for q in queries for r in range(repeat)]
+        summary['cross_mode_similarity_mean'] = round(statistics.mean(sims), 3) if sims else 0.0
+
+    return {'summary': summary, 'rows': rows}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Compara los modos two_pass y single_pass del flujo de agentes')
+    parser.add_argument('--queries', type=Path, help='Archivo con una consulta por línea (por defecto, conjunto fijo interno)')
+    parser.add_argument('--modes', nargs='+', default=list(PIPELINE_MODES), choices=PIPELINE_MODES)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--price-in', type=float, default=0.0, help='Precio por 1K tokens de entrada')
+    parser.add_argument('--price-out', type=float, default=0.0, help='Precio por 1K tokens de salida')
+    parser.add_argument('--out', type=Path, help='Ruta donde guardar el reporte completo en JSON')
+    args = parser.parse_args(argv)
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        queries = [ln.strip() for ln in args.queries.read_text(encoding='utf-8').splitlines() if ln.strip()]
+
+    report = run_benchmark(queries, args.modes, repeat=args.repeat, price_in=args.price_in, price_out=args.price_out)
+    print(json.dumps(report['summary'], ensure_ascii=False, indent=2))
+    if args.out:
+        args.out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f'Reporte completo guardado en {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Registro de prompts de los agentes (kb/agents/*.md) residente en memoria.
+
+Los archivos se leen una vez (al arrancar), se les quitan los bloques de código
+(```) y se guarda el hash de cada uno como versión. Las peticiones solo leen el
+diccionario en memoria; como mucho cada PROMPT_RELOAD_INTERVAL segundos se
+comprueba (stat) si algún archivo cambió, y en ese caso se recarga el conjunto.
+`reload()` fuerza la recarga (endpoint de administración).
+
+Las versiones se usan como clave de la caché de respuestas y se devuelven en la
+salida del flujo (`prompt_versions`) para poder trazar qué prompt generó cada
+respuesta.
+"""
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional
+import os
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_DIR = Path(__file__).resolve().parent.parent.parent / 'kb' / 'agents'
+
+
+def strip_code_fences(text: str) -> str:
+    """Elimina los bloques delimitados por ``` para no confundir a los prompts."""
+    lines = []
+    skip = False
+    for ln in text.splitlines():
+        if ln.strip().startswith('```'):
+            skip = not skip
+            continue
+        if not skip:
+            lines.append(ln)
+    return '\n'.join(lines)
+
+
+class Prompt(NamedTuple):
+    name: str
+    text: str
+    version: str
+
+
+class PromptRegistry:
+    """Prompts precargados y versionados, con recarga cuando cambian los archivos."""
+
+    def __init__(self, root: Path = PROMPTS_DIR, check_interval: float = 2.0):
+        self.root = Path(root)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._prompts: Dict[str, Prompt] = {}
+        self._signature = None
+        self._last_check = 0.0
+
+    def _scan(self) -> tuple:
+        """Firma barata del directorio: (nombre, mtime, tamaño) de cada .md."""
+        if not self.root.is_dir():
+            return ()
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.md') and entry.is_file():
+                st = entry.stat()
+                entries.append((entry.name, st.st_mtime_ns, st.st_size))
+        return tuple(sorted(entries))
+
+    def _load(self, signature: tuple) -> None:
+        prompts = {}
+        for filename, _, _ in signature:
+            name = filename[:-3]
+            try:
+                text = strip_code_fences((self.root / filename).read_text(encoding='utf-8'))
+            except OSError:
+                logger.exception('No se pudo leer el prompt %s', filename)
+                continue
+            version = hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+            prompts[name] = Prompt(name, text, version)
+        if not prompts:
+            logger.warning('No se encontraron prompts de agentes en %s', self.root)
+        changed = sorted(n for n in prompts if n not in self._prompts or self._prompts[n].version != prompts[n].version)
+        if self._prompts and changed:
+            logger.info('Prompts recargados: %s', ', '.join(changed))
+        self._prompts = prompts
+        self._signature = signature
+
+    def _refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and self._signature is not None and now - self._last_check < self.check_interval:
+            return
+        with self._lock:
+            if not force and self._signature is not None and now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+            signature = self._scan()
+            if force or signature != self._signature:
+                self._load(signature)
+
+    def reload(self) -> Dict[str, str]:
+        """Recarga todos los prompts desde disco y devuelve sus versiones."""
+        self._refresh(force=True)
+        return self.versions()
+
+    def prompt(self, name: str) -> Optional[Prompt]:
+        self._refresh()
+        return self._prompts.get(name)
+
+    def get(self, name: str) -> str:
+        """Texto del prompt `name` (sin extensión), o '' si no existe."""
+        p = self.prompt(name)
+        return p.text if p is not None else ''
+
+    def versions(self, names: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """{nombre: hash} de los prompts indicados (o de todos); '' si falta alguno."""
+        self._refresh()
+        prompts = self._prompts
+        if names is None:
+            return {n: p.version for n, p in sorted(prompts.items())}
+        return {n: prompts[n].version if n in prompts else '' for n in names}
+
+
+_REGISTRY: Optional[PromptRegistry] = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """Devuelve el registro de prompts del proceso (se carga en el primer uso)."""
+    global _REGISTRY
+    if _REGISTRY is None:
+        with _REGISTRY_LOCK:
+            if _REGISTRY is None:
+                _REGISTRY = PromptRegistry(check_interval=float(os.getenv('PROMPT_RELOAD_INTERVAL', '2')))
+    return _REGISTRY
@@ -0,0 +1,152 @@
+"""
+Caché semántica de respuestas del flujo de agentes.
+
+Guarda la salida de `run_agent_flow` indexada por el embedding (normalizado) de
+la consulta. Una consulta nueva cuya similitud coseno con alguna guardada supere
+`threshold` devuelve esa respuesta sin volver a ejecutar el flujo.
+
+Las entradas pertenecen a un *namespace* (versión del índice de la KB, hashes de
+los prompts y modo del pipeline): si cambia, la caché se vacía, de modo que una
+re-indexación o la edición de un prompt invalidan todas las respuestas previas.
+Dentro de un namespace cada entrada lleva además una `key` que debe coincidir
+exactamente (p. ej. los valores numéricos de la consulta): dos preguntas casi
+idénticas que solo difieren en una cifra no comparten respuesta.
+Además cada entrada caduca a los `ttl` segundos y, al llenarse, se expulsa la
+usada hace más tiempo.
+
+Configuración por entorno:
+- RESPONSE_CACHE: '0' para desactivarla
+- RESPONSE_CACHE_THRESHOLD: similitud mínima para un acierto (por defecto 0.95)
+- RESPONSE_CACHE_TTL: segundos de vida de cada entrada (por defecto 3600)
+- RESPONSE_CACHE_MAX_ENTRIES: máximo de respuestas guardadas (por defecto 1000)
+"""
+from collections import OrderedDict
+from typing import Hashable, Optional, Sequence, Tuple
+import os
+import copy
+import time
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticResponseCache:
+    """Caché en memoria (consulta ~ vector) -> respuesta, con umbral, TTL y LRU."""
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600.0, max_entries: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._namespace = None
+        self._matrix: Optional[np.ndarray] = None   # (max_entries, dim), filas normalizadas
+        self._valid = np.zeros(self.max_entries, dtype=bool)
+        self._key_hash = np.zeros(self.max_entries, dtype=np.int64)  # hash de la key de cada slot
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # slot -> (resultado, creado, key), orden LRU
+        self._free = list(range(self.max_entries - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _reset(self) -> None:
+        self._matrix = None
+        self._valid[:] = False
+        self._entries.clear()
+        self._free = list(range(self.max_entries - 1, -1, -1))
+
+    def _check_namespace(self, namespace) -> None:
+        if namespace != self._namespace:
+            if self._entries:
+                logger.info('Caché de respuestas invalidada (%d entradas): cambió el índice o los prompts', len(self._entries))
+            self._reset()
+            self._namespace = namespace
+
+    def _drop(self, slot: int) -> None:
+        self._entries.pop(slot, None)
+        self._valid[slot] = False
+        self._free.append(slot)
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> Optional[np.ndarray]:
+        q = np.asarray(vector, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(q))
+        if q.size <= 1 or norm == 0.0:
+            return None
+        return q / norm
+
+    def get(self, vector: Sequence[float], namespace, key: Hashable = None) -> Optional[Tuple[dict, float]]:
+        """Devuelve (copia de la respuesta, similitud) del vecino más cercano con la misma `key`
+        si supera el umbral."""
+        q = self._normalize(vector)
+        if q is None:
+            return None
+        with self._lock:
+            self._check_namespace(namespace)
+            if not self._entries or self._matrix is None or self._matrix.shape[1] != q.shape[0]:
+                self.misses += 1
+                return None
+            scores = self._matrix @ q
+            scores[~(self._valid & (self._key_hash == hash(key)))] = -np.inf
+            slot = int(np.argmax(scores))
+            similarity = float(scores[slot])
+            if similarity < self.threshold or self._entries[slot][2] != key:
+                self.misses += 1
+                return None
+            result, created, _ = self._entries[slot]
+            if time.monotonic() - created > self.ttl:
+                self._drop(slot)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            return copy.deepcopy(result), similarity
+
+    def put(self, vector: Sequence[float], result: dict, namespace, key: Hashable = None) -> None:
+        q = self._normalize(vector)
+        if q is None:
+            return
+        with self._lock:
+            self._check_namespace(namespace)
+            if self._matrix is None or self._matrix.shape[1] != q.shape[0]:
+                self._reset()
+                self._matrix = np.zeros((self.max_entries, q.shape[0]), dtype=np.float32)
+            if not self._free:
+                oldest, _ = self._entries.popitem(last=False)
+                self._valid[oldest] = False
+                self._free.append(oldest)
+            slot = self._free.pop()
+            self._matrix[slot] = q
+            self._valid[slot] = True
+            self._key_hash[slot] = hash(key)
+            self._entries[slot] = (copy.deepcopy(result), time.monotonic(), key)
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+_CACHE: Optional[SemanticResponseCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_response_cache() -> Optional[SemanticResponseCache]:
+    """Devuelve la caché de respuestas del proceso, o None si está desactivada."""
+    global _CACHE
+    if os.getenv('RESPONSE_CACHE', '1') == '0':
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = SemanticResponseCache(
+                    threshold=float(os.getenv('RESPONSE_CACHE_THRESHOLD', '0.95')),
+                    ttl=float(os.getenv('RESPONSE_CACHE_TTL', '3600')),
+                    max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1000')),
+                )
+    return _CACHE
@@ -0,0 +1,281 @@
+"""
+Clasificador de riesgo local (bajo / medio / alto) para el selector de riesgo.
+
+Sustituye la llamada al LLM de `run_risk_selector` en la mayoría de los turnos:
+puntúa la consulta con tablas de términos (sin acentos, en minúsculas) y
+umbrales numéricos de glucosa y presión arterial. Si la confianza queda por
+debajo de RISK_CLASSIFIER_MIN_CONFIDENCE, el flujo consulta al LLM y registra
+ambas etiquetas en un log JSONL, que sirve para ajustar las tablas y para el
+reporte de concordancia:
+
+    python -m src.agents.risk_classifier --report
+    python -m src.agents.risk_classifier --report --queries consultas.txt   # etiqueta con el LLM
+
+Configuración por entorno:
+- RISK_SELECTOR: 'local' (por defecto, con respaldo LLM) o 'llm' (siempre LLM)
+- RISK_CLASSIFIER_MIN_CONFIDENCE: confianza mínima para no consultar al LLM (0.6)
+- RISK_LABEL_LOG: ruta del log de etiquetas (data/risk_labels.jsonl); '' lo desactiva
+"""
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import logging
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+RISK_LEVELS = ('bajo', 'medio', 'alto')
+DEFAULT_LABEL_LOG = Path(__file__).resolve().parent.parent.parent / 'data' / 'risk_labels.jsonl'
+
+# Peso de cada coincidencia por nivel; `bajo` parte de un valor previo porque
+# una consulta sin señales de alarma suele ser informativa.
+LEVEL_WEIGHTS = {'bajo': 1.0, 'medio': 2.0, 'alto': 3.0}
+BAJO_PRIOR = 0.5
+
+KEYWORDS = {
+    'alto': [
+        'dolor de pecho', 'dolor en el pecho', 'dolor toracico', 'opresion en el pecho',
+        'desmayo', 'me desmaye', 'perdida de conciencia', 'perdi el conocimiento', 'inconsciente',
+        'convulsion', 'no puedo respirar', 'dificultad para respirar', 'me falta el aire', 'ahogo',
+        'estado de confusion', 'confusion mental', 'desorientado', 'paralisis', 'no puedo mover', 'cara caida', 'no puedo hablar',
+        'vomitos persistentes', 'vomito sin parar', 'cetoacidosis', 'aliento a fruta',
+        'hipoglucemia severa', 'en coma', 'coma diabetico', 'sangrado', 'emergencia', 'urgencia', 'urgente',
+        'ambulancia', 'infarto', 'derrame', 'acv', 'gangrena', 'suicid*',
+    ],
+    'medio': [
+        'sintoma', 'sed excesiva', 'mucha sed', 'orino mucho', 'orino seguido', 'orinar mucho',
+        'cansancio', 'fatiga', 'hormigueo', 'adormecimiento', 'entumecimiento',
+        'herida que no cicatriza', 'no cicatriza', 'vision borrosa', 'veo borroso', 'mareo', 'me mareo',
+        'glucosa alta', 'azucar alta', 'hiperglucemia', 'hipoglucemia', 'presion alta', 'hipertension',
+        'medicamento', 'insulina', 'metformina', 'diagnostic*', 'prediabetes', 'resistencia a la insulina',
+        'sobrepeso', 'obesidad', 'colesterol', 'trigliceridos', 'dolor', 'me duele', 'preocupa*',
+        'bajar de peso rapido', 'perdida de peso', 'embarazada', 'gestacional',
+    ],
+    'bajo': [
+        'que es', 'informacion', 'receta', 'alimentacion', 'alimentos', 'dieta', 'menu',
+        'ejercicio', 'habitos', 'prevenir', 'prevencion', 'consejo', 'nutricion', 'fruta',
+        'verdura', 'desayuno', 'almuerzo', 'cena', 'snack', 'caminar', 'dormir', 'hidratacion',
+        'diferencia entre', 'cuantas calorias', 'saludable',
+    ],
+}
+
+# Glucosa: solo con unidad (mg/dl, mmol/l) o como valor de la glucosa ("tengo la glucosa
+# en 250", "mi azucar en sangre de 60"); un número cerca de "azúcar" a secas no cuenta.
+_GLUCOSE_TERM = r'(?:glucosa|glicemia|glucemia|(?:nivel(?:es)? de|tengo el|mi) azucar|azucar en (?:la )?sangre)'
+_NOT_GLUCOSE_UNIT = r'(?!\s*(?:%|min|hora|seg|dia|seman|mes|ano|gramo|gr?\b|kg|cucharad|taza|vez|veces))'
+_GLUCOSE_PHRASE_RE = re.compile(
+    _GLUCOSE_TERM + r'(?:\s+[a-z]+){0,3}?(?:\s+(?:en|de|a)\s+|\s*[:=]\s*)(\d{2,3})\b' + _NOT_GLUCOSE_UNIT
+)
+_GLUCOSE_MGDL_RE = re.compile(r'\b(\d{2,3})\s*mg\s*/?\s*dl\b')
+_GLUCOSE_MMOL_RE = re.compile(r'\b(\d{1,2}(?:[.,]\d+)?)\s*mmol')
+_PRESSURE_RE = re.compile(r'(\d{2,3})\s*/\s*(\d{2,3})')
+
+
+def fold(text: str) -> str:
+    """Minúsculas y sin acentos, para comparar con las tablas de términos."""
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def _term_pattern(term: str) -> str:
+    # palabra completa con plural opcional ('menu' no coincide con 'menudo');
+    # un '*' final marca una raíz ('suicid*' -> suicidio, suicida)
+    if term.endswith('*'):
+        return re.escape(fold(term[:-1])) + r'[a-z]*'
+    return re.escape(fold(term)) + r'(?:e?s)?'
+
+
+def _compile_keywords(table: Dict[str, List[str]]) -> Dict[str, re.Pattern]:
+    # un único patrón por nivel, anclado a límites de palabra en ambos extremos
+    return {
+        level: re.compile(r'\b(?:' + '|'.join(_term_pattern(t) for t in sorted(terms, key=len, reverse=True)) + r')\b')
+        for level, terms in table.items()
+    }
+
+
+def glucose_values(folded: str) -> List[int]:
+    """Valores de glucosa (mg/dl) mencionados en un texto ya normalizado con `fold`."""
+    values = {}
+    for pattern in (_GLUCOSE_PHRASE_RE, _GLUCOSE_MGDL_RE):
+        for m in pattern.finditer(folded):
+            values[m.start(1)] = int(m.group(1))
+    for m in _GLUCOSE_MMOL_RE.finditer(folded):
+        values[m.start(1)] = round(float(m.group(1).replace(',', '.')) * 18)
+    return [values[k] for k in sorted(values)]
+
+
+class RiskPrediction(NamedTuple):
+    label: str
+    confidence: float
+    scores: Dict[str, float]
+    matches: List[str]
+
+
+class RiskClassifier:
+    """Clasificador por términos y umbrales clínicos; inferencia en microsegundos."""
+
+    def __init__(self, keywords: Optional[Dict[str, List[str]]] = None, min_confidence: float = 0.6):
+        self.min_confidence = min_confidence
+        self._patterns = _compile_keywords(keywords or KEYWORDS)
+
+    def predict(self, text: str) -> RiskPrediction:
+        folded = fold(text)
+        scores = {'bajo': BAJO_PRIOR, 'medio': 0.0, 'alto': 0.0}
+        matches = []
+        for level, pattern in self._patterns.items():
+            found = pattern.findall(folded)
+            if found:
+                scores[level] += LEVEL_WEIGHTS[level] * len(set(found))
+                matches.extend(f'{level}:{m}' for m in sorted(set(found)))
+
+        for mgdl in glucose_values(folded):
+            if mgdl >= 250 or mgdl < 55:
+                scores['alto'] += LEVEL_WEIGHTS['alto']
+                matches.append(f'alto:glucosa={mgdl}')
+            elif mgdl >= 126 or mgdl < 70:
+                scores['medio'] += LEVEL_WEIGHTS['medio']
+                matches.append(f'medio:glucosa={mgdl}')
+        for sys_bp, dia_bp in _PRESSURE_RE.findall(folded):
+            sys_bp, dia_bp = int(sys_bp), int(dia_bp)
+            if sys_bp >= 180 or dia_bp >= 120:
+                scores['alto'] += LEVEL_WEIGHTS['alto']
+                matches.append(f'alto:presion={sys_bp}/{dia_bp}')
+            elif sys_bp >= 140 or dia_bp >= 90:
+                scores['medio'] += LEVEL_WEIGHTS['medio']
+                matches.append(f'medio:presion={sys_bp}/{dia_bp}')
+
+        # una señal de alarma decide aunque haya términos informativos
+        if scores['alto'] > 0:
+            label = 'alto'
+        else:
+            label = max(('medio', 'bajo'), key=lambda lvl: scores[lvl])
+        confidence = scores[label] / (sum(scores.values()) + 1.0)
+        return RiskPrediction(label, round(confidence, 3), scores, matches)
+
+    def is_confident(self, prediction: RiskPrediction) -> bool:
+        return prediction.confidence >= self.min_confidence
+
+
+_CLASSIFIER: Optional[RiskClassifier] = None
+_LOG_LOCK = threading.Lock()
+
+
+def get_risk_classifier() -> Optional[RiskClassifier]:
+    """Devuelve el clasificador del proceso, o None si RISK_SELECTOR=llm."""
+    global _CLASSIFIER
+    if os.getenv('RISK_SELECTOR', 'local').lower() == 'llm':
+        return None
+    if _CLASSIFIER is None:
+        _CLASSIFIER = RiskClassifier(min_confidence=float(os.getenv('RISK_CLASSIFIER_MIN_CONFIDENCE', '0.6')))
+    return _CLASSIFIER
+
+
+def _label_log_path() -> Optional[Path]:
+    path = os.getenv('RISK_LABEL_LOG', str(DEFAULT_LABEL_LOG))
+    return Path(path) if path else None
+
+
+def log_risk_label(query: str, llm_label: str, prediction: RiskPrediction, path: Optional[Path] = None) -> None:
+    """Registra la etiqueta del LLM junto a la predicción local (para concordancia y ajuste)."""
+    path = path or _label_log_path()
+    if path is None:
+        return
+    record = {
+        'ts': time.time(),
+        'query': query,
+        'llm': llm_label,
+        'local': prediction.label,
+        'confidence': prediction.confidence,
+        'matches': prediction.matches,
+    }
+    try:
+        with _LOG_LOCK:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open('a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    except OSError:
+        logger.warning('No se pudo escribir el log de etiquetas de riesgo en %s', path)
+
+
+def load_label_log(path: Path) -> List[dict]:
+    if not path.exists():
+        return []
+    records = []
+    for line in path.read_text(encoding='utf-8').splitlines():
+        line = line.strip()
+        if line:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def agreement_report(pairs: List[Tuple[str, str]], classifier: RiskClassifier,
+                     thresholds: Tuple[float, ...] = (0.0, 0.4, 0.5, 0.6, 0.7, 0.8)) -> dict:
+    """Concordancia del clasificador local con etiquetas del LLM.
+
+    `pairs` son (consulta, etiqueta_llm). Para cada umbral de confianza informa la
+    cobertura (fracción resuelta localmente) y la concordancia en esa fracción; el
+    flujo efectivo concuerda siempre en el resto, que va al LLM.
+    """
+    preds = [(classifier.predict(q), llm) for q, llm in pairs if llm in RISK_LEVELS]
+    confusion = {llm: {local: 0 for local in RISK_LEVELS} for llm in RISK_LEVELS}
+    for pred, llm in preds:
+        confusion[llm][pred.label] += 1
+    n = len(preds)
+    by_threshold = []
+    for t in thresholds:
+        covered = [(p, llm) for p, llm in preds if p.confidence >= t]
+        agree = sum(p.label == llm for p, llm in covered)
+        by_threshold.append({
+            'min_confidence': t,
+            'coverage': round(len(covered) / n, 3) if n else 0.0,
+            'agreement': round(agree / len(covered), 3) if covered else None,
+        })
+    return {
+        'n': n,
+        'agreement': round(sum(p.label == llm for p, llm in preds) / n, 3) if n else None,
+        'confusion': confusion,  # filas: etiqueta LLM, columnas: etiqueta local
+        'by_threshold': by_threshold,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Clasificador de riesgo local: predicción y reporte de concordancia con el LLM')
+    parser.add_argument('query', nargs='?', help='Consulta a clasificar')
+    parser.add_argument('--report', action='store_true', help='Reporte de concordancia sobre el log de etiquetas')
+    parser.add_argument('--queries', type=Path, help='Consultas (una por línea) a etiquetar con el LLM antes del reporte')
+    parser.add_argument('--log', type=Path, default=_label_log_path() or DEFAULT_LABEL_LOG)
+    args = parser.parse_args(argv)
+
+    classifier = RiskClassifier(min_confidence=float(os.getenv('RISK_CLASSIFIER_MIN_CONFIDENCE', '0.6')))
+    if args.query:
+        print(json.dumps(classifier.predict(args.query)._asdict(), ensure_ascii=False, indent=2))
+    if not args.report:
+        return
+
+    pairs = [(r['query'], r['llm']) for r in load_label_log(args.log) if 'query' in r and 'llm' in r]
+    if args.queries:
+        project_root = Path(__file__).resolve().parent.parent.parent
+        if str(project_root) not in sys.path:
+            sys.path.insert(0, str(project_root))
+        from src.agents.agents_factory import _risk_prompt, _parse_risk
+        from src.agents.openai_utils import get_call_model
+        call_model = get_call_model()
+        model = os.getenv('LLM_MODEL', 'gpt-4')
+        for q in [ln.strip() for ln in args.queries.read_text(encoding='utf-8').splitlines() if ln.strip()]:
+            llm = _parse_risk(call_model(_risk_prompt(q), model=model, max_tokens=10))
+            log_risk_label(q, llm, classifier.predict(q), path=args.log)
+            pairs.append((q, llm))
+    print(json.dumps(agreement_report(pairs, classifier), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
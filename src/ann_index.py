@@ -0,0 +1,184 @@
+"""
+Índice aproximado de vecinos más cercanos (IVF: inverted file) en NumPy puro.
+
+Los vectores (ya normalizados) se agrupan con k-means esférico en `n_lists`
+centroides. En la búsqueda solo se puntúan las filas de las `nprobe` listas
+cuyos centroides son más similares a la consulta: `nprobe` es el control
+recall/latencia (nprobe = n_lists equivale a la búsqueda exacta).
+
+Uso del reporte de recall@k contra la búsqueda exacta:
+
+    python src/ann_index.py --k 5 --nprobe 1 2 4 8 16
+"""
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+import os
+import time
+import numpy as np
+
+try:
+    from src.vector_search import normalize_rows, top_k_cosine
+except ImportError:
+    from vector_search import normalize_rows, top_k_cosine
+
+IVF_FILE = 'ivf.npz'
+
+
+def default_n_lists(n: int) -> int:
+    """Número de listas por defecto: ~sqrt(n), como en las implementaciones IVF habituales."""
+    return max(1, int(np.sqrt(max(n, 1))))
+
+
+def _assign(embeddings: np.ndarray, centroids: np.ndarray, block: int = 65536) -> np.ndarray:
+    """Asigna cada fila al centroide más similar, por bloques para acotar memoria."""
+    labels = np.empty(embeddings.shape[0], dtype=np.int64)
+    for start in range(0, embeddings.shape[0], block):
+        chunk = np.asarray(embeddings[start:start + block], dtype=np.float32)
+        labels[start:start + block] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(embeddings: np.ndarray, n_lists: int, n_iter: int = 15, sample_size: Optional[int] = None, seed: int = 0) -> np.ndarray:
+    """Entrena centroides con k-means esférico sobre una muestra de filas."""
+    rng = np.random.default_rng(seed)
+    n = embeddings.shape[0]
+    n_lists = max(1, min(n_lists, n))
+    sample_size = sample_size or min(n, 256 * n_lists)
+    sample_idx = rng.choice(n, size=min(sample_size, n), replace=False)
+    sample = np.asarray(embeddings[np.sort(sample_idx)], dtype=np.float32)
+
+    centroids = sample[rng.choice(sample.shape[0], size=n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=n_lists)
+        empty = counts == 0
+        if empty.any():
+            # re-sembrar listas vacías con filas aleatorias de la muestra
+            sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Listas invertidas sobre las filas de la matriz de embeddings del índice.
+
+    - centroids: (n_lists, dim) normalizados
+    - list_offsets: (n_lists + 1,) inicio de cada lista dentro de `list_ids`
+    - list_ids: (n,) filas de la matriz ordenadas por lista
+    """
+    __slots__ = ('centroids', 'list_offsets', 'list_ids')
+
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_ids: np.ndarray):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, n_lists: Optional[int] = None, n_iter: int = 15, seed: int = 0) -> 'IVFIndex':
+        """Construye el índice a partir de embeddings ya normalizados."""
+        n_lists = n_lists or default_n_lists(embeddings.shape[0])
+        centroids = train_centroids(embeddings, n_lists, n_iter=n_iter, seed=seed)
+        return cls.from_centroids(embeddings, centroids)
+
+    @classmethod
+    def from_centroids(cls, embeddings: np.ndarray, centroids: np.ndarray) -> 'IVFIndex':
+        """Reparte las filas en las listas de unos centroides ya entrenados."""
+        labels = _assign(embeddings, centroids)
+        list_ids = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=centroids.shape[0])
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(centroids, list_offsets, list_ids.astype(np.int64))
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Filas de la matriz pertenecientes a las `nprobe` listas más cercanas a `query`."""
+        nprobe = max(1, min(nprobe, self.n_lists))
+        cscores = self.centroids @ query
+        if nprobe < self.n_lists:
+            lists = np.argpartition(-cscores, nprobe - 1)[:nprobe]
+        else:
+            lists = np.arange(self.n_lists)
+        return np.concatenate([self.list_ids[self.list_offsets[l]:self.list_offsets[l + 1]] for l in lists])
+
+    def search(self, embeddings: np.ndarray, queries, k: int, nprobe: int = 8) -> Tuple[np.ndarray, np.ndarray]:
+        """Búsqueda aproximada; misma interfaz de salida que `top_k_cosine`.
+
+        Si una consulta reúne menos de `k` candidatos, las posiciones sobrantes
+        se rellenan con índice -1 y score -inf.
+        """
+        q = normalize_rows(queries)
+        k = max(0, min(int(k), embeddings.shape[0]))
+        out_idx = np.full((q.shape[0], k), -1, dtype=np.int64)
+        out_scores = np.full((q.shape[0], k), -np.inf, dtype=np.float32)
+        for row, qv in enumerate(q):
+            rows = np.sort(self.candidates(qv, nprobe))
+            idx, scores = top_k_cosine(np.asarray(embeddings[rows]), qv, k)
+            found = idx.shape[1]
+            out_idx[row, :found] = rows[idx[0]]
+            out_scores[row, :found] = scores[0]
+        return out_idx, out_scores
+
+    def save(self, path: Path) -> None:
+        np.savez(str(path), centroids=self.centroids, list_offsets=self.list_offsets, list_ids=self.list_ids)
+
+    @classmethod
+    def load(cls, path: Path) -> 'IVFIndex':
+        with np.load(str(path)) as data:
+            return cls(data['centroids'], data['list_offsets'], data['list_ids'])
+
+
+def recall_report(embeddings: np.ndarray, ivf: IVFIndex, k: int = 5, nprobes: Sequence[int] = (1, 2, 4, 8, 16), n_queries: int = 200, noise: float = 0.05, seed: int = 0) -> List[dict]:
+    """Mide recall@k y latencia del IVF frente a la búsqueda exacta.
+
+    Las consultas son filas del propio índice con ruido gaussiano (sin un set de
+    consultas reales, es la aproximación habitual a la distribución de consultas).
+    """
+    rng = np.random.default_rng(seed)
+    n = embeddings.shape[0]
+    picks = rng.choice(n, size=min(n_queries, n), replace=False)
+    queries = np.asarray(embeddings[picks], dtype=np.float32)
+    queries = normalize_rows(queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32))
+
+    t0 = time.perf_counter()
+    exact_idx = [top_k_cosine(embeddings, qv, k)[0][0] for qv in queries]
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+    rows = []
+    for nprobe in nprobes:
+        t0 = time.perf_counter()
+        approx_idx = [ivf.search(embeddings, qv, k, nprobe=nprobe)[0][0] for qv in queries]
+        ann_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approx_idx, exact_idx))
+        rows.append({
+            'nprobe': nprobe,
+            'recall_at_k': hits / float(max(1, k * len(queries))),
+            'exact_ms': exact_ms,
+            'ann_ms': ann_ms,
+        })
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+    from vector_index import get_resident_index
+
+    parser = argparse.ArgumentParser(description='Reporte recall@k del índice IVF frente a la búsqueda exacta')
+    parser.add_argument('--k', type=int, default=int(os.getenv('RETRIEVAL_TOP_K', '3')))
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--lists', type=int, default=None, help='n_lists si el índice publicado no tiene IVF')
+    args = parser.parse_args()
+
+    snapshot = get_resident_index().get()
+    if snapshot is None or not len(snapshot):
+        raise SystemExit('No hay índice publicado en kb/db')
+    ivf = snapshot.ivf or IVFIndex.build(snapshot.embeddings, n_lists=args.lists)
+    print(f"Índice {snapshot.version}: {len(snapshot)} vectores, {ivf.n_lists} listas")
+    print(f"{'nprobe':>7} {'recall@' + str(args.k):>10} {'exacta ms':>10} {'ivf ms':>8}")
+    for r in recall_report(snapshot.embeddings, ivf, k=args.k, nprobes=args.nprobe, n_queries=args.queries):
+        print(f"{r['nprobe']:>7} {r['recall_at_k']:>10.3f} {r['exact_ms']:>10.3f} {r['ann_ms']:>8.3f}")
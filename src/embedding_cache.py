@@ -0,0 +1,155 @@
+"""
+Caché persistente de embeddings en disco (SQLite).
+
+Clave: (nombre del modelo, sha256 del texto). Valor: vector float32. La caché la
+comparten la ingesta (`ingest.build_index`) y las consultas (`retrieval`), de
+modo que re-indexar sin cambios o repetir una consulta no llama al backend de
+embeddings. El tamaño se acota con `max_entries`: al superarlo se eliminan las
+entradas usadas hace más tiempo.
+
+Configuración por entorno:
+- EMBEDDING_CACHE: '0' para desactivarla
+- EMBEDDING_CACHE_PATH: ruta del archivo (por defecto kb/db/embedding_cache.sqlite)
+- EMBEDDING_CACHE_MAX_ENTRIES: máximo de vectores guardados (por defecto 200000)
+"""
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = Path(__file__).parent.parent / 'kb' / 'db' / 'embedding_cache.sqlite'
+_SQL_BATCH = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Almacén (modelo, hash) -> vector con expulsión por antigüedad de uso."""
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH, max_entries: int = 200000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        # WAL permite lectores concurrentes (varios workers) mientras la ingesta escribe
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            ' model TEXT NOT NULL, text_hash TEXT NOT NULL, dim INTEGER NOT NULL,'
+            ' vector BLOB NOT NULL, last_used REAL NOT NULL,'
+            ' PRIMARY KEY (model, text_hash))'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)')
+        self._conn.commit()
+        self._approx_count = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> dict:
+        """Devuelve {hash: vector} para los hashes presentes y actualiza su último uso."""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique), _SQL_BATCH):
+                batch = unique[i:i + _SQL_BATCH]
+                marks = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({marks})',
+                    [model, *batch],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    'UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?',
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model: str, hashes: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        now = time.time()
+        rows = []
+        for h, vec in zip(hashes, vectors):
+            arr = np.asarray(vec, dtype=np.float32)
+            rows.append((model, h, int(arr.shape[0]), arr.tobytes(), now))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)',
+                rows,
+            )
+            self._conn.commit()
+            self._approx_count += len(rows)
+            if self._approx_count > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Elimina las entradas menos usadas hasta quedar en ~90% de `max_entries`."""
+        count = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        excess = count - int(self.max_entries * 0.9)
+        if count > self.max_entries and excess > 0:
+            self._conn.execute(
+                'DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)',
+                (excess,),
+            )
+            self._conn.commit()
+            count -= excess
+            logger.info('Caché de embeddings: %d entradas expulsadas', excess)
+        self._approx_count = count
+
+    def embed(self, model: str, texts: List[str], embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """Devuelve los embeddings de `texts`, llamando a `embed_fn` solo para los que faltan."""
+        hashes = [text_hash(t) for t in texts]
+        found = self.get_many(model, hashes)
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in found and h not in missing:
+                missing[h] = t
+        if missing:
+            new_vectors = embed_fn(list(missing.values()))
+            self.put_many(model, list(missing.keys()), new_vectors)
+            for h, vec in zip(missing.keys(), new_vectors):
+                found[h] = np.asarray(vec, dtype=np.float32)
+        logger.debug('Caché de embeddings: %d aciertos, %d nuevos', len(texts) - len(missing), len(missing))
+        return [found[h].tolist() for h in hashes]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_CACHE: Optional[EmbeddingCache] = None
+_CACHE_FAILED = False
+_CACHE_LOCK = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Devuelve la caché del proceso, o None si está desactivada o no se puede abrir."""
+    global _CACHE, _CACHE_FAILED
+    if os.getenv('EMBEDDING_CACHE', '1') == '0' or _CACHE_FAILED:
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                try:
+                    _CACHE = EmbeddingCache(
+                        Path(os.getenv('EMBEDDING_CACHE_PATH', str(DEFAULT_CACHE_PATH))),
+                        max_entries=int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '200000')),
+                    )
+                except sqlite3.Error:
+                    logger.exception('No se pudo abrir la caché de embeddings; se continúa sin caché')
+                    _CACHE_FAILED = True
+                    return None
+    return _CACHE
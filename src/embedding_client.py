@@ -0,0 +1,215 @@
+"""
+Cliente de embeddings por lotes, concurrente y consciente de los límites de tasa.
+
+- Los lotes se dimensionan por presupuesto de tokens (estimado) y no por número
+  de textos.
+- Varios lotes viajan en paralelo (`max_concurrency` hilos, un pool de
+  conexiones HTTP compartido).
+- Ante 429/5xx se reintenta con backoff exponencial (respetando `Retry-After`);
+  mientras dura la espera ningún otro hilo envía peticiones.
+- Los trabajos de varios lotes guardan cada lote terminado en `checkpoint/`, de
+  modo que una ingesta interrumpida se reanuda sin repetir lo ya pagado.
+
+Habla directamente con el endpoint `/embeddings` de la API de OpenAI (o
+compatible) vía httpx, por lo que puede probarse contra un servidor local
+indicando `base_url` (o OPENAI_BASE_URL) o inyectando un `transport` de httpx
+(p. ej. `httpx.MockTransport`).
+"""
+from pathlib import Path
+from typing import List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+import random
+import shutil
+import hashlib
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = Path(__file__).parent.parent / 'checkpoint'
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class EmbeddingAPIError(RuntimeError):
+    """Error no recuperable devuelto por el endpoint de embeddings."""
+
+
+class EmbeddingRateLimitError(EmbeddingAPIError):
+    """Se agotaron los reintentos ante errores de límite de tasa o del servidor."""
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 caracteres por token en inglés/español; suficiente para dimensionar lotes
+    return len(text) // 4 + 1
+
+
+def make_batches(texts: List[str], max_batch_tokens: int, max_batch_items: int) -> List[Tuple[int, int]]:
+    """Parte `texts` en rangos [inicio, fin) que respetan ambos límites."""
+    batches = []
+    start = 0
+    tokens = 0
+    for i, t in enumerate(texts):
+        t_tokens = estimate_tokens(t)
+        if i > start and (tokens + t_tokens > max_batch_tokens or i - start >= max_batch_items):
+            batches.append((start, i))
+            start = i
+            tokens = 0
+        tokens += t_tokens
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+class EmbeddingDispatcher:
+    """Despachador de lotes de embeddings con reintentos y checkpoints."""
+
+    def __init__(
+        self,
+        model: str,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        max_concurrency: int = 4,
+        max_batch_tokens: int = 60000,
+        max_batch_items: int = 2048,
+        max_retries: int = 6,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        timeout: float = 60.0,
+        checkpoint_dir: Optional[Path] = CHECKPOINT_DIR,
+        transport=None,
+    ):
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError("Falta la dependencia 'httpx'. Instálala con: pip install httpx")
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.checkpoint_dir = Path(checkpoint_dir) if checkpoint_dir else None
+        self._client = httpx.Client(
+            base_url=(base_url or os.getenv('OPENAI_BASE_URL') or DEFAULT_BASE_URL).rstrip('/'),
+            headers={'Authorization': f"Bearer {api_key or os.getenv('OPENAI_API_KEY', '')}"},
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            transport=transport,
+        )
+        self._transport_errors = (httpx.TransportError,)
+        # instante (monotonic) hasta el que todos los hilos deben esperar tras un 429
+        self._cooldown_until = 0.0
+        self._cooldown_lock = threading.Lock()
+
+    def _wait_cooldown(self) -> None:
+        delay = self._cooldown_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _set_cooldown(self, delay: float) -> None:
+        with self._cooldown_lock:
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return min(self.backoff_max, float(retry_after))
+            except ValueError:
+                pass
+        return min(self.backoff_max, self.backoff_base * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+    def _request(self, batch: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            self._wait_cooldown()
+            try:
+                resp = self._client.post('/embeddings', json={'model': self.model, 'input': batch})
+            except self._transport_errors as e:
+                if attempt >= self.max_retries:
+                    raise EmbeddingAPIError(f"Error de conexión con el servicio de embeddings: {e}") from e
+                time.sleep(self._backoff(attempt, None))
+                continue
+            if resp.status_code == 200:
+                data = sorted(resp.json().get('data', []), key=lambda item: item.get('index', 0))
+                if len(data) != len(batch):
+                    raise EmbeddingAPIError(f"Se esperaban {len(batch)} embeddings y se recibieron {len(data)}")
+                return [item['embedding'] for item in data]
+            if resp.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                delay = self._backoff(attempt, resp.headers.get('retry-after'))
+                if resp.status_code == 429:
+                    self._set_cooldown(delay)
+                logger.warning('Embeddings: HTTP %s, reintento %d en %.1fs', resp.status_code, attempt + 1, delay)
+                time.sleep(delay)
+                continue
+            if resp.status_code in RETRYABLE_STATUS:
+                raise EmbeddingRateLimitError(f"HTTP {resp.status_code} tras {self.max_retries} reintentos: {resp.text[:200]}")
+            raise EmbeddingAPIError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+        raise EmbeddingRateLimitError('Reintentos agotados')
+
+    def _job_dir(self, texts: List[str]) -> Optional[Path]:
+        if self.checkpoint_dir is None:
+            return None
+        h = hashlib.sha256(self.model.encode('utf-8'))
+        for t in texts:
+            h.update(hashlib.sha256(t.encode('utf-8')).digest())
+        return self.checkpoint_dir / f"embeddings-{h.hexdigest()[:16]}"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Genera los embeddings de `texts` preservando el orden."""
+        if not texts:
+            return []
+        batches = make_batches(texts, self.max_batch_tokens, self.max_batch_items)
+        if len(batches) == 1:
+            return self._request(texts)
+
+        job_dir = self._job_dir(texts)
+        if job_dir is not None:
+            job_dir.mkdir(parents=True, exist_ok=True)
+        results = [None] * len(batches)
+
+        def run(i: int) -> None:
+            start, end = batches[i]
+            ckpt = job_dir / f"batch-{start:08d}-{end:08d}.npy" if job_dir is not None else None
+            if ckpt is not None and ckpt.exists():
+                results[i] = np.load(str(ckpt))
+                return
+            arr = np.asarray(self._request(texts[start:end]), dtype=np.float32)
+            if ckpt is not None:
+                tmp = ckpt.with_suffix('.tmp.npy')
+                np.save(str(tmp), arr)
+                os.replace(tmp, ckpt)
+            results[i] = arr
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            # list() propaga la primera excepción; los lotes completos quedan en el checkpoint
+            list(pool.map(run, range(len(batches))))
+        if job_dir is not None:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        return np.concatenate(results).tolist()
+
+    def close(self) -> None:
+        self._client.close()
+
+
+_DISPATCHERS = {}
+_DISPATCHERS_LOCK = threading.Lock()
+
+
+def get_embedding_dispatcher(model: str) -> EmbeddingDispatcher:
+    """Devuelve un despachador por modelo, configurado por entorno y reutilizado en el proceso."""
+    with _DISPATCHERS_LOCK:
+        dispatcher = _DISPATCHERS.get(model)
+        if dispatcher is None:
+            dispatcher = EmbeddingDispatcher(
+                model,
+                max_concurrency=int(os.getenv('EMBEDDING_CONCURRENCY', '4')),
+                max_batch_tokens=int(os.getenv('EMBEDDING_BATCH_TOKENS', '60000')),
+                max_retries=int(os.getenv('EMBEDDING_MAX_RETRIES', '6')),
+                checkpoint_dir=Path(os.getenv('EMBEDDING_CHECKPOINT_DIR', str(CHECKPOINT_DIR))),
+            )
+            _DISPATCHERS[model] = dispatcher
+        return dispatcher
@@ -1,68 +1,323 @@
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import os
 import json
-from utils import chunk_text, embed_texts, save_index, extract_text_from_pdf
+import hashlib
+from utils import chunk_text, embed_texts, extract_text_from_pdf
+from vector_index import publish_index, read_current_version, load_snapshot
+from ann_index import default_n_lists
 import numpy as np
 
 KB_DIR = Path(__file__).parent.parent / 'kb'
-INDEX_PATH = KB_DIR / 'db' / 'index.npz'
+DB_DIR = KB_DIR / 'db'
+# Manifiesto con la huella (mtime, tamaño, sha256) de cada archivo indexado
+MANIFEST_NAME = 'manifest.json'
+# A partir de este número de fragmentos se construye también el índice aproximado IVF
+IVF_MIN_VECTORS = int(os.getenv('IVF_MIN_VECTORS', '20000'))
+# Procesos para extraer/fragmentar archivos en paralelo (1 = en serie)
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', str(os.cpu_count() or 1)))
+# Fragmentos acumulados antes de enviarlos a la etapa de embeddings
+EMBED_BATCH_CHUNKS = int(os.getenv('EMBED_BATCH_CHUNKS', '512'))
 
 
-def load_documents(kb_dir: Path, papers_dir: Path = None):
-    """Cargar únicamente archivos markdown y PDF bajo `kb/papers/` para indexar."""
-    docs = []
-    if not papers_dir.exists():
-        return docs
-    
-    # MarkDown files
-    for p in papers_dir.rglob('*.md'):
-        if p.name.startswith('index'):
-            continue
+def list_source_files(papers_dir: Path) -> List[Path]:
+    """Archivos markdown y PDF bajo `papers_dir` que forman parte del índice."""
+    if not papers_dir or not papers_dir.exists():
+        return []
+    md_files = [p for p in papers_dir.rglob('*.md') if not p.name.startswith('index')]
+    return sorted(md_files) + sorted(papers_dir.rglob('*.pdf'))
+
+
+def load_file(kb_dir: Path, p: Path) -> List[dict]:
+    """Cargar los documentos de un archivo (uno por markdown, uno por página de PDF)."""
+    if p.suffix.lower() == '.md':
         text = p.read_text(encoding='utf-8')
         title = next((line.strip() for line in text.splitlines() if line.strip()), p.stem)
-        docs.append({'source': str(p.relative_to(kb_dir)), 'text': text, 'title': title})
-
-    # PDF files
-    for p in papers_dir.rglob('*.pdf'):
-        try:
-            pages = extract_text_from_pdf(p)
-        except Exception as e:
-            print(f"Advertencia: no se pudo leer PDF {p}: {e}")
-            continue
-        for i, page_text in enumerate(pages):
-            title = f"{p.stem} - page {i+1}"
-            source = str(p.relative_to(kb_dir)) + f"::page_{i+1}"
-            docs.append({'source': source, 'text': page_text, 'title': title})
-            
-    return docs
+        return [{'source': str(p.relative_to(kb_dir)), 'text': text, 'title': title}]
+
+    try:
+        pages = extract_text_from_pdf(p)
+    except Exception as e:
+        print(f"Advertencia: no se pudo leer PDF {p}: {e}")
+        return []
+    docs = []
+    for i, page_text in enumerate(pages):
+        title = f"{p.stem} - page {i+1}"
+        source = str(p.relative_to(kb_dir)) + f"::page_{i+1}"
+        docs.append({'source': source, 'text': page_text, 'title': title})
     return docs
 
 
-def build_index(kb_dir: Path, papers_dir: Path, index_path: Path):
-    """Construir y guardar el índice de embeddings a partir de los documentos.
+def load_documents(kb_dir: Path, papers_dir: Path = None):
+    """Cargar únicamente archivos markdown y PDF bajo `kb/papers/` para indexar."""
+    docs = []
+    for p in list_source_files(papers_dir):
+        docs.extend(load_file(kb_dir, p))
+    return docs
 
-    Lee los documentos, los divide en fragmentos, genera embeddings y guarda
-    el índice junto con los metadatos.
-    """
-    docs = load_documents(kb_dir, papers_dir)
+
+def chunk_file(kb_dir: Path, p: Path):
+    """Cargar y fragmentar un archivo. Devuelve (chunks, metadatas)."""
+    file_key = str(p.relative_to(kb_dir))
     chunks = []
     metadatas = []
-    for d in docs:
+    for d in load_file(kb_dir, p):
         parts = chunk_text(d['text'], max_chars=1000)
-        for i, p in enumerate(parts):
-            chunks.append(p)
+        for i, part in enumerate(parts):
+            chunks.append(part)
             metadatas.append({
                 'source': d['source'],
+                'file': file_key,
                 'title': d.get('title'),
                 'chunk_id': i,
-                'text': p,
-                'text_preview': p[:200]
+                'text': part,
+                'text_preview': part[:200]
             })
-    print(f"Generando embeddings para {len(chunks)} fragmentos...")
-    embeddings = embed_texts(chunks)
-    emb_arr = np.array(embeddings)
-    save_index(emb_arr, metadatas, index_path)
-    print(f"Índice guardado en {index_path}")
+    return chunks, metadatas
+
+
+def _process_file(kb_dir: Path, p: Path):
+    """Trabajo de un proceso del pool: extraer, fragmentar y calcular la huella de un archivo."""
+    chunks, metadatas = chunk_file(kb_dir, p)
+    return chunks, metadatas, file_fingerprint(p)
+
+
+def _failed(p: Path, e: Exception):
+    print(f"Advertencia: no se pudo procesar {p}: {e}")
+    return p, [], [], None
+
+
+def iter_file_chunks(kb_dir: Path, files: List[Path], workers: int = None) -> Iterator[Tuple[Path, List[str], List[dict], Optional[dict]]]:
+    """Genera (archivo, chunks, metadatas, huella) procesando los archivos en paralelo.
+
+    Como máximo hay `2 * workers` archivos en vuelo, así que la memoria queda
+    acotada aunque el corpus tenga cientos de PDFs. Los resultados se entregan
+    en el orden de `files` para que el índice sea reproducible.
+
+    Un archivo que no se pudo procesar se entrega con huella None (sin chunks),
+    de modo que no entra al manifiesto y la próxima ingesta lo reintenta. Si un
+    proceso del pool muere (BrokenProcessPool), los archivos en vuelo y los que
+    faltaban se entregan también como fallidos.
+    """
+    workers = max(1, workers or INGEST_WORKERS)
+    if workers == 1 or len(files) <= 1:
+        for p in files:
+            try:
+                result = (p, *_process_file(kb_dir, p))
+            except Exception as e:
+                result = _failed(p, e)
+            yield result
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        remaining = iter(files)
+        broken = None
+        for p in remaining:
+            pending.append((p, pool.submit(_process_file, kb_dir, p)))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            p, fut = pending.popleft()
+            try:
+                result = (p, *fut.result())
+            except BrokenProcessPool as e:
+                broken = e
+                yield _failed(p, e)
+                break
+            except Exception as e:
+                result = _failed(p, e)
+            nxt = next(remaining, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(_process_file, kb_dir, nxt)))
+            yield result
+        if broken is not None:
+            print("Advertencia: el pool de ingesta se detuvo; los archivos restantes se reintentarán en la próxima ingesta")
+            for p, _ in pending:
+                yield _failed(p, broken)
+            for p in remaining:
+                yield _failed(p, broken)
+
+
+def embed_files(kb_dir: Path, files: List[Path], workers: int = None):
+    """Etapa completa de ingesta: extracción en paralelo y embeddings por lotes.
+
+    Los fragmentos se envían a `embed_texts` en lotes de EMBED_BATCH_CHUNKS a
+    medida que llegan, sin construir antes la lista completa de documentos.
+    Devuelve (emb_arr, metadatas, {archivo: huella con número de chunks}); los
+    archivos que fallaron no aparecen en las huellas.
+    """
+    emb_parts = []
+    metadatas = []
+    fingerprints = {}
+    pending_texts = []
+    total = 0
+    failed = 0
+    for p, file_chunks, file_metas, fp in iter_file_chunks(kb_dir, files, workers):
+        if fp is None:
+            failed += 1
+            continue
+        metadatas.extend(file_metas)
+        fingerprints[str(p.relative_to(kb_dir))] = {**fp, 'chunks': len(file_chunks)}
+        pending_texts.extend(file_chunks)
+        if len(pending_texts) >= EMBED_BATCH_CHUNKS:
+            emb_parts.append(np.array(embed_texts(pending_texts), dtype=np.float32))
+            total += len(pending_texts)
+            print(f"  {total} fragmentos con embedding...")
+            pending_texts = []
+    if pending_texts:
+        emb_parts.append(np.array(embed_texts(pending_texts), dtype=np.float32))
+        total += len(pending_texts)
+    print(f"Embeddings generados para {total} fragmentos")
+    if failed:
+        print(f"Advertencia: {failed} archivos fallaron y quedan fuera del manifiesto")
+    emb_arr = np.concatenate(emb_parts) if emb_parts else np.zeros((0, 0), dtype=np.float32)
+    return emb_arr, metadatas, fingerprints
+
+
+def file_fingerprint(p: Path, with_hash: bool = True) -> dict:
+    st = p.stat()
+    fp = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+    if with_hash:
+        fp['sha256'] = hashlib.sha256(p.read_bytes()).hexdigest()
+    return fp
+
+
+def load_manifest(db_dir: Path) -> dict:
+    path = Path(db_dir) / MANIFEST_NAME
+    if not path.exists():
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        print(f"Advertencia: manifiesto ilegible en {path}; se reconstruirá el índice completo")
+        return {}
+
+
+def save_manifest(db_dir: Path, version: str, files: Dict[str, dict]) -> None:
+    path = Path(db_dir) / MANIFEST_NAME
+    tmp = path.with_suffix('.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'files': files}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _resolve_ivf_lists(ivf_lists: Optional[int], n_chunks: int) -> int:
+    if ivf_lists is None:
+        ivf_lists = int(os.getenv('INDEX_IVF_LISTS', '0'))
+        if not ivf_lists and n_chunks >= IVF_MIN_VECTORS:
+            ivf_lists = default_n_lists(n_chunks)
+    return ivf_lists
+
+
+def build_index(kb_dir: Path, papers_dir: Path, db_dir: Path = DB_DIR, ivf_lists: int = None, incremental: bool = False, compact: bool = False):
+    """Construir y publicar el índice de embeddings a partir de los documentos.
+
+    Lee los documentos, los divide en fragmentos, genera embeddings y publica
+    una nueva versión del índice en `db_dir` (ver `vector_index.publish_index`).
+    Los procesos que sirven la API detectan la nueva versión sin reiniciar.
+
+    `ivf_lists` fija el número de listas del índice IVF (0 = sin IVF). Si no se
+    indica, se toma de INDEX_IVF_LISTS o, con corpus de al menos IVF_MIN_VECTORS
+    fragmentos, se usa ~sqrt(n).
+
+    Con `incremental=True` solo se procesan los archivos nuevos o modificados
+    según el manifiesto (ver `update_index`).
+    """
+    if incremental:
+        return update_index(kb_dir, papers_dir, db_dir, ivf_lists=ivf_lists, compact=compact)
+
+    files = list_source_files(papers_dir)
+    print(f"Procesando {len(files)} archivos...")
+    emb_arr, metadatas, manifest_files = embed_files(kb_dir, files)
+    version = publish_index(emb_arr, metadatas, db_dir, ivf_lists=_resolve_ivf_lists(ivf_lists, len(metadatas)))
+    save_manifest(db_dir, version, manifest_files)
+    print(f"Índice versión {version} activo en {db_dir}")
+    return version
+
+
+def update_index(kb_dir: Path, papers_dir: Path, db_dir: Path = DB_DIR, ivf_lists: int = None, compact: bool = False):
+    """Actualiza el índice publicado procesando solo los archivos que cambiaron.
+
+    - Un archivo se considera sin cambios si coincide su mtime y tamaño con el
+      manifiesto; si no, se compara el sha256 del contenido.
+    - Los vectores de archivos borrados o modificados se descartan; los de
+      archivos nuevos o modificados se agregan al final.
+    - Si el índice tenía IVF, los vectores nuevos se asignan a los centroides
+      existentes; con `compact=True` los centroides se re-entrenan.
+
+    Si no hay manifiesto o no corresponde a la versión activa, se hace una
+    reconstrucción completa.
+    """
+    manifest = load_manifest(db_dir)
+    current = read_current_version(db_dir)
+    if not manifest or current is None or manifest.get('version') != current:
+        print("No hay manifiesto válido para la versión activa; reconstrucción completa")
+        return build_index(kb_dir, papers_dir, db_dir, ivf_lists=ivf_lists)
+    snapshot = load_snapshot(current, db_dir)
+    if any('file' not in m for m in snapshot.metadatas):
+        print("El índice activo no registra el archivo de cada fragmento; reconstrucción completa")
+        return build_index(kb_dir, papers_dir, db_dir, ivf_lists=ivf_lists)
+
+    old_files = manifest.get('files', {})
+    new_files = {}
+    changed = []
+    present = set()
+    for p in list_source_files(papers_dir):
+        key = str(p.relative_to(kb_dir))
+        present.add(key)
+        prev = old_files.get(key)
+        fp = file_fingerprint(p, with_hash=False)
+        if prev and prev.get('mtime_ns') == fp['mtime_ns'] and prev.get('size') == fp['size']:
+            new_files[key] = prev
+            continue
+        fp = file_fingerprint(p)
+        if prev and prev.get('sha256') == fp['sha256']:
+            new_files[key] = {**fp, 'chunks': prev.get('chunks', 0)}
+            continue
+        changed.append(p)
+    deleted = [k for k in old_files if k not in present]
+
+    if not changed and not deleted and not compact:
+        if new_files != old_files:
+            save_manifest(db_dir, current, new_files)
+        print(f"Sin cambios; el índice {current} sigue activo")
+        return current
+
+    print(f"Actualización incremental: {len(changed)} archivos nuevos/modificados, {len(deleted)} eliminados")
+    stale = set(deleted) | {str(p.relative_to(kb_dir)) for p in changed}
+    keep = np.array([m['file'] not in stale for m in snapshot.metadatas], dtype=bool)
+    metadatas = [m for m, k in zip(snapshot.metadatas, keep) if k]
+
+    parts = [np.asarray(snapshot.embeddings[keep], dtype=np.float32)] if keep.any() else []
+    if changed:
+        new_emb, new_metas, new_fps = embed_files(kb_dir, changed)
+        metadatas.extend(new_metas)
+        new_files.update(new_fps)
+        if new_emb.size:
+            parts.append(new_emb)
+    emb_arr = np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+
+    ivf_centroids = None
+    if snapshot.ivf is not None and not compact and ivf_lists is None:
+        ivf_centroids = snapshot.ivf.centroids
+        ivf_lists = snapshot.ivf.n_lists
+    else:
+        ivf_lists = _resolve_ivf_lists(ivf_lists, len(metadatas))
+    version = publish_index(emb_arr, metadatas, db_dir, ivf_lists=ivf_lists, ivf_centroids=ivf_centroids)
+    save_manifest(db_dir, version, new_files)
+    print(f"Índice versión {version} activo en {db_dir}")
+    return version
 
 
 if __name__ == '__main__':
-    build_index(KB_DIR, KB_DIR / 'data_rag', INDEX_PATH)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Construir el índice de embeddings de kb/data_rag')
+    parser.add_argument('--incremental', action='store_true', help='procesar solo archivos nuevos, modificados o eliminados')
+    parser.add_argument('--compact', action='store_true', help='con --incremental, re-entrenar también el IVF')
+    args = parser.parse_args()
+    build_index(KB_DIR, KB_DIR / 'data_rag', DB_DIR, incremental=args.incremental, compact=args.compact)
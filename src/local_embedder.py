@@ -0,0 +1,131 @@
+"""
+Servicio de embeddings local (sentence-transformers) residente en el proceso.
+
+El modelo se carga una sola vez (idealmente al arrancar la API) y las consultas
+concurrentes se agrupan: un hilo de fondo junta las peticiones que llegan dentro
+de una ventana de `max_wait_ms` (hasta `max_batch` textos) y las resuelve con una
+única llamada a `encode`. Las llamadas grandes (ingesta) van directo al modelo.
+
+Configuración por entorno:
+- LOCAL_EMBEDDER_THREADS: hilos de inferencia en CPU (torch.set_num_threads)
+- LOCAL_EMBEDDER_MAX_BATCH: máximo de textos por lote agrupado (por defecto 64)
+- LOCAL_EMBEDDER_MAX_WAIT_MS: ventana de agrupación en ms (por defecto 5)
+"""
+from concurrent.futures import Future
+from typing import List, Optional
+import os
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_MODEL = 'all-MiniLM-L6-v2'
+
+
+class LocalEmbedder:
+    """Modelo sentence-transformers único con cola de micro-lotes."""
+
+    def __init__(self, model_name: str = DEFAULT_LOCAL_MODEL, threads: Optional[int] = None, max_batch: int = 64, max_wait_ms: float = 5.0):
+        self.model_name = model_name
+        self.threads = threads
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        """Carga el modelo si aún no está en memoria y arranca el hilo de micro-lotes."""
+        if self._model is not None:
+            return self._model
+        with self._load_lock:
+            if self._model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError:
+                    raise RuntimeError(
+                        "No se encontró OPENAI_API_KEY ni la dependencia 'sentence-transformers'. Instálala con: pip install sentence-transformers"
+                    )
+                if self.threads:
+                    try:
+                        import torch
+                        torch.set_num_threads(self.threads)
+                    except ImportError:
+                        pass
+                t0 = time.perf_counter()
+                self._model = SentenceTransformer(self.model_name)
+                logger.info('Modelo de embeddings local %s cargado en %.1fs', self.model_name, time.perf_counter() - t0)
+                self._worker = threading.Thread(target=self._run, name='local-embedder', daemon=True)
+                self._worker.start()
+        return self._model
+
+    def _encode_now(self, texts: List[str]) -> List[List[float]]:
+        model = self.load()
+        with self._encode_lock:
+            return model.encode(texts, show_progress_bar=False, batch_size=max(32, self.max_batch)).tolist()
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        """Embeddings de `texts`; las llamadas pequeñas se agrupan con las concurrentes."""
+        if not texts:
+            return []
+        self.load()
+        if len(texts) >= self.max_batch:
+            return self._encode_now(texts)
+        fut: Future = Future()
+        self._queue.put((list(texts), fut))
+        return fut.result()
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            pending = [first]
+            size = len(first[0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            texts = [t for batch, _ in pending for t in batch]
+            try:
+                vectors = self._encode_now(texts)
+            except Exception as e:
+                for _, fut in pending:
+                    fut.set_exception(e)
+                continue
+            offset = 0
+            for batch, fut in pending:
+                fut.set_result(vectors[offset:offset + len(batch)])
+                offset += len(batch)
+
+
+_EMBEDDER: Optional[LocalEmbedder] = None
+_EMBEDDER_LOCK = threading.Lock()
+
+
+def get_local_embedder() -> LocalEmbedder:
+    """Devuelve el embedder local del proceso (singleton, sin cargar el modelo)."""
+    global _EMBEDDER
+    if _EMBEDDER is None:
+        with _EMBEDDER_LOCK:
+            if _EMBEDDER is None:
+                threads = os.getenv('LOCAL_EMBEDDER_THREADS')
+                _EMBEDDER = LocalEmbedder(
+                    threads=int(threads) if threads else None,
+                    max_batch=int(os.getenv('LOCAL_EMBEDDER_MAX_BATCH', '64')),
+                    max_wait_ms=float(os.getenv('LOCAL_EMBEDDER_MAX_WAIT_MS', '5')),
+                )
+    return _EMBEDDER
@@ -1,10 +1,22 @@
 """
 Sistema de sesiones para recopilar variables del modelo de predicción de diabetes.
 """
-from typing import Dict, Optional, List, Any
-from datetime import datetime
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, List, Any, Mapping, Tuple
+from datetime import datetime, timezone
 from pydantic import BaseModel
+from array import array
+import re
+import json
+import math
+import time
 import uuid
+import unicodedata
+
+try:
+    from src.session_store import SessionStore, create_session_store, start_expiry
+except ImportError:
+    from session_store import SessionStore, create_session_store, start_expiry  # type: ignore
 
 
 class PredictionSession(BaseModel):
@@ -117,33 +129,264 @@ VARIABLE_QUESTIONS = [
 ]
 
 
-# Almacenamiento en memoria de sesiones (en producción usar Redis/DB)
-_SESSIONS: Dict[str, PredictionSession] = {}
+# ========== Validación de respuestas (compilada una vez al importar) ==========
+
+_NUMBER_RE = re.compile(r'\d+(?:[.,]\d+)?')
+_SPACES_RE = re.compile(r'\s+')
+_EDGE_PUNCT = ' .,;:!?¡¿"\''
+
+
+def fold_answer(text: str) -> str:
+    """Normaliza una respuesta: minúsculas, sin acentos, espacios simples y sin puntuación en los bordes."""
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return _SPACES_RE.sub(' ', text).strip(_EDGE_PUNCT)
+
+
+class AnswerError(ValueError):
+    """Respuesta inválida; el mensaje se muestra tal cual al usuario."""
+
+
+class QuestionValidator(ABC):
+    """Convierte la respuesta a una pregunta en el valor numérico de su variable."""
+
+    def __init__(self, question: Dict[str, Any]):
+        self.question = question
+        self.variable = question["variable"]
+
+    @abstractmethod
+    def parse(self, answer: Any) -> float:
+        """Valor de la variable para `answer`; lanza AnswerError si no es válida."""
+
+
+class ChoiceValidator(QuestionValidator):
+    """Opciones con tabla precalculada de respuestas normalizadas ("si", "sí", "SÍ" -> misma clave)."""
+
+    def __init__(self, question: Dict[str, Any]):
+        super().__init__(question)
+        self.table = {fold_answer(k): v for k, v in question.get("map", {}).items()}
+        self.codes = frozenset(self.table.values())
+        self.message = f"Por favor responde con una de las opciones: {', '.join(question['options'])}"
+
+    def parse(self, answer: Any) -> float:
+        if not self.table:
+            # sin mapa: las variables del modelo son numéricas
+            try:
+                return float(answer)
+            except (TypeError, ValueError):
+                raise AnswerError(self.message)
+        if isinstance(answer, (int, float)) and not isinstance(answer, bool) and answer in self.codes:
+            return answer
+        value = self.table.get(fold_answer(answer))
+        if value is None:
+            raise AnswerError(self.message)
+        return value
+
+
+class NumberValidator(QuestionValidator):
+    """Número dentro de [min, max], extraído del texto ("70 kg", "1,75") o recibido ya numérico."""
+
+    def __init__(self, question: Dict[str, Any]):
+        super().__init__(question)
+        self.min = question.get("min")
+        self.max = question.get("max")
+        self.transform = question.get("transform")
+        self.message = f"Por favor proporciona un número válido (entre {question.get('min', 0)} y {question.get('max', 1000)})."
+
+    def parse(self, answer: Any) -> float:
+        if isinstance(answer, (int, float)) and not isinstance(answer, bool):
+            value = float(answer)
+        else:
+            match = _NUMBER_RE.search(str(answer))
+            if match is None:
+                raise AnswerError(self.message)
+            value = float(match.group().replace(',', '.'))
+        # NaN no falla ninguna comparación: se descarta antes de comprobar el rango
+        if not math.isfinite(value):
+            raise AnswerError(self.message)
+        if self.min is not None and value < self.min:
+            raise AnswerError(f"El valor debe ser al menos {self.min}.")
+        if self.max is not None and value > self.max:
+            raise AnswerError(f"El valor debe ser máximo {self.max}.")
+        if self.transform is not None:
+            value = self.transform(value)
+        return value
+
+
+def compile_question(question: Dict[str, Any]) -> QuestionValidator:
+    if question["type"] == "choice":
+        return ChoiceValidator(question)
+    if question["type"] == "number":
+        return NumberValidator(question)
+    raise ValueError(f"Tipo de pregunta desconocido: {question['type']}")
+
+
+# Un validador por pregunta, en el orden de VARIABLE_QUESTIONS
+VALIDATORS = tuple(compile_question(q) for q in VARIABLE_QUESTIONS)
+VALIDATORS_BY_VARIABLE = {v.variable: v for v in VALIDATORS}
+
+
+def validate_submission(answers: Mapping[str, Any]) -> Tuple[Dict[str, float], Dict[str, str]]:
+    """
+    Valida de una vez las respuestas de un cuestionario completo ({variable: respuesta}).
+
+    Las respuestas pueden ser texto (como en el chat) o ya numéricas (códigos del mapa
+    o valores). Devuelve (valores válidos, {variable: mensaje de error}); faltantes y
+    variables desconocidas cuentan como errores.
+    """
+    values: Dict[str, float] = {}
+    errors: Dict[str, str] = {}
+    for validator in VALIDATORS:
+        answer = answers.get(validator.variable)
+        if answer is None or answer == "":
+            errors[validator.variable] = "Falta la respuesta."
+            continue
+        try:
+            values[validator.variable] = validator.parse(answer)
+        except AnswerError as e:
+            errors[validator.variable] = str(e)
+    for name in answers:
+        if name not in VALIDATORS_BY_VARIABLE:
+            errors[name] = "Variable desconocida."
+    return values, errors
+
+
+# Variables de la sesión en orden fijo: las de VARIABLE_QUESTIONS y el BMI calculado
+SESSION_VARIABLES = tuple(q["variable"] for q in VARIABLE_QUESTIONS) + ("BMI",)
+_VARIABLE_SLOTS = {name: i for i, name in enumerate(SESSION_VARIABLES)}
+# Las respuestas de opción se guardan como enteros (códigos del mapa)
+_INTEGER_SLOTS = frozenset(i for i, q in enumerate(VARIABLE_QUESTIONS) if q["type"] == "choice")
+_QUESTION_MASK = (1 << len(VARIABLE_QUESTIONS)) - 1
+
+
+class CompactSession:
+    """
+    Forma interna de una sesión: los valores en un array de floats en el orden de
+    SESSION_VARIABLES, un entero como máscara de variables respondidas y la fecha
+    de inicio como timestamp. Ocupa una fracción de `PredictionSession`
+    (ver `python -m src.session_benchmark`); el modelo pydantic solo se construye
+    en el borde de la API con `to_model()`.
+    """
+
+    __slots__ = ("session_id", "started_at", "values", "answered",
+                 "current_question_index", "completed", "risk_prediction", "risk_level")
+
+    def __init__(self, session_id: str, started_at: float, values: Optional[array] = None, answered: int = 0,
+                 current_question_index: int = 0, completed: bool = False,
+                 risk_prediction: Optional[float] = None, risk_level: Optional[str] = None):
+        self.session_id = session_id
+        self.started_at = started_at
+        self.values = values if values is not None else array("d", bytes(8 * len(SESSION_VARIABLES)))
+        self.answered = answered
+        self.current_question_index = current_question_index
+        self.completed = completed
+        self.risk_prediction = risk_prediction
+        self.risk_level = risk_level
+
+    def set(self, name: str, value: float) -> None:
+        """Registra el valor (numérico) de una variable de SESSION_VARIABLES."""
+        i = _VARIABLE_SLOTS[name]
+        self.values[i] = value
+        self.answered |= 1 << i
+
+    def get(self, name: str, default: Any = None) -> Any:
+        i = _VARIABLE_SLOTS.get(name)
+        if i is None or not self.answered >> i & 1:
+            return default
+        value = self.values[i]
+        return int(value) if i in _INTEGER_SLOTS else value
+
+    def __contains__(self, name: str) -> bool:
+        i = _VARIABLE_SLOTS.get(name)
+        return i is not None and bool(self.answered >> i & 1)
+
+    @property
+    def variables(self) -> Dict[str, Any]:
+        """Copia de las variables respondidas como dict (solo lectura: usar `set` para modificar)."""
+        values = self.values
+        return {
+            name: (int(values[i]) if i in _INTEGER_SLOTS else values[i])
+            for i, name in enumerate(SESSION_VARIABLES)
+            if self.answered >> i & 1
+        }
+
+    def to_model(self) -> PredictionSession:
+        started = datetime.fromtimestamp(self.started_at, timezone.utc).replace(tzinfo=None)
+        return PredictionSession(
+            session_id=self.session_id,
+            started_at=started.isoformat(),
+            variables=self.variables,
+            current_question_index=self.current_question_index,
+            completed=self.completed,
+            risk_prediction=self.risk_prediction,
+            risk_level=self.risk_level,
+        )
+
+    @classmethod
+    def from_model(cls, model: PredictionSession) -> "CompactSession":
+        started = datetime.fromisoformat(model.started_at)
+        if started.tzinfo is None:
+            started = started.replace(tzinfo=timezone.utc)
+        session = cls(model.session_id, started.timestamp(),
+                      current_question_index=model.current_question_index, completed=model.completed,
+                      risk_prediction=model.risk_prediction, risk_level=model.risk_level)
+        for name, value in model.variables.items():
+            session.set(name, value)
+        return session
+
+    def dumps(self) -> str:
+        """Serialización compacta (lista JSON) para los almacenes SQLite/Redis."""
+        return json.dumps([self.session_id, self.started_at, self.values.tolist(), self.answered,
+                           self.current_question_index, self.completed, self.risk_prediction, self.risk_level],
+                          separators=(",", ":"))
+
+    @classmethod
+    def loads(cls, data: str) -> "CompactSession":
+        session_id, started_at, values, answered, index, completed, risk_prediction, risk_level = json.loads(data)
+        return cls(session_id, started_at, array("d", values), answered, index, completed,
+                   risk_prediction, risk_level)
+
+
+# Almacén de sesiones (memoria LRU+TTL, SQLite o Redis según SESSION_STORE; ver src/session_store.py)
+_STORE: Optional[SessionStore] = None
+
+
+def get_session_store() -> SessionStore:
+    """Devuelve el almacén de sesiones del proceso (lo crea y arranca su expiración en el primer uso)."""
+    global _STORE
+    if _STORE is None:
+        _STORE = create_session_store(encode=CompactSession.dumps, decode=CompactSession.loads)
+        start_expiry(_STORE)
+    return _STORE
 
 
-def create_session() -> PredictionSession:
+def save_session(session: CompactSession) -> None:
+    """Persiste los cambios de la sesión (necesario con los backends que serializan)."""
+    get_session_store().set(session.session_id, session)
+
+
+def create_session() -> CompactSession:
     """Crea una nueva sesión de predicción."""
-    session = PredictionSession(
-        session_id=str(uuid.uuid4()),
-        started_at=datetime.utcnow().isoformat()
-    )
-    _SESSIONS[session.session_id] = session
+    session = CompactSession(session_id=str(uuid.uuid4()), started_at=time.time())
+    save_session(session)
     return session
 
 
-def get_session(session_id: str) -> Optional[PredictionSession]:
-    """Obtiene una sesión existente."""
-    return _SESSIONS.get(session_id)
+def get_session(session_id: str) -> Optional[CompactSession]:
+    """Obtiene una sesión existente (None si no existe o expiró)."""
+    return get_session_store().get(session_id)
 
 
-def get_or_create_session(session_id: Optional[str] = None) -> PredictionSession:
+def get_or_create_session(session_id: Optional[str] = None) -> CompactSession:
     """Obtiene una sesión existente o crea una nueva."""
-    if session_id and session_id in _SESSIONS:
-        return _SESSIONS[session_id]
+    if session_id:
+        session = get_session(session_id)
+        if session is not None:
+            return session
     return create_session()
 
 
-def get_next_question(session: PredictionSession) -> Optional[Dict[str, Any]]:
+def get_next_question(session: CompactSession) -> Optional[Dict[str, Any]]:
     """Obtiene la siguiente pregunta para la sesión."""
     if session.current_question_index >= len(VARIABLE_QUESTIONS):
         session.completed = True
@@ -151,7 +394,7 @@ def get_next_question(session: PredictionSession) -> Optional[Dict[str, Any]]:
     return VARIABLE_QUESTIONS[session.current_question_index]
 
 
-def process_answer(session: PredictionSession, answer: str) -> Dict[str, Any]:
+def process_answer(session: CompactSession, answer: str) -> Dict[str, Any]:
     """
     Procesa la respuesta del usuario y actualiza la sesión.
     
@@ -166,90 +409,48 @@ def process_answer(session: PredictionSession, answer: str) -> Dict[str, Any]:
         }
     
     current_q = VARIABLE_QUESTIONS[session.current_question_index]
-    variable = current_q["variable"]
-    q_type = current_q["type"]
+    validator = VALIDATORS[session.current_question_index]
     
     # Validar y procesar respuesta
     try:
-        if q_type == "choice":
-            answer_lower = answer.strip().lower()
-            if "map" in current_q:
-                mapped_value = current_q["map"].get(answer_lower)
-                if mapped_value is None:
-                    return {
-                        "success": False,
-                        "message": f"Por favor responde con una de las opciones: {', '.join(current_q['options'])}",
-                        "next_question": current_q
-                    }
-                session.variables[variable] = mapped_value
-            else:
-                session.variables[variable] = answer.strip()
-                
-        elif q_type == "number":
-            # Extraer número de la respuesta
-            import re
-            numbers = re.findall(r'\d+\.?\d*', answer)
-            if not numbers:
-                return {
-                    "success": False,
-                    "message": f"Por favor proporciona un número válido (entre {current_q.get('min', 0)} y {current_q.get('max', 1000)}).",
-                    "next_question": current_q
-                }
-            
-            value = float(numbers[0])
-            
-            # Validar rango
-            if "min" in current_q and value < current_q["min"]:
-                return {
-                    "success": False,
-                    "message": f"El valor debe ser al menos {current_q['min']}.",
-                    "next_question": current_q
-                }
-            if "max" in current_q and value > current_q["max"]:
-                return {
-                    "success": False,
-                    "message": f"El valor debe ser máximo {current_q['max']}.",
-                    "next_question": current_q
-                }
-            
-            # Aplicar transformación si existe
-            if "transform" in current_q:
-                value = current_q["transform"](value)
-            
-            session.variables[variable] = value
-        
-        # Avanzar a la siguiente pregunta
-        session.current_question_index += 1
-        next_q = get_next_question(session)
-        
+        session.set(validator.variable, validator.parse(answer))
+    except AnswerError as e:
         return {
-            "success": True,
-            "message": "Respuesta registrada correctamente.",
-            "next_question": next_q
+            "success": False,
+            "message": str(e),
+            "next_question": current_q
         }
-        
     except Exception as e:
         return {
             "success": False,
             "message": f"Error procesando la respuesta: {str(e)}",
             "next_question": current_q
         }
+    
+    # Avanzar a la siguiente pregunta
+    session.current_question_index += 1
+    next_q = get_next_question(session)
+    
+    return {
+        "success": True,
+        "message": "Respuesta registrada correctamente.",
+        "next_question": next_q
+    }
 
 
-def calculate_bmi(session: PredictionSession) -> None:
+def calculate_bmi(session: CompactSession) -> None:
     """Calcula el BMI si hay peso y altura disponibles."""
-    if "Weight_kg" in session.variables and "Height_cm" in session.variables:
-        weight = session.variables["Weight_kg"]
-        height_m = session.variables["Height_cm"] / 100.0
-        session.variables["BMI"] = weight / (height_m ** 2)
+    if "Weight_kg" in session and "Height_cm" in session:
+        weight = session.get("Weight_kg")
+        height_m = session.get("Height_cm") / 100.0
+        session.set("BMI", weight / (height_m ** 2))
 
 
-def get_missing_variables(session: PredictionSession) -> List[str]:
+def get_missing_variables(session: CompactSession) -> List[str]:
     """Obtiene las variables que aún faltan por recopilar."""
-    required = [q["variable"] for q in VARIABLE_QUESTIONS]
-    return [v for v in required if v not in session.variables]
+    return [v for i, v in enumerate(SESSION_VARIABLES[:len(VARIABLE_QUESTIONS)]) if not session.answered >> i & 1]
 
 
-def is_session_complete(session: PredictionSession) -> bool:
+def is_session_complete(session: CompactSession) -> bool:
     """Verifica si la sesión tiene todas las variables necesarias."""
-    return session.completed and len(get_missing_variables(session)) == 0
+    return session.completed and session.answered & _QUESTION_MASK == _QUESTION_MASK
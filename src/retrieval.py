@@ -1,41 +1,77 @@
-from pathlib import Path
+import os
 import logging
-from typing import List
-import numpy as np
+from typing import List, Optional, Sequence
 
 try:
     from src import utils
+    from src.vector_index import get_resident_index
+    from src.vector_search import top_k_cosine
 except ImportError:
     import utils
+    from vector_index import get_resident_index
+    from vector_search import top_k_cosine
 
 logger = logging.getLogger(__name__)
 
-def retrieve_relevant(query: str, top_k: int = 5) -> List[dict]:
-    """Recupera los `top_k` fragmentos más similares desde el índice (kb/db/index.npz).
 
-    Devuelve lista de metadatas con clave adicional `score` (cosine similarity).
+def _search_snapshot(snapshot, query_vectors, top_k: int):
+    """Elige búsqueda exacta o IVF según RETRIEVAL_MODE (auto | exact | ivf).
+
+    En modo `auto` se usa el IVF si la versión publicada lo incluye. RETRIEVAL_NPROBE
+    controla el compromiso recall/latencia del IVF.
     """
-    index_path = Path(__file__).parent.parent / 'kb' / 'db' / 'index.npz'
-    if not index_path.exists():
-        logger.info('No se encontró índice en %s', index_path)
-        return []
-    emb_arr, metadatas = utils.load_index(index_path)
-    if emb_arr is None or not metadatas:
-        return []
+    mode = os.getenv('RETRIEVAL_MODE', 'auto').lower()
+    if snapshot.ivf is not None and mode != 'exact':
+        nprobe = int(os.getenv('RETRIEVAL_NPROBE', '8'))
+        return snapshot.ivf.search(snapshot.embeddings, query_vectors, top_k, nprobe=nprobe)
+    if mode == 'ivf':
+        logger.warning('RETRIEVAL_MODE=ivf pero el índice %s no tiene IVF; usando búsqueda exacta', snapshot.version)
+    return top_k_cosine(snapshot.embeddings, query_vectors, top_k)
+
 
-    q_emb = utils.embed_texts([query])[0]
-    emb_matrix = np.array(emb_arr)
-    qv = np.array(q_emb)
+def search_vectors(query_vectors: Sequence[Sequence[float]], top_k: int = 5, snippet_chars: Optional[int] = None) -> List[List[dict]]:
+    """Busca en el índice residente los `top_k` fragmentos para cada vector de consulta.
 
-    def cos(a, b):
-        denom = (np.linalg.norm(a) * np.linalg.norm(b))
-        return float(np.dot(a, b) / denom) if denom != 0 else 0.0
+    Devuelve una lista (una por consulta) de metadatas con clave adicional `score`.
+    Si se indica `snippet_chars`, el texto de cada fragmento se recorta a ese largo.
+    """
+    snapshot = get_resident_index().get()
+    if snapshot is None:
+        logger.info('No se encontró índice en %s', get_resident_index().db_dir)
+        return [[] for _ in query_vectors]
+    if snapshot.embeddings is None or not snapshot.metadatas:
+        return [[] for _ in query_vectors]
 
-    scores = [cos(qv, emb_matrix[i]) for i in range(len(emb_matrix))]
-    idxs = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
+    idxs, scores = _search_snapshot(snapshot, query_vectors, top_k)
     results = []
-    for i in idxs:
-        m = dict(metadatas[i])
-        m['score'] = scores[i]
-        results.append(m)
+    for row_idx, row_scores in zip(idxs, scores):
+        hits = []
+        for i, score in zip(row_idx, row_scores):
+            if i < 0:
+                continue
+            m = dict(snapshot.metadatas[i])
+            if snippet_chars is not None and isinstance(m.get('text'), str):
+                m['text'] = m['text'][:snippet_chars]
+            m['score'] = float(score)
+            hits.append(m)
+        results.append(hits)
     return results
+
+
+def retrieve_relevant(query: str, top_k: int = 5) -> List[dict]:
+    """Recupera los `top_k` fragmentos más similares desde el índice residente (kb/db).
+
+    Devuelve lista de metadatas con clave adicional `score` (cosine similarity).
+    """
+    return retrieve_relevant_batch([query], top_k=top_k)[0]
+
+
+def retrieve_relevant_batch(queries: List[str], top_k: int = 5) -> List[List[dict]]:
+    """Versión por lotes de `retrieve_relevant`: un solo embedding y un solo producto matricial."""
+    if not queries:
+        return []
+    if get_resident_index().get() is None:
+        logger.info('No se encontró índice en %s', get_resident_index().db_dir)
+        return [[] for _ in queries]
+    q_embs = utils.embed_texts(list(queries))
+    return search_vectors(q_embs, top_k=top_k)
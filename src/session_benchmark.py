@@ -0,0 +1,114 @@
+"""
+Benchmark de memoria de las sesiones de evaluación: `PredictionSession`
+(pydantic, dict de variables y fecha ISO) frente a `CompactSession`.
+
+Crea N sesiones de cada forma con el mismo contenido (a mitad de cuestionario y
+completas) y mide con tracemalloc la memoria que retienen, además del tamaño
+serializado que se guardaría en SQLite/Redis.
+
+Uso:
+    python -m src.session_benchmark --sessions 100000
+"""
+from pathlib import Path
+from typing import Callable, List, Optional
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tracemalloc
+
+try:
+    from src.prediction_session import CompactSession, PredictionSession, VARIABLE_QUESTIONS, calculate_bmi
+except ImportError:
+    project_root = Path(__file__).resolve().parent.parent
+    if str(project_root) not in sys.path:
+        sys.path.insert(0, str(project_root))
+    from src.prediction_session import CompactSession, PredictionSession, VARIABLE_QUESTIONS, calculate_bmi
+
+
+def _answer(q: dict, rng: random.Random) -> float:
+    if q["type"] == "choice":
+        return rng.choice(sorted(set(q["map"].values())))
+    return float(rng.randint(int(q["min"]), int(q["max"])))
+
+
+def make_sessions(n: int, answered: int, seed: int = 0) -> List[CompactSession]:
+    """`n` sesiones compactas con las primeras `answered` preguntas respondidas."""
+    rng = random.Random(seed)
+    sessions = []
+    for _ in range(n):
+        s = CompactSession(str(uuid.uuid4()), time.time() - rng.random() * 3600)
+        for q in VARIABLE_QUESTIONS[:answered]:
+            s.set(q["variable"], _answer(q, rng))
+        s.current_question_index = answered
+        if answered == len(VARIABLE_QUESTIONS):
+            calculate_bmi(s)
+            s.completed = True
+            s.risk_prediction = rng.random()
+            s.risk_level = ("bajo", "medio", "alto")[int(s.risk_prediction * 3)]
+        sessions.append(s)
+    return sessions
+
+
+def measure(build: Callable[[], list]) -> int:
+    """Bytes retenidos por los objetos que devuelve `build`."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del objects
+    return total
+
+
+def run(n: int) -> dict:
+    report = {}
+    for label, answered in (('mitad', len(VARIABLE_QUESTIONS) // 2), ('completa', len(VARIABLE_QUESTIONS))):
+        # los ids son los mismos en ambos casos y los comparte la clave del almacén: no se cuentan
+        compact = make_sessions(n, answered)
+        payloads = [(s.session_id, s.started_at, s.variables, s.current_question_index, s.completed,
+                     s.risk_prediction, s.risk_level) for s in compact]
+
+        def build_pydantic():
+            return [PredictionSession(session_id=sid, started_at=CompactSession(sid, ts).to_model().started_at,
+                                      variables=variables, current_question_index=idx, completed=done,
+                                      risk_prediction=rp, risk_level=rl)
+                    for sid, ts, variables, idx, done, rp, rl in payloads]
+
+        def build_compact():
+            out = []
+            for sid, ts, variables, idx, done, rp, rl in payloads:
+                s = CompactSession(sid, ts, current_question_index=idx, completed=done, risk_prediction=rp, risk_level=rl)
+                for name, value in variables.items():
+                    s.set(name, value)
+                out.append(s)
+            return out
+
+        pydantic_bytes = measure(build_pydantic)
+        compact_bytes = measure(build_compact)
+        sample = compact[:1000]
+        report[label] = {
+            'sessions': n,
+            'pydantic_mb': round(pydantic_bytes / 2 ** 20, 1),
+            'compact_mb': round(compact_bytes / 2 ** 20, 1),
+            'pydantic_bytes_per_session': round(pydantic_bytes / n),
+            'compact_bytes_per_session': round(compact_bytes / n),
+            'reduction': round(pydantic_bytes / max(compact_bytes, 1), 1),
+            'pydantic_json_bytes': round(sum(len(s.to_model().model_dump_json()) for s in sample) / len(sample)),
+            'compact_json_bytes': round(sum(len(s.dumps()) for s in sample) / len(sample)),
+        }
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Memoria por sesión: PredictionSession vs CompactSession')
+    parser.add_argument('--sessions', type=int, default=100000)
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.sessions), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
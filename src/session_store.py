@@ -0,0 +1,254 @@
+"""
+Almacenes de sesiones con expiración (sesiones de evaluación de riesgo).
+
+Todos los backends exponen la misma interfaz (`get`, `set`, `delete`,
+`expire`) y una TTL deslizante: cada lectura o escritura renueva la expiración,
+de modo que solo caducan las sesiones abandonadas.
+
+- `memory`: diccionario LRU acotado a `max_entries`, local al proceso.
+- `sqlite`: archivo SQLite (WAL) compartible entre workers de la misma máquina.
+- `redis`: cualquier cliente compatible con Redis (`get`/`set(ex=)`/`delete`),
+  p. ej. `redis.Redis` entre réplicas o `fakeredis.FakeRedis` en pruebas. La
+  expiración la hace el propio servidor.
+
+Los backends que serializan (`sqlite`, `redis`) reciben `encode`/`decode`
+(objeto <-> str); el de memoria guarda el objeto tal cual.
+
+Configuración por entorno:
+- SESSION_STORE: memory | sqlite | redis (por defecto memory)
+- SESSION_TTL: segundos de inactividad antes de expirar (por defecto 3600)
+- SESSION_MAX_ENTRIES: máximo de sesiones en memoria (por defecto 10000)
+- SESSION_DB_PATH: archivo SQLite (por defecto data/sessions.sqlite)
+- SESSION_REDIS_URL: URL del servidor Redis (por defecto redis://localhost:6379/0)
+- SESSION_SWEEP_INTERVAL: segundos entre barridos de expiración (por defecto 60)
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Optional
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = Path(__file__).parent.parent / 'data' / 'sessions.sqlite'
+SESSION_BACKENDS = ('memory', 'sqlite', 'redis')
+
+
+class SessionStore(ABC):
+    """Interfaz común de los almacenes de sesiones."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Devuelve la sesión (renovando su expiración) o None si no existe o caducó."""
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        """Guarda la sesión con una expiración de `ttl` segundos."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Elimina la sesión si existe."""
+
+    def expire(self) -> int:
+        """Elimina las sesiones caducadas y devuelve cuántas se borraron."""
+        return 0
+
+    def close(self) -> None:
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """LRU en memoria con TTL; al superar `max_entries` se descarta la sesión usada hace más tiempo."""
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 10000):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def expire(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]
+            for k in expired:
+                del self._entries[k]
+        return len(expired)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sesiones serializadas en una tabla SQLite con su instante de expiración."""
+
+    def __init__(self, path: Path = DEFAULT_DB_PATH, ttl: float = 3600,
+                 encode: Callable[[Any], str] = str, decode: Callable[[str], Any] = str):
+        super().__init__(ttl)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.encode = encode
+        self.decode = decode
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        # WAL: varios workers leen y escriben el mismo archivo sin bloquearse entre sí
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            ' key TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at)')
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data FROM sessions WHERE key = ? AND expires_at > ?', (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE sessions SET expires_at = ? WHERE key = ?', (now + self.ttl, key))
+            self._conn.commit()
+        return self.decode(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        data = self.encode(value)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sessions (key, data, expires_at) VALUES (?, ?, ?)',
+                (key, data, time.time() + self.ttl),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM sessions WHERE key = ?', (key,))
+            self._conn.commit()
+
+    def expire(self) -> int:
+        with self._lock:
+            cur = self._conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),))
+            self._conn.commit()
+        return cur.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSessionStore(SessionStore):
+    """Sesiones en un servidor compatible con Redis; la TTL la aplica el servidor (`SET ... EX`)."""
+
+    def __init__(self, client, ttl: float = 3600, prefix: str = 'session:',
+                 encode: Callable[[Any], str] = str, decode: Callable[[str], Any] = str):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+        self.encode = encode
+        self.decode = decode
+
+    def get(self, key: str) -> Optional[Any]:
+        name = self.prefix + key
+        data = self.client.get(name)
+        if data is None:
+            return None
+        self.client.expire(name, int(self.ttl))
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return self.decode(data)
+
+    def set(self, key: str, value: Any) -> None:
+        self.client.set(self.prefix + key, self.encode(value), ex=int(self.ttl))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+
+class _ExpirySweeper(threading.Thread):
+    """Hilo de fondo que llama periódicamente a `store.expire()`."""
+
+    def __init__(self, store: SessionStore, interval: float):
+        super().__init__(name='session-expiry', daemon=True)
+        self.store = store
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                removed = self.store.expire()
+            except Exception:
+                logger.exception('Error al expirar sesiones')
+                continue
+            if removed:
+                logger.info('Sesiones expiradas: %d', removed)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+def create_session_store(backend: Optional[str] = None, encode: Callable[[Any], str] = str,
+                         decode: Callable[[str], Any] = str) -> SessionStore:
+    """Construye el almacén indicado (o el de SESSION_STORE) con la configuración del entorno."""
+    backend = (backend or os.getenv('SESSION_STORE', 'memory')).lower()
+    ttl = float(os.getenv('SESSION_TTL', '3600'))
+    if backend == 'sqlite':
+        path = Path(os.getenv('SESSION_DB_PATH', str(DEFAULT_DB_PATH)))
+        return SQLiteSessionStore(path, ttl=ttl, encode=encode, decode=decode)
+    if backend == 'redis':
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("SESSION_STORE=redis requiere la dependencia 'redis'. Instálala con: pip install redis") from e
+        client = redis.Redis.from_url(os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/0'))
+        return RedisSessionStore(client, ttl=ttl, encode=encode, decode=decode)
+    if backend != 'memory':
+        logger.warning('SESSION_STORE=%s desconocido; usando memory', backend)
+    return MemorySessionStore(ttl=ttl, max_entries=int(os.getenv('SESSION_MAX_ENTRIES', '10000')))
+
+
+_SWEEPER: Optional[_ExpirySweeper] = None
+
+
+def start_expiry(store: SessionStore, interval: Optional[float] = None) -> _ExpirySweeper:
+    """Arranca (una vez por proceso) el barrido periódico de sesiones caducadas."""
+    global _SWEEPER
+    if _SWEEPER is not None:
+        _SWEEPER.stop()
+    interval = float(os.getenv('SESSION_SWEEP_INTERVAL', '60')) if interval is None else interval
+    _SWEEPER = _ExpirySweeper(store, interval)
+    _SWEEPER.start()
+    return _SWEEPER
@@ -3,6 +3,16 @@ from pathlib import Path
 import os
 import json
 import numpy as np
+
+try:
+    from src.embedding_cache import get_embedding_cache
+    from src.embedding_client import get_embedding_dispatcher
+    from src.local_embedder import get_local_embedder
+except ImportError:
+    from embedding_cache import get_embedding_cache
+    from embedding_client import get_embedding_dispatcher
+    from local_embedder import get_local_embedder
+
 try:
     # Cargar variables del .env del proyecto (si existe)
     from dotenv import load_dotenv
@@ -71,6 +81,19 @@ def chunk_text(text: str, max_chars: int = 1000) -> List[str]:
 
 
 def _embed_openai(texts: List[str], model: str) -> List[List[float]]:
+    """Embeddings vía API de OpenAI.
+
+    Usa el despachador concurrente con reintentos (`embedding_client`); si httpx
+    no está disponible, cae en el SDK `openai` (cliente moderno y, si no existe,
+    `openai.Embedding` del SDK antiguo).
+    """
+    try:
+        dispatcher = get_embedding_dispatcher(model)
+    except RuntimeError:
+        dispatcher = None
+    if dispatcher is not None:
+        return dispatcher.embed(texts)
+
     try:
         import openai
     except ImportError:
@@ -90,27 +113,21 @@ def _embed_openai(texts: List[str], model: str) -> List[List[float]]:
                 else:
                     embeddings.append(getattr(item, 'embedding', None))
         return embeddings
-    except Exception:
-        openai.api_key = os.getenv('OPENAI_API_KEY')
-        batch_size = 100
-        embeddings = []
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i+batch_size]
-            resp = openai.Embedding.create(model=model, input=batch)
-            for item in resp['data']:
-                embeddings.append(item['embedding'])
-        return embeddings
+    except ImportError:
+        pass
+    openai.api_key = os.getenv('OPENAI_API_KEY')
+    batch_size = 100
+    embeddings = []
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i+batch_size]
+        resp = openai.Embedding.create(model=model, input=batch)
+        for item in resp['data']:
+            embeddings.append(item['embedding'])
+    return embeddings
 
 def _embed_sentence_transformer(texts: List[str]) -> List[List[float]]:
-    try:
-        from sentence_transformers import SentenceTransformer
-    except ImportError:
-        raise RuntimeError(
-            "No se encontró OPENAI_API_KEY ni la dependencia 'sentence-transformers'. Instálala con: pip install sentence-transformers"
-        )
-    model_local = SentenceTransformer('all-MiniLM-L6-v2')
-    emb_arr = model_local.encode(texts, show_progress_bar=False)
-    return emb_arr.tolist()
+    # El modelo queda residente en el proceso (ver local_embedder)
+    return get_local_embedder().encode(texts)
 
 def embed_texts(texts: List[str], model: str = None):
     """Generar embeddings para una lista de textos.
@@ -119,15 +136,25 @@ def embed_texts(texts: List[str], model: str = None):
       y el modelo indicado por EMBEDDING_MODEL (por defecto 'text-embedding-3-small').
     - Si no hay API key, cae en un fallback local usando sentence-transformers
       (requiere instalación de `sentence-transformers`).
+    - Los vectores ya calculados se leen de la caché persistente
+      (`embedding_cache`), indexada por (modelo, hash del texto).
 
     Devuelve una lista de vectores (listas de floats).
     """
     openai_key = os.getenv('OPENAI_API_KEY')
     model = model or os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
     if openai_key:
-        return _embed_openai(texts, model)
+        backend_model = model
+        embed_fn = lambda batch: _embed_openai(batch, model)
     else:
-        return _embed_sentence_transformer(texts)
+        backend_model = get_local_embedder().model_name
+        embed_fn = _embed_sentence_transformer
+    if not texts:
+        return []
+    cache = get_embedding_cache()
+    if cache is None:
+        return embed_fn(texts)
+    return cache.embed(backend_model, texts, embed_fn)
 
 
 def save_index(emb_arr: np.ndarray, metadatas: List[dict], index_path: Path):
@@ -0,0 +1,233 @@
+"""
+Índice vectorial residente para la recuperación (RAG).
+
+Formato en disco (bajo `kb/db/`):
+
+- `versions/<version>/embeddings.npy`: matriz float32 sin comprimir, se abre con
+  `np.load(mmap_mode='r')` para que todos los workers de uvicorn compartan las
+  mismas páginas a través del page cache del sistema operativo.
+- `versions/<version>/metadatas.json`: metadata por fragmento.
+- `versions/<version>/info.json`: dimensiones y si los vectores están normalizados.
+- `versions/<version>/ivf.npz` (opcional): índice aproximado IVF (ver `ann_index`).
+- `CURRENT`: nombre de la versión activa. Se reemplaza de forma atómica
+  (`os.replace`) al publicar un índice nuevo, por lo que los lectores ven siempre
+  la versión anterior completa o la nueva completa.
+
+Si no existe `CURRENT` se usa el índice legado `index.npz` (si existe).
+"""
+from pathlib import Path
+from typing import List, Optional
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+from datetime import datetime, timezone
+import numpy as np
+
+try:
+    from src import utils
+    from src.vector_search import normalize_rows
+    from src.ann_index import IVFIndex, IVF_FILE
+except ImportError:
+    import utils
+    from vector_search import normalize_rows
+    from ann_index import IVFIndex, IVF_FILE
+
+logger = logging.getLogger(__name__)
+
+DB_DIR = Path(__file__).parent.parent / 'kb' / 'db'
+LEGACY_INDEX_NAME = 'index.npz'
+CURRENT_FILE = 'CURRENT'
+VERSIONS_DIR = 'versions'
+EMBEDDINGS_FILE = 'embeddings.npy'
+METADATAS_FILE = 'metadatas.json'
+INFO_FILE = 'info.json'
+
+
+class IndexSnapshot:
+    """Vista inmutable de una versión del índice (embeddings + metadatas + IVF opcional)."""
+    __slots__ = ('version', 'embeddings', 'metadatas', 'path', 'ivf')
+
+    def __init__(self, version: str, embeddings: np.ndarray, metadatas: List[dict], path: Optional[Path] = None, ivf: Optional[IVFIndex] = None):
+        self.version = version
+        self.embeddings = embeddings
+        self.metadatas = metadatas
+        self.path = path
+        self.ivf = ivf
+
+    def __len__(self) -> int:
+        return len(self.metadatas)
+
+
+def _new_version() -> str:
+    # prefijo temporal con microsegundos: el orden lexicográfico es el de publicación
+    return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f') + '-' + uuid.uuid4().hex[:6]
+
+
+def read_current_version(db_dir: Path = DB_DIR) -> Optional[str]:
+    """Devuelve la versión activa apuntada por `CURRENT` (o None si no existe)."""
+    try:
+        version = (Path(db_dir) / CURRENT_FILE).read_text(encoding='utf-8').strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+
+def publish_index(emb_arr: np.ndarray, metadatas: List[dict], db_dir: Path = DB_DIR, keep: int = 2, ivf_lists: int = 0, ivf_centroids: Optional[np.ndarray] = None) -> str:
+    """Escribe una versión nueva del índice y la activa de forma atómica.
+
+    - emb_arr: array (n_fragments, dim); se guarda normalizado, float32 y sin comprimir
+    - metadatas: lista de dicts con metadata por fragmento
+    - keep: número de versiones a conservar en disco (incluida la activa)
+    - ivf_lists: si es > 0, construye además un índice IVF con ese número de listas
+    - ivf_centroids: centroides ya entrenados a reutilizar (evita re-entrenar el IVF)
+
+    Devuelve el identificador de la versión publicada.
+    """
+    db_dir = Path(db_dir)
+    versions_dir = db_dir / VERSIONS_DIR
+    versions_dir.mkdir(parents=True, exist_ok=True)
+
+    version = _new_version()
+    tmp_dir = versions_dir / f".tmp-{version}"
+    tmp_dir.mkdir()
+    emb = np.asarray(emb_arr, dtype=np.float32)
+    emb = emb.reshape(0, 0) if emb.size == 0 else normalize_rows(emb)
+    np.save(str(tmp_dir / EMBEDDINGS_FILE), np.ascontiguousarray(emb))
+    with open(tmp_dir / METADATAS_FILE, 'w', encoding='utf-8') as f:
+        json.dump(metadatas, f, ensure_ascii=False)
+    info = {'count': int(emb.shape[0]), 'dim': int(emb.shape[1]), 'normalized': True}
+    if ivf_centroids is not None and emb.shape[0] > 0:
+        ivf = IVFIndex.from_centroids(emb, ivf_centroids)
+        ivf.save(tmp_dir / IVF_FILE)
+        info['ivf_lists'] = ivf.n_lists
+    elif ivf_lists > 0 and emb.shape[0] > 0:
+        ivf = IVFIndex.build(emb, n_lists=ivf_lists)
+        ivf.save(tmp_dir / IVF_FILE)
+        info['ivf_lists'] = ivf.n_lists
+    with open(tmp_dir / INFO_FILE, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    os.rename(tmp_dir, versions_dir / version)
+
+    # Cambiar el puntero CURRENT de forma atómica
+    tmp_current = db_dir / f".{CURRENT_FILE}.{os.getpid()}.tmp"
+    tmp_current.write_text(version, encoding='utf-8')
+    os.replace(tmp_current, db_dir / CURRENT_FILE)
+
+    _prune_versions(versions_dir, version, keep)
+    print(f"Índice publicado en {versions_dir / version}")
+    return version
+
+
+def _prune_versions(versions_dir: Path, current: str, keep: int) -> None:
+    """Elimina versiones antiguas conservando las `keep` más recientes.
+
+    En Linux los workers que aún tengan mapeada una versión borrada la siguen
+    leyendo sin problemas hasta su próxima recarga.
+    """
+    names = sorted(p.name for p in versions_dir.iterdir() if p.is_dir() and not p.name.startswith('.'))
+    stale = [n for n in names if n != current][:max(0, len(names) - max(1, keep))]
+    for name in stale:
+        try:
+            shutil.rmtree(versions_dir / name)
+        except OSError:
+            logger.warning('No se pudo eliminar la versión antigua del índice %s', name)
+
+
+def load_snapshot(version: str, db_dir: Path = DB_DIR) -> IndexSnapshot:
+    """Carga una versión publicada con los embeddings memory-mapped.
+
+    Las versiones sin `info.json` (anteriores a la normalización) se normalizan
+    en memoria al cargarlas.
+    """
+    path = Path(db_dir) / VERSIONS_DIR / version
+    emb = np.load(str(path / EMBEDDINGS_FILE), mmap_mode='r')
+    info = {}
+    if (path / INFO_FILE).exists():
+        with open(path / INFO_FILE, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    if not info.get('normalized') and emb.size:
+        emb = normalize_rows(emb)
+    with open(path / METADATAS_FILE, 'r', encoding='utf-8') as f:
+        metadatas = json.load(f)
+    ivf = IVFIndex.load(path / IVF_FILE) if (path / IVF_FILE).exists() else None
+    return IndexSnapshot(version, emb, metadatas, path, ivf)
+
+
+def _load_legacy_snapshot(index_path: Path) -> IndexSnapshot:
+    emb, metadatas = utils.load_index(index_path)
+    emb = normalize_rows(emb) if emb is not None and np.size(emb) else np.zeros((0, 0), dtype=np.float32)
+    version = f"legacy-{index_path.stat().st_mtime_ns}"
+    return IndexSnapshot(version, emb, metadatas, index_path)
+
+
+class ResidentIndex:
+    """Índice residente en el proceso con recarga en caliente.
+
+    `get()` devuelve la instantánea actual. Como máximo cada `check_interval`
+    segundos se relee `CURRENT`; si cambió, se carga la nueva versión y se
+    sustituye la referencia (una asignación, atómica para los lectores). Las
+    peticiones en curso siguen usando la instantánea que ya tenían.
+    """
+
+    def __init__(self, db_dir: Path = DB_DIR, check_interval: Optional[float] = None):
+        self.db_dir = Path(db_dir)
+        if check_interval is None:
+            check_interval = float(os.getenv('INDEX_RELOAD_INTERVAL', '2'))
+        self.check_interval = check_interval
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._last_check = float('-inf')
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[IndexSnapshot]:
+        if time.monotonic() - self._last_check < self.check_interval:
+            return self._snapshot
+        with self._lock:
+            if time.monotonic() - self._last_check >= self.check_interval:
+                self._refresh()
+                self._last_check = time.monotonic()
+        return self._snapshot
+
+    def reload(self) -> Optional[IndexSnapshot]:
+        """Fuerza la comprobación de una nueva versión."""
+        with self._lock:
+            self._refresh()
+            self._last_check = time.monotonic()
+        return self._snapshot
+
+    def _refresh(self) -> None:
+        current = self._snapshot
+        try:
+            version = read_current_version(self.db_dir)
+            if version is not None:
+                if current is None or current.version != version:
+                    self._snapshot = load_snapshot(version, self.db_dir)
+                    logger.info('Índice vectorial cargado: versión %s (%d fragmentos)', version, len(self._snapshot))
+                return
+            legacy_path = self.db_dir / LEGACY_INDEX_NAME
+            if not legacy_path.exists():
+                if current is not None:
+                    logger.warning('El índice vectorial desapareció de %s; se mantiene la versión %s', self.db_dir, current.version)
+                return
+            if current is None or current.version != f"legacy-{legacy_path.stat().st_mtime_ns}":
+                self._snapshot = _load_legacy_snapshot(legacy_path)
+                logger.info('Índice legado cargado desde %s (%d fragmentos)', legacy_path, len(self._snapshot))
+        except Exception:
+            logger.exception('No se pudo cargar el índice vectorial; se mantiene la versión anterior')
+
+
+_RESIDENT_INDEX: Optional[ResidentIndex] = None
+_RESIDENT_LOCK = threading.Lock()
+
+
+def get_resident_index() -> ResidentIndex:
+    """Devuelve el índice residente del proceso (singleton)."""
+    global _RESIDENT_INDEX
+    if _RESIDENT_INDEX is None:
+        with _RESIDENT_LOCK:
+            if _RESIDENT_INDEX is None:
+                _RESIDENT_INDEX = ResidentIndex()
+    return _RESIDENT_INDEX
@@ -0,0 +1,55 @@
+"""
+Motor de similitud coseno vectorizado para la recuperación.
+
+Los embeddings del índice se guardan normalizados (norma L2 = 1), de modo que la
+similitud coseno se reduce a un producto matriz-vector. La selección del top-k
+usa `argpartition` (O(n)) y solo se ordenan los k candidatos.
+"""
+from typing import Tuple
+import numpy as np
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    """Devuelve una copia float32 con cada fila normalizada a norma 1.
+
+    Las filas de norma 0 se dejan en cero (similitud 0 con cualquier consulta).
+    """
+    mat = np.array(matrix, dtype=np.float32, copy=True)
+    if mat.ndim == 1:
+        mat = mat.reshape(1, -1)
+    if mat.size == 0:
+        return mat
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    mat /= norms
+    return mat
+
+
+def top_k_cosine(matrix: np.ndarray, queries, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Calcula los `k` vecinos más similares para una o varias consultas.
+
+    - matrix: array (n, dim) con filas ya normalizadas
+    - queries: vector (dim,) o matriz (m, dim); se normalizan aquí
+    - k: número de resultados por consulta
+
+    Devuelve (indices, scores), ambos de forma (m, k') con k' = min(k, n),
+    ordenados por similitud descendente.
+    """
+    q = normalize_rows(queries)
+    n = 0 if matrix is None else matrix.shape[0]
+    k = max(0, min(int(k), n))
+    if k == 0:
+        empty = np.zeros((q.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    if q.shape[1] != matrix.shape[1]:
+        raise ValueError(f"Dimensión de la consulta ({q.shape[1]}) distinta a la del índice ({matrix.shape[1]})")
+
+    scores = q @ matrix.T  # (m, n)
+    if k < n:
+        cand = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        cand = np.broadcast_to(np.arange(n), (q.shape[0], n))
+    cand_scores = np.take_along_axis(scores, cand, axis=1)
+    order = np.argsort(-cand_scores, axis=1, kind='stable')
+    return np.take_along_axis(cand, order, axis=1), np.take_along_axis(cand_scores, order, axis=1)
+
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# Agregar el directorio raíz al path de Python (src/, api/, app/)
+root_dir = Path(__file__).resolve().parent.parent
+if str(root_dir) not in sys.path:
+    sys.path.insert(0, str(root_dir))
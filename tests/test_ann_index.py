@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from src.ann_index import IVFIndex, recall_report
+from src.vector_search import normalize_rows
+
+
+@pytest.fixture(scope='module')
+def corpus():
+    # Fragmentos agrupados por tema, como los de la KB
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(40, 32))
+    return normalize_rows(centers[rng.integers(0, 40, 3000)] + rng.normal(scale=0.3, size=(3000, 32)))
+
+
+@pytest.fixture(scope='module')
+def ivf(corpus):
+    return IVFIndex.build(corpus)
+
+
+def test_every_row_belongs_to_exactly_one_list(corpus, ivf):
+    assert ivf.list_offsets[-1] == len(corpus)
+    assert sorted(ivf.list_ids.tolist()) == list(range(len(corpus)))
+
+
+def test_recall_floor(corpus, ivf):
+    recall = {r['nprobe']: r['recall_at_k'] for r in recall_report(corpus, ivf, k=5, nprobes=(8, ivf.n_lists), n_queries=100)}
+    assert recall[8] >= 0.95
+    assert recall[ivf.n_lists] == 1.0   # todas las listas = búsqueda exacta
+
+
+def test_save_load_round_trip(tmp_path, corpus, ivf):
+    path = tmp_path / 'ivf.npz'
+    ivf.save(path)
+    loaded = IVFIndex.load(path)
+    query = corpus[:3]
+    for a, b in zip(ivf.search(corpus, query, 5), loaded.search(corpus, query, 5)):
+        assert np.array_equal(a, b)
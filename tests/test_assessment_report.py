@@ -0,0 +1,72 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import api.coach as coach
+
+ANSWERS = {
+    'Gender': 'Mujer', 'Age_Years': 45, 'Weight_kg': '70 kg', 'Height_cm': 165,
+    'Diabetes_Diagnosis': 'No', 'Prediabetes_Diagnosis': 'No', 'Family_History_Diabetes': 'Sí',
+    'Overweight_Diagnosis': 'No', 'Congestive_Heart_Failure': 'No', 'Coronary_Artery_Disease': 'No',
+    'Thyroid_Problem': 'No', 'Total_MET_Score': 'Moderado (algunas veces)',
+}
+
+
+@pytest.fixture
+def pdf_requests(monkeypatch):
+    # Servicio de PDF simulado: registra las peticiones y acepta el trabajo al instante
+    seen = []
+
+    def handler(request):
+        seen.append(request.url.path)
+        job_id = 'job-1'
+        return httpx.Response(202, json={
+            'job_id': job_id, 'status': 'queued',
+            'status_url': f'/api/pdf/jobs/{job_id}', 'download_url': f'/api/pdf/jobs/{job_id}/download',
+        })
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(coach.httpx, 'AsyncClient', lambda **kw: real_client(transport=httpx.MockTransport(handler), **kw))
+    monkeypatch.setattr(coach, 'run_agent_flow_async', None)
+    # sin servicio registrado (coach servido sin app/main.py) se usa la API HTTP
+    monkeypatch.setattr(coach, '_pdf_service', None)
+    return seen
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(coach.router, prefix='/api/coach')
+    return TestClient(app)
+
+
+def test_report_enqueues_pdf_job_and_returns_202(client, pdf_requests):
+    assessment = client.post('/api/coach/assessment', json={'answers': ANSWERS})
+    assert assessment.status_code == 200, assessment.text
+
+    report = client.post(assessment.json()['report_url'])
+    assert report.status_code == 202, report.text
+    assert report.headers['location'] == '/api/pdf/jobs/job-1'
+    assert report.json()['details']['pdf_data']['status'] == 'queued'
+    assert pdf_requests == ['/api/pdf/jobs']
+
+
+def test_report_uses_in_process_pdf_service_without_http(client, pdf_requests, monkeypatch):
+    calls = []
+
+    async def service(payload, base_url, wait):
+        calls.append(wait)
+        return {'job_id': 'job-2', 'status': 'queued', 'status_url': '/api/pdf/jobs/job-2'}
+
+    monkeypatch.setattr(coach, '_pdf_service', service)
+    session_id = client.post('/api/coach/assessment', json={'answers': ANSWERS}).json()['session_id']
+    report = client.post(f'/api/coach/assessment/{session_id}/report')
+    assert report.status_code == 202
+    assert report.headers['location'] == '/api/pdf/jobs/job-2'
+    assert calls == [False]
+    assert pdf_requests == []
+
+
+def test_blocking_pdf_client_outlasts_server_render_timeout():
+    assert coach.PDF_CLIENT_TIMEOUT > float(coach.os.getenv('PDF_RENDER_TIMEOUT', '60'))
@@ -0,0 +1,74 @@
+import json
+
+import httpx
+import pytest
+
+from src.embedding_client import EmbeddingAPIError, EmbeddingDispatcher
+
+
+TEXTS = [f't{i}' for i in range(7)]
+
+
+def _vector(text):
+    return [float(text[1:]), 1.0]
+
+
+class StubServer:
+    """Endpoint /embeddings en memoria; `responses` fuerza códigos por petición."""
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.batches = []
+
+    def __call__(self, request):
+        batch = json.loads(request.content)['input']
+        self.batches.append(batch)
+        if self.responses:
+            status, headers = self.responses.pop(0)
+            if status != 200:
+                return httpx.Response(status, headers=headers, text='stub error')
+        data = [{'index': i, 'embedding': _vector(t)} for i, t in reversed(list(enumerate(batch)))]
+        return httpx.Response(200, json={'data': data})
+
+
+def _dispatcher(server, **kwargs):
+    kwargs.setdefault('checkpoint_dir', None)
+    return EmbeddingDispatcher(
+        'stub-model', api_key='test', base_url='http://stub/v1', max_concurrency=1,
+        max_batch_items=3, backoff_base=0.01, transport=httpx.MockTransport(server), **kwargs,
+    )
+
+
+def test_batches_by_item_limit_and_preserves_order():
+    server = StubServer()
+    out = _dispatcher(server).embed(TEXTS)
+    assert [len(b) for b in server.batches] == [3, 3, 1]
+    assert out == [_vector(t) for t in TEXTS]
+
+
+def test_429_sets_shared_cooldown_and_retries():
+    server = StubServer([(429, {'retry-after': '0.05'})])
+    dispatcher = _dispatcher(server)
+    assert dispatcher.embed(TEXTS[:2]) == [_vector(t) for t in TEXTS[:2]]
+    assert len(server.batches) == 2
+    assert dispatcher._cooldown_until > 0
+
+
+def test_non_retryable_error_is_raised():
+    server = StubServer([(400, {})])
+    with pytest.raises(EmbeddingAPIError):
+        _dispatcher(server).embed(TEXTS[:2])
+
+
+def test_interrupted_job_resumes_from_checkpoint(tmp_path):
+    failing = StubServer([(200, {}), (400, {})])
+    with pytest.raises(EmbeddingAPIError):
+        _dispatcher(failing, checkpoint_dir=tmp_path).embed(TEXTS)
+    # el lote fallido no deja checkpoint; los demás sí
+    assert len(list(tmp_path.glob('embeddings-*/batch-*.npy'))) == 2
+
+    server = StubServer()
+    out = _dispatcher(server, checkpoint_dir=tmp_path).embed(TEXTS)
+    assert out == [_vector(t) for t in TEXTS]
+    assert server.batches == [TEXTS[3:6]]
+    assert not list(tmp_path.iterdir())
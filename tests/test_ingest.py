@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# ingest importa sus módulos hermanos sin el prefijo `src.`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+import ingest  # noqa: E402
+
+# los procesos del pool heredan los parches del test solo con fork
+requires_fork = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='requiere fork')
+
+
+def _fake_embed(texts):
+    return [[float(len(t)), 1.0] for t in texts]
+
+
+def _crashing_process_file(kb_dir, p):
+    # Simula un fallo nativo (p. ej. del lector de PDF) que mata al proceso hijo
+    if p.stem == 'crash':
+        os._exit(1)
+    return (*ingest.chunk_file(kb_dir, p), ingest.file_fingerprint(p))
+
+
+def _raising_chunk_file(kb_dir, p):
+    if p.stem == 'bad':
+        raise ValueError('archivo corrupto')
+    return _real_chunk_file(kb_dir, p)
+
+
+_real_chunk_file = ingest.chunk_file
+
+
+@pytest.fixture
+def kb(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'embed_texts', _fake_embed)
+    papers = tmp_path / 'papers'
+    papers.mkdir()
+    for name in ('a', 'b', 'c'):
+        (papers / f'{name}.md').write_text(f'# {name}\n\nTexto del documento {name}.', encoding='utf-8')
+    return tmp_path, papers
+
+
+@pytest.mark.parametrize('workers', [1, pytest.param(2, marks=requires_fork)])
+def test_failed_file_is_left_out_of_the_manifest(kb, monkeypatch, workers):
+    kb_dir, papers = kb
+    (papers / 'bad.md').write_text('# bad', encoding='utf-8')
+    monkeypatch.setattr(ingest, 'chunk_file', _raising_chunk_file)
+
+    files = ingest.list_source_files(papers)
+    results = {p.stem: fp for p, _, _, fp in ingest.iter_file_chunks(kb_dir, files, workers=workers)}
+    assert results['bad'] is None
+    assert all(results[name] is not None for name in ('a', 'b', 'c'))
+
+    _, metadatas, fingerprints = ingest.embed_files(kb_dir, files, workers=workers)
+    assert sorted(fingerprints) == ['papers/a.md', 'papers/b.md', 'papers/c.md']
+    assert {m['file'] for m in metadatas} == set(fingerprints)
+
+
+@requires_fork
+def test_broken_pool_marks_remaining_files_as_failed(kb, monkeypatch):
+    kb_dir, papers = kb
+    (papers / 'crash.md').write_text('# crash', encoding='utf-8')
+    monkeypatch.setattr(ingest, '_process_file', _crashing_process_file)
+
+    files = ingest.list_source_files(papers)
+    results = list(ingest.iter_file_chunks(kb_dir, files, workers=2))
+    # todos los archivos se entregan, en orden, y el del fallo nunca con huella
+    assert [p for p, *_ in results] == files
+    assert dict((p.stem, fp) for p, _, _, fp in results)['crash'] is None
+
+
+def test_incremental_update_only_embeds_changed_files(kb, monkeypatch, tmp_path):
+    kb_dir, papers = kb
+    db_dir = tmp_path / 'db'
+    first = ingest.build_index(kb_dir, papers, db_dir, ivf_lists=0)
+    # un retoque sin cambios de contenido (solo mtime) no cuenta como modificación
+    os.utime(papers / 'a.md', ns=(0, 0))
+    assert ingest.update_index(kb_dir, papers, db_dir) == first
+
+    new_b = '# b\n\nContenido nuevo de b, bastante más largo.'
+    new_d = '# d\n\nDocumento nuevo.'
+    (papers / 'b.md').write_text(new_b, encoding='utf-8')
+    (papers / 'c.md').unlink()
+    (papers / 'd.md').write_text(new_d, encoding='utf-8')
+    embedded = []
+    monkeypatch.setattr(ingest, 'embed_texts', lambda texts: embedded.extend(texts) or _fake_embed(texts))
+
+    version = ingest.update_index(kb_dir, papers, db_dir)
+    assert version != first
+    assert embedded == [new_b, new_d]   # a.md se reutiliza, c.md se descarta
+
+    snapshot = ingest.load_snapshot(version, db_dir)
+    assert sorted({m['file'] for m in snapshot.metadatas}) == ['papers/a.md', 'papers/b.md', 'papers/d.md']
+    assert snapshot.embeddings.shape[0] == len(snapshot.metadatas)
+    manifest = ingest.load_manifest(db_dir)
+    assert manifest['version'] == version
+    assert sorted(manifest['files']) == ['papers/a.md', 'papers/b.md', 'papers/d.md']
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import pdf_worker
+from app.pdf_worker import PDFQueueFull, PDFWorkerPool
+
+
+@pytest.fixture
+def render_gate(monkeypatch):
+    # Sustituye el render real (matplotlib + xhtml2pdf) por uno que espera una señal
+    gate = threading.Event()
+
+    def fake_render(**params):
+        gate.wait(5)
+        return 1
+
+    monkeypatch.setattr(pdf_worker, 'render_pdf', fake_render)
+    return gate
+
+
+def _pool(state_dir, **kwargs):
+    pool = PDFWorkerPool(state_dir=state_dir, **kwargs)
+    pool._executor = ThreadPoolExecutor(max_workers=1)
+    return pool
+
+
+def _finalize(job):
+    return {'pdf_id': job.job_id, 'download_url': f'/api/pdf/{job.job_id}/download'}
+
+
+def test_job_state_is_visible_to_another_process_pool(tmp_path, render_gate):
+    async def scenario():
+        owner = _pool(tmp_path)
+        other = PDFWorkerPool(state_dir=tmp_path)   # otro worker que comparte el directorio
+        job = owner.submit('job-1', {}, _finalize)
+        assert other.get('job-1') is None
+        assert other.lookup('job-1')['status'] in ('queued', 'running')
+
+        render_gate.set()
+        await owner.wait(job, timeout=5)
+        state = other.lookup('job-1')
+        assert state['status'] == 'done'
+        assert state['result']['download_url'] == '/api/pdf/job-1/download'
+
+    asyncio.run(scenario())
+
+
+def test_lookup_rejects_unsafe_job_ids(tmp_path):
+    (tmp_path.parent / 'secret.json').write_text('{"status": "done"}', encoding='utf-8')
+    pool = PDFWorkerPool(state_dir=tmp_path)
+    assert pool.lookup('../secret') is None
+    assert pool.lookup('no-existe') is None
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    from fastapi.testclient import TestClient
+    from app import main
+
+    pool = PDFWorkerPool(state_dir=tmp_path)
+    monkeypatch.setattr(main, 'get_pdf_pool', lambda: pool)
+    return TestClient(main.app), pool
+
+
+def test_job_endpoint_answers_for_jobs_accepted_by_another_worker(api, tmp_path, render_gate):
+    client, _ = api
+
+    async def accept_elsewhere():
+        owner = _pool(tmp_path)
+        render_gate.set()
+        await owner.wait(owner.submit('job-9', {}, _finalize), timeout=5)
+
+    asyncio.run(accept_elsewhere())
+    response = client.get('/api/pdf/jobs/job-9')
+    assert response.status_code == 200
+    assert response.json()['status'] == 'done'
+    assert response.json()['download_url'] == '/api/pdf/jobs/job-9/download'
+    assert client.get('/api/pdf/jobs/desconocido').status_code == 404
+
+
+def test_full_queue_raises_and_frees_capacity_when_jobs_finish(tmp_path, render_gate):
+    async def scenario():
+        pool = _pool(tmp_path, workers=1, queue_size=1)
+        jobs = [pool.submit(f'job-{i}', {}, _finalize) for i in range(2)]
+        with pytest.raises(PDFQueueFull):
+            pool.submit('job-extra', {}, _finalize)
+        render_gate.set()
+        for job in jobs:
+            await pool.wait(job, timeout=5)
+        assert pool.pending == 0
+        pool.submit('job-extra', {}, _finalize)
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_answers_429_with_retry_after(api):
+    from app.main import PDF_RETRY_AFTER
+
+    client, pool = api
+    pool._pending = pool.capacity
+    response = client.post('/api/pdf/jobs', json={'html_content': '<p>hola</p>'})
+    assert response.status_code == 429
+    assert response.headers['retry-after'] == PDF_RETRY_AFTER
+    assert client.post('/api/pdf/create', json={'html_content': '<p>hola</p>'}).status_code == 429
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import api.predict as predict
+
+RECORD = {
+    'Gender': 2, 'Age_Years': 45, 'BMI': 27.5, 'Diabetes_Diagnosis': 0, 'Prediabetes_Diagnosis': 0,
+    'Family_History_Diabetes': 1, 'Overweight_Diagnosis': 1, 'Congestive_Heart_Failure': 0,
+    'Coronary_Artery_Disease': 0, 'Thyroid_Problem': 0, 'Total_MET_Score': 600,
+}
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(predict.router, prefix='/api/predict')
+    return TestClient(app)
+
+
+def _rows(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_batch_streams_one_ndjson_line_per_record_in_order(client):
+    records = [{**RECORD, 'id': 'p1'}, {**RECORD, 'Age_Years': 70, 'id': 'p2'}, RECORD]
+    response = client.post('/api/predict/batch', json={'records': records})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    rows = _rows(response)
+    assert [r['index'] for r in rows] == [0, 1, 2]
+    assert [r.get('id') for r in rows] == ['p1', 'p2', None]
+    score, level = predict.predict_diabetes_risk(RECORD)
+    assert rows[2]['risk_score'] == pytest.approx(score, abs=1e-5) and rows[2]['risk_level'] == level
+
+
+def test_batch_accepts_csv(client):
+    header = ','.join(['id', *RECORD])
+    line = ','.join(['c1', *(str(v) for v in RECORD.values())])
+    response = client.post('/api/predict/batch', content=f'{header}\n{line}\n', headers={'content-type': 'text/csv'})
+    assert response.status_code == 200
+    assert _rows(response)[0]['id'] == 'c1'
+
+
+def test_batch_over_row_limit_is_rejected_with_413(client, monkeypatch):
+    monkeypatch.setattr(predict, 'PREDICT_BATCH_MAX_ROWS', 2)
+    response = client.post('/api/predict/batch', json=[RECORD] * 3)
+    assert response.status_code == 413
+    assert client.post('/api/predict/batch', json=[RECORD] * 2).status_code == 200
+
+
+def test_batch_with_invalid_value_is_rejected_before_streaming(client):
+    response = client.post('/api/predict/batch', json=[RECORD, {**RECORD, 'BMI': 'mucho'}])
+    assert response.status_code == 422
+    assert 'BMI' in response.text
@@ -0,0 +1,64 @@
+import pytest
+
+from src.prediction_session import (
+    AnswerError, CompactSession, NumberValidator, QuestionValidator, SESSION_VARIABLES,
+)
+from src.session_store import SQLiteSessionStore
+
+
+@pytest.fixture
+def validator():
+    return NumberValidator({'variable': 'peso', 'type': 'number', 'min': 20, 'max': 300})
+
+
+@pytest.mark.parametrize('answer', [float('nan'), float('inf'), float('-inf')])
+def test_non_finite_numbers_are_rejected(validator, answer):
+    with pytest.raises(AnswerError):
+        validator.parse(answer)
+
+
+def test_number_in_text_is_parsed(validator):
+    assert validator.parse('70,5 kg') == 70.5
+
+
+def test_validator_without_parse_fails_at_construction():
+    class Incomplete(QuestionValidator):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete({'variable': 'x', 'type': 'number'})
+
+
+def _answered_session():
+    session = CompactSession('s-1', 1_700_000_000.25, current_question_index=5)
+    session.set('Gender', 2)
+    session.set('Weight_kg', 70.5)
+    session.set('BMI', 25.9)
+    session.risk_prediction, session.risk_level = 0.42, 'medio'
+    return session
+
+
+def _state(session):
+    return {name: getattr(session, name) for name in CompactSession.__slots__ if name != 'values'}
+
+
+def test_compact_session_round_trips_through_dumps_loads():
+    session = _answered_session()
+    restored = CompactSession.loads(session.dumps())
+    assert _state(restored) == _state(session)
+    assert restored.variables == {'Gender': 2, 'Weight_kg': 70.5, 'BMI': 25.9}
+    assert isinstance(restored.get('Gender'), int)
+    assert 'Age_Years' not in restored and restored.get('Age_Years', 'x') == 'x'
+    assert len(restored.values) == len(SESSION_VARIABLES)
+
+
+def test_compact_session_round_trips_through_the_model_and_sqlite(tmp_path):
+    session = _answered_session()
+    model = session.to_model()
+    assert model.variables == session.variables
+    assert _state(CompactSession.from_model(model)) == _state(session)
+
+    store = SQLiteSessionStore(tmp_path / 'sessions.sqlite', encode=CompactSession.dumps, decode=CompactSession.loads)
+    store.set(session.session_id, session)
+    assert store.get(session.session_id).variables == session.variables
+    store.close()
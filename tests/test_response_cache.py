@@ -0,0 +1,94 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.agents import agents_factory
+from src.agents.response_cache import SemanticResponseCache
+
+
+def _answer(text, risk='bajo'):
+    return {'risk': risk, 'final': text}
+
+
+def test_same_key_hits_and_other_key_misses():
+    cache = SemanticResponseCache(threshold=0.95)
+    cache.put([1.0, 0.0, 0.0], _answer('a'), 'ns', key=('110',))
+    hit = cache.get([1.0, 0.01, 0.0], 'ns', key=('110',))
+    assert hit is not None and hit[0]['final'] == 'a'
+    assert cache.get([1.0, 0.01, 0.0], 'ns', key=('180',)) is None
+
+
+def test_key_mismatch_does_not_hide_matching_neighbour():
+    cache = SemanticResponseCache(threshold=0.95)
+    cache.put([1.0, 0.0, 0.0], _answer('250'), 'ns', key=('250',))
+    cache.put([0.98, 0.1, 0.0], _answer('50'), 'ns', key=('50',))
+    hit = cache.get([1.0, 0.0, 0.0], 'ns', key=('50',))
+    assert hit is not None and hit[0]['final'] == '50'
+
+
+@pytest.fixture
+def flow_cache(monkeypatch):
+    # Embedding constante: solo la key puede separar las consultas
+    cache = SemanticResponseCache(threshold=0.95)
+    monkeypatch.setattr(agents_factory, 'get_response_cache', lambda: cache)
+    monkeypatch.setattr(agents_factory, '_embed_query_cached', lambda query: np.ones(8, dtype=np.float32))
+    monkeypatch.setattr(agents_factory, '_cache_namespace', lambda mode: ('idx', mode))
+    return cache
+
+
+def test_queries_differing_only_in_a_value_miss_each_other(flow_cache):
+    cache, q_emb, scope, hit = agents_factory._cache_lookup('Mi glucosa en ayunas fue 110', 'two_pass')
+    assert hit is None
+    agents_factory._cache_store(cache, q_emb, scope, _answer('respuesta para 110'))
+
+    assert agents_factory._cache_lookup('Mi glucosa en ayunas fue 180', 'two_pass')[3] is None
+    hit = agents_factory._cache_lookup('mi glucosa en ayunas fue 110', 'two_pass')[3]
+    assert hit is not None and hit[0]['final'] == 'respuesta para 110'
+
+
+def test_high_risk_answers_are_not_cached(flow_cache):
+    cache, q_emb, scope, _ = agents_factory._cache_lookup('Tengo la glucosa en 250', 'two_pass')
+    agents_factory._cache_store(cache, q_emb, scope, _answer('acude a urgencias', risk='alto'))
+    assert len(cache) == 0
+    assert agents_factory._cache_lookup('Tengo la glucosa en 250', 'two_pass')[3] is None
+
+
+def _stream_flow(monkeypatch, fail_after):
+    async def call_model(prompt, **kwargs):
+        return 'borrador'
+
+    async def stream_model(prompt, **kwargs):
+        for i, delta in enumerate(['Come ', 'más ', 'verduras.']):
+            if i == fail_after:
+                raise RuntimeError('conexión cortada')
+            yield delta
+
+    async def risk_selector(*args):
+        return 'bajo'
+
+    async def retrieval(user_input):
+        return [], ''
+
+    monkeypatch.setattr(agents_factory, 'get_async_call_model', lambda: call_model)
+    monkeypatch.setattr(agents_factory, 'get_async_stream_model', lambda: stream_model)
+    monkeypatch.setattr(agents_factory, 'run_risk_selector_async', risk_selector)
+    monkeypatch.setattr(agents_factory, 'run_retrieval_async', retrieval)
+
+    async def collect():
+        return [event async for event in agents_factory.run_agent_flow_stream('¿Qué verduras puedo comer?', mode='two_pass')]
+
+    return asyncio.run(collect())
+
+
+def test_interrupted_stream_is_flagged_and_not_cached(flow_cache, monkeypatch):
+    events = _stream_flow(monkeypatch, fail_after=2)
+    kind, done = events[-1]
+    assert kind == 'done' and done['incomplete'] is True
+    assert len(flow_cache) == 0
+
+
+def test_complete_stream_is_cached(flow_cache, monkeypatch):
+    done = _stream_flow(monkeypatch, fail_after=None)[-1][1]
+    assert 'incomplete' not in done
+    assert len(flow_cache) == 1
@@ -0,0 +1,58 @@
+import pytest
+
+from src.agents.risk_classifier import RiskClassifier, glucose_values, fold
+
+
+@pytest.fixture(scope='module')
+def classifier():
+    return RiskClassifier(min_confidence=0.6)
+
+
+@pytest.mark.parametrize('query', [
+    'Mi hijo no quiere que coma dulces',
+    'Tengo confusión sobre los carbohidratos',
+    '¿Cuántas cucharadas de azúcar, 10 está bien?',
+    'A menudo como pan en el desayuno',
+    'Tengo la glucosa en 10 minutos la mido',
+])
+def test_harmless_questions_are_not_confident_alto(classifier, query):
+    prediction = classifier.predict(query)
+    assert not (prediction.label == 'alto' and classifier.is_confident(prediction)), prediction
+
+
+@pytest.mark.parametrize('query, mgdl', [
+    ('tengo la glucosa en 250', 250),
+    ('tengo la glucosa en 50', 50),
+    ('mi glucosa está en 300 mg/dl', 300),
+    ('me salió 320 mg/dl en ayunas', 320),
+    ('mi azúcar en sangre de 45', 45),
+])
+def test_glucose_alarm_values_are_alto(classifier, query, mgdl):
+    prediction = classifier.predict(query)
+    assert prediction.label == 'alto'
+    assert classifier.is_confident(prediction)
+    assert f'alto:glucosa={mgdl}' in prediction.matches
+
+
+@pytest.mark.parametrize('query', [
+    'Siento dolor en el pecho y me falta el aire',
+    'Mi papá estuvo en coma diabético',
+    'Está en estado de confusión y sudando',
+])
+def test_alarm_terms_are_alto(classifier, query):
+    prediction = classifier.predict(query)
+    assert prediction.label == 'alto'
+    assert classifier.is_confident(prediction)
+
+
+def test_terms_match_whole_words(classifier):
+    assert 'bajo:menus' in classifier.predict('menús para la semana').matches
+    assert classifier.predict('a menudo').matches == []
+    assert any(m.startswith('medio:diagnostic') for m in classifier.predict('ya me diagnosticaron').matches)
+
+
+def test_glucose_requires_unit_or_glucose_phrase():
+    assert glucose_values(fold('¿Cuántas cucharadas de azúcar, 10 está bien?')) == []
+    assert glucose_values(fold('una taza de azúcar en 200 gramos de harina')) == []
+    assert glucose_values(fold('glucemia de 7,5 mmol/l')) == [135]
+    assert glucose_values(fold('glucosa en 180 mg/dl')) == [180]
@@ -0,0 +1,161 @@
+import sys
+import time
+import types
+
+import pytest
+
+from src import session_store
+from src.session_store import (
+    MemorySessionStore, RedisSessionStore, SessionStore, SQLiteSessionStore,
+    _ExpirySweeper, create_session_store,
+)
+
+
+class FakeClock:
+    """Sustituye al módulo `time` de session_store para adelantar el reloj a mano."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+class FakeRedis:
+    """Cliente mínimo compatible con Redis (`get`/`set(ex=)`/`expire`/`delete`) sobre un dict."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.data = {}
+
+    def _alive(self, name):
+        entry = self.data.get(name)
+        if entry is not None and entry[1] <= self.clock.now:
+            del self.data[name]
+            return None
+        return entry
+
+    def get(self, name):
+        entry = self._alive(name)
+        return entry[0].encode('utf-8') if entry else None
+
+    def set(self, name, value, ex=None):
+        self.data[name] = (value, self.clock.now + ex if ex else float('inf'))
+
+    def expire(self, name, seconds):
+        entry = self._alive(name)
+        if entry:
+            self.data[name] = (entry[0], self.clock.now + seconds)
+
+    def delete(self, name):
+        self.data.pop(name, None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(session_store, 'time', clock)
+    return clock
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def store(request, clock, tmp_path):
+    if request.param == 'memory':
+        s = MemorySessionStore(ttl=10)
+    elif request.param == 'sqlite':
+        s = SQLiteSessionStore(tmp_path / 'sessions.sqlite', ttl=10)
+    else:
+        s = RedisSessionStore(FakeRedis(clock), ttl=10)
+    yield s
+    s.close()
+
+
+def test_base_class_requires_the_interface():
+    with pytest.raises(TypeError):
+        SessionStore(ttl=10)
+
+    class Incomplete(SessionStore):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete(ttl=10)
+
+
+def test_round_trip_and_delete(store):
+    store.set('a', 'uno')
+    assert store.get('a') == 'uno'
+    store.delete('a')
+    assert store.get('a') is None
+
+
+def test_ttl_is_sliding(store, clock):
+    store.set('a', 'uno')
+    clock.now += 8
+    assert store.get('a') == 'uno'   # la lectura renueva la expiración
+    clock.now += 8
+    assert store.get('a') == 'uno'
+    clock.now += 11
+    assert store.get('a') is None
+
+
+def test_expire_removes_stale_sessions(clock, tmp_path):
+    for s in (MemorySessionStore(ttl=10), SQLiteSessionStore(tmp_path / 's.sqlite', ttl=10)):
+        s.set('old', 'x')
+        clock.now += 5
+        s.set('new', 'y')
+        clock.now += 6
+        assert s.expire() == 1
+        assert s.get('new') == 'y'
+        s.close()
+
+
+def test_memory_store_evicts_least_recently_used(clock):
+    s = MemorySessionStore(ttl=10, max_entries=2)
+    s.set('a', 1)
+    s.set('b', 2)
+    s.get('a')
+    s.set('c', 3)
+    assert len(s) == 2
+    assert s.get('b') is None
+    assert s.get('a') == 1 and s.get('c') == 3
+
+
+def test_sweeper_expires_in_background():
+    s = MemorySessionStore(ttl=0.01)
+    s.set('a', 1)
+    sweeper = _ExpirySweeper(s, interval=0.01)
+    sweeper.start()
+    try:
+        deadline = time.monotonic() + 2
+        while len(s) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(s) == 0
+    finally:
+        sweeper.stop()
+
+
+def test_create_session_store_reads_the_environment(monkeypatch, tmp_path, clock):
+    monkeypatch.setenv('SESSION_TTL', '42')
+    monkeypatch.delenv('SESSION_STORE', raising=False)
+    assert isinstance(create_session_store(), MemorySessionStore)
+
+    monkeypatch.setenv('SESSION_STORE', 'sqlite')
+    monkeypatch.setenv('SESSION_DB_PATH', str(tmp_path / 'env.sqlite'))
+    s = create_session_store()
+    assert isinstance(s, SQLiteSessionStore) and s.ttl == 42 and s.path == tmp_path / 'env.sqlite'
+    s.close()
+
+    urls = []
+    fake_redis = types.SimpleNamespace(Redis=types.SimpleNamespace(from_url=lambda url: urls.append(url) or FakeRedis(clock)))
+    monkeypatch.setitem(sys.modules, 'redis', fake_redis)
+    monkeypatch.setenv('SESSION_STORE', 'redis')
+    monkeypatch.setenv('SESSION_REDIS_URL', 'redis://stub:6379/1')
+    assert isinstance(create_session_store(), RedisSessionStore)
+    assert urls == ['redis://stub:6379/1']
+
+    monkeypatch.setenv('SESSION_STORE', 'desconocido')
+    assert isinstance(create_session_store(), MemorySessionStore)
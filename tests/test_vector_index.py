@@ -0,0 +1,33 @@
+import numpy as np
+
+from src.vector_index import CURRENT_FILE, ResidentIndex, publish_index, read_current_version
+
+
+def _metas(n, tag):
+    return [{'source': f'{tag}-{i}', 'file': f'{tag}.md', 'text': f'{tag} {i}'} for i in range(n)]
+
+
+def test_resident_index_hot_swaps_to_the_published_version(tmp_path):
+    v1 = publish_index(np.eye(3, dtype=np.float32) * 2, _metas(3, 'a'), tmp_path)
+    index = ResidentIndex(tmp_path, check_interval=0)
+    old = index.get()
+    assert old.version == v1 and len(old) == 3
+    # los vectores se publican normalizados y se leen memory-mapped
+    assert np.allclose(np.linalg.norm(old.embeddings, axis=1), 1.0)
+    assert isinstance(old.embeddings, np.memmap)
+
+    v2 = publish_index(np.ones((2, 3), dtype=np.float32), _metas(2, 'b'), tmp_path)
+    new = index.get()
+    assert read_current_version(tmp_path) == v2
+    assert new.version == v2 and [m['source'] for m in new.metadatas] == ['b-0', 'b-1']
+    # quien aún tenga la versión anterior sigue leyendo una instantánea completa
+    assert old.version == v1 and len(old) == 3 and old.embeddings.shape == (3, 3)
+
+
+def test_broken_publication_keeps_the_previous_snapshot(tmp_path):
+    v1 = publish_index(np.eye(2, dtype=np.float32), _metas(2, 'a'), tmp_path)
+    index = ResidentIndex(tmp_path, check_interval=0)
+    assert index.get().version == v1
+
+    (tmp_path / CURRENT_FILE).write_text('version-inexistente', encoding='utf-8')
+    assert index.reload().version == v1
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from src.vector_search import normalize_rows, top_k_cosine
+
+
+def _brute_force(matrix, query, k):
+    # Referencia: la implementación por filas que reemplazó el motor vectorizado
+    q = np.asarray(query, dtype=np.float64)
+    q = q / np.linalg.norm(q)
+    scores = [float(np.dot(row, q)) for row in np.asarray(matrix, dtype=np.float64)]
+    order = sorted(range(len(scores)), key=lambda i: -scores[i])[:k]
+    return order, [scores[i] for i in order]
+
+
+@pytest.mark.parametrize('k', [1, 5, 50, 500])
+def test_top_k_matches_brute_force(k):
+    rng = np.random.default_rng(0)
+    matrix = normalize_rows(rng.normal(size=(300, 16)))
+    queries = rng.normal(size=(4, 16))
+    idx, scores = top_k_cosine(matrix, queries, k)
+    assert idx.shape == (4, min(k, 300))
+    for row, query in enumerate(queries):
+        expected_idx, expected_scores = _brute_force(matrix, query, k)
+        assert idx[row].tolist() == expected_idx
+        assert np.allclose(scores[row], expected_scores, atol=1e-5)
+        assert np.all(np.diff(scores[row]) <= 0)
+
+
+def test_single_query_zero_rows_and_dimension_mismatch():
+    matrix = normalize_rows([[1, 0], [0, 2], [0, 0]])
+    assert np.allclose(np.linalg.norm(matrix, axis=1), [1, 1, 0])
+    idx, scores = top_k_cosine(matrix, [1, 3], 2)
+    assert idx.tolist() == [[1, 0]] and np.allclose(scores, [[3 / 10 ** 0.5, 1 / 10 ** 0.5]])
+    assert top_k_cosine(matrix, [1, 0], 0)[0].shape == (1, 0)
+    with pytest.raises(ValueError):
+        top_k_cosine(matrix, [1, 0, 0], 1)